@@ -0,0 +1,482 @@
+"""
+Moteur d'agrégats en mémoire, optionnel (COLONIE_ANALYTICS=numpy) : les
+actions sont gardées en colonnes NumPy (robot, humain, scénario, catégorie
+d'action et résultat, codés en entiers) et les grilles du dashboard (par
+modèle, loi, secteur, vulnérabilité, catégorie d'action) sont calculées par
+np.bincount, sans requête SQL.
+
+Un thread rafraîchit l'instantané : seules les actions au-delà du plus grand
+id_action chargé sont lues. Robots, humains et scénarios sont relus quand une
+action en référence un inconnu, et tout est rechargé toutes les
+COLONIE_ANALYTICS_RELOAD secondes (modifications ou suppressions d'actions,
+changement de modèle d'un robot...) ou dès que le nombre d'actions ne
+correspond plus à la table compteurs.
+"""
+import functools
+import logging
+import os
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import psycopg2
+
+import codes
+from colonnes_actions import copier_actions, pourcentage
+from db import connecter
+from requetes import REQUETES
+
+log = logging.getLogger(__name__)
+
+MOTEUR = os.environ.get('COLONIE_ANALYTICS', 'sql')
+
+# mêmes libellés que les requêtes de requetes.py
+LOIS = {1: 'Loi 1: Protéger Vie', 2: 'Loi 2: Obéir Ordres', 3: 'Loi 3: Auto-Préservation'}
+LOIS_CONFLITS = {1: 'Loi 1 (Protéger Vie)', 2: 'Loi 2 (Obéir Ordres)', 3: 'Loi 3 (Auto-Préservation)'}
+LOIS_DECISIONS = {1: 'Urgence (Protéger Vie)', 2: 'Protocole (Obéir)', 3: 'Sécurité (Auto-Préserv.)'}
+
+SUCCES, MITIGUE, ECHEC = (codes.RESULTATS.index(r) for r in ('succes', 'mitigue', 'echec'))
+NB_RESULTATS = len(codes.RESULTATS)
+
+
+class Colonne:
+    """Tableau NumPy extensible : la capacité double, les vues déjà prises restent valides"""
+
+    def __init__(self, dtype, capacite=1024):
+        self._donnees = np.empty(capacite, dtype=dtype)
+        self.taille = 0
+
+    def ajouter(self, valeurs):
+        fin = self.taille + len(valeurs)
+        if fin > len(self._donnees):
+            donnees = np.empty(max(fin, 2 * len(self._donnees)), dtype=self._donnees.dtype)
+            donnees[:self.taille] = self._donnees[:self.taille]
+            self._donnees = donnees
+        self._donnees[self.taille:fin] = valeurs
+        self.taille = fin
+
+    def valeurs(self):
+        return self._donnees[:self.taille]
+
+
+class Dictionnaire:
+    """Codage des valeurs d'une catégorie en entiers 0, 1, 2... dans l'ordre d'arrivée"""
+
+    def __init__(self, valeurs=()):
+        self.valeurs = []
+        self._codes = {}
+        for valeur in valeurs:
+            self.code(valeur)
+
+    def code(self, valeur):
+        if valeur not in self._codes:
+            self._codes[valeur] = len(self.valeurs)
+            self.valeurs.append(valeur)
+        return self._codes[valeur]
+
+    def __len__(self):
+        return len(self.valeurs)
+
+
+class Referentiels:
+    """
+    Attributs des robots, humains et scénarios, en tableaux indexés par
+    identifiant : code de la catégorie, -1 pour un identifiant absent (et
+    pour 0, l'identifiant des actions sans robot, humain ou scénario)
+    """
+
+    def __init__(self, cur):
+        cur.execute("select id_robot, modele from robots")
+        robots = cur.fetchall()
+        self.modeles = Dictionnaire(sorted({m for _, m in robots}))
+        self.robot_modele = self._par_id(robots, self.modeles.code)
+
+        cur.execute("select id_humain, vulnerabilite, localisation from humains")
+        humains = cur.fetchall()
+        self.vulnerabilites = Dictionnaire(codes.VULNERABILITES)
+        self.humain_vulnerabilite = self._par_id([(i, v) for i, v, _ in humains], self.vulnerabilites.code)
+        self.secteurs = Dictionnaire()
+        self.humain_secteur = self._par_id([(i, s) for i, _, s in humains], self.secteurs.code)
+
+        cur.execute("select id_scenario, description, priorite_loi from scenarios order by priorite_loi, id_scenario")
+        self.scenarios = cur.fetchall()
+        self.scenario_loi = self._par_id([(i, loi) for i, _, loi in self.scenarios], int, vide=0)
+
+    @staticmethod
+    def _par_id(lignes, coder, vide=-1):
+        tableau = np.full(max((i for i, _ in lignes), default=0) + 1, vide, dtype=np.int64)
+        for identifiant, valeur in lignes:
+            tableau[identifiant] = coder(valeur)
+        return tableau
+
+    def couvre(self, robots, humains, scenarios):
+        """Tous les identifiants de ces colonnes sont connus"""
+        return all(len(ids) == 0 or ids.max() < len(tableau) for ids, tableau in (
+            (robots, self.robot_modele), (humains, self.humain_vulnerabilite),
+            (scenarios, self.scenario_loi)))
+
+
+def _compteurs(grille):
+    total, succes, mitiges, echecs = (int(grille.sum()), int(grille[SUCCES]),
+                                      int(grille[MITIGUE]), int(grille[ECHEC]))
+    return total, succes, mitiges, echecs
+
+
+class Instantane:
+    """
+    Colonnes des actions à une version des données. Les grilles sont
+    calculées à la première demande puis gardées avec l'instantané.
+    """
+
+    def __init__(self, version, id_max, colonnes, actions, referentiels):
+        self.version = version
+        self.id_max = id_max
+        self.robot, self.humain, self.scenario, self.action, self.resultat = colonnes
+        self.nb = len(self.resultat)
+        self.actions = actions
+        self.ref = referentiels
+        self.cree_le = time.monotonic()
+        self._resultats = {}
+
+    def resultat_de(self, nom):
+        if nom not in self._resultats:
+            self._resultats[nom] = CALCULS[nom](self)
+        return self._resultats[nom]
+
+    def _grille(self, cle, taille):
+        """Nombre d'actions par valeur de `cle` (entiers >= 0) et par résultat : (taille, 3)"""
+        return np.bincount(cle * NB_RESULTATS + self.resultat,
+                           minlength=taille * NB_RESULTATS).reshape(-1, NB_RESULTATS)[:taille]
+
+    @functools.cached_property
+    def par_robot(self):
+        return self._grille(self.robot, len(self.ref.robot_modele))
+
+    @functools.cached_property
+    def par_humain(self):
+        return self._grille(self.humain, len(self.ref.humain_vulnerabilite))
+
+    @functools.cached_property
+    def par_scenario(self):
+        return self._grille(self.scenario, len(self.ref.scenario_loi))
+
+    @functools.cached_property
+    def par_action(self):
+        return self._grille(self.action, len(self.actions))
+
+    def regrouper(self, grille, codes_par_id, taille):
+        """Grille par identifiant ramenée à une grille par catégorie (codes_par_id >= 0)"""
+        resultat = np.zeros((taille, NB_RESULTATS), dtype=np.int64)
+        connus = codes_par_id >= 0
+        np.add.at(resultat, codes_par_id[connus], grille[connus])
+        return resultat
+
+    @functools.cached_property
+    def par_modele(self):
+        return self.regrouper(self.par_robot, self.ref.robot_modele, len(self.ref.modeles))
+
+    @functools.cached_property
+    def par_vulnerabilite(self):
+        return self.regrouper(self.par_humain, self.ref.humain_vulnerabilite, len(self.ref.vulnerabilites))
+
+    @functools.cached_property
+    def par_secteur(self):
+        return self.regrouper(self.par_humain, self.ref.humain_secteur, len(self.ref.secteurs))
+
+    @functools.cached_property
+    def par_loi(self):
+        """{loi: grille} des actions qui ont un scénario"""
+        lois = {}
+        for id_scenario, _, loi in self.ref.scenarios:
+            lois[loi] = lois.get(loi, 0) + self.par_scenario[id_scenario]
+        return dict(sorted(lois.items()))
+
+
+def actions_par_resultat(inst):
+    total = inst.par_action.sum(axis=0)
+    return [{'resultat': r, 'count': int(total[i])} for i, r in enumerate(codes.RESULTATS) if total[i]]
+
+
+def performance_par_modele(inst):
+    lignes = []
+    for code, modele in enumerate(inst.ref.modeles.valeurs):
+        total, succes, mitiges, echecs = _compteurs(inst.par_modele[code])
+        lignes.append({'modele': modele, 'total_actions': total, 'succes': succes, 'mitiges': mitiges,
+                       'echecs': echecs, 'success_rate': pourcentage(succes, total)})
+    return sorted(lignes, key=lambda l: (l['success_rate'] is not None, l['success_rate'] or 0), reverse=True)
+
+
+def dilemmes_ethiques(inst):
+    lignes = []
+    for id_scenario, description, loi in inst.ref.scenarios:
+        total, succes, mitiges, echecs = _compteurs(inst.par_scenario[id_scenario])
+        lignes.append({'id_scenario': id_scenario, 'description': description, 'loi': loi,
+                       'times_faced': total, 'succes': succes, 'mitiges': mitiges, 'echecs': echecs,
+                       'taux_reussite': pourcentage(succes, total)})
+    return lignes
+
+
+def vulnerabilite_resultats(inst):
+    return [{'vulnerabilite': vulnerabilite, 'resultat': r, 'count': int(inst.par_vulnerabilite[code, i])}
+            for code, vulnerabilite in enumerate(inst.ref.vulnerabilites.valeurs)
+            for i, r in enumerate(codes.RESULTATS)
+            if inst.par_vulnerabilite[code, i]]
+
+
+def risques_par_secteur(inst):
+    lignes = []
+    for code, secteur in enumerate(inst.ref.secteurs.valeurs):
+        total, succes, _, echecs = _compteurs(inst.par_secteur[code])
+        if total:
+            lignes.append({'secteur': secteur, 'actions': total, 'succes': succes, 'echecs': echecs,
+                           'taux_reussite': pourcentage(succes, total)})
+    return sorted(lignes, key=lambda l: l['taux_reussite'], reverse=True)
+
+
+def categories_actions(inst):
+    lignes = []
+    for code, categorie in enumerate(inst.actions.valeurs[:len(inst.par_action)]):
+        total, succes, mitiges, echecs = _compteurs(inst.par_action[code])
+        if total:
+            lignes.append({'categorie': categorie, 'total': total, 'succes': succes, 'mitiges': mitiges,
+                           'echecs': echecs, 'taux_reussite': pourcentage(succes, total)})
+    return sorted(lignes, key=lambda l: l['taux_reussite'], reverse=True)
+
+
+def complexite_ethique(inst):
+    lois = {}
+    for id_scenario, _, loi in inst.ref.scenarios:
+        nb_scenarios, tentatives = lois.get(loi, (0, 0))
+        lois[loi] = (nb_scenarios + 1, tentatives + int(inst.par_scenario[id_scenario].sum()))
+    return [{'loi': loi, 'loi_nom': LOIS.get(loi), 'scenario_count': nb_scenarios,
+             'total_attempts': tentatives}
+            for loi, (nb_scenarios, tentatives) in sorted(lois.items())]
+
+
+def reussite_par_loi(inst):
+    lignes = []
+    for loi, grille in inst.par_loi.items():
+        total, succes, mitiges, echecs = _compteurs(grille)
+        if total:
+            lignes.append({'loi': loi, 'loi_nom': LOIS.get(loi), 'total_actions': total, 'succes': succes,
+                           'mitiges': mitiges, 'echecs': echecs, 'pourcent_succes': pourcentage(succes, total)})
+    return lignes
+
+
+def impact_vulnerabilite(inst):
+    lignes = []
+    for code, vulnerabilite in enumerate(inst.ref.vulnerabilites.valeurs):
+        total, succes, mitiges, echecs = _compteurs(inst.par_vulnerabilite[code])
+        if total:
+            lignes.append({'vulnerabilite': vulnerabilite, 'actions_total': total, 'succes': succes,
+                           'mitiges': mitiges, 'echecs': echecs, 'taux_reussite': pourcentage(succes, total)})
+    return lignes
+
+
+def analyse_ethique_secteurs(inst):
+    # scénarios distincts par secteur : présence de chaque couple (secteur, scénario)
+    nb_scenarios = len(inst.ref.scenario_loi)
+    secteur = inst.ref.humain_secteur[inst.humain]
+    garde = (secteur >= 0) & (inst.scenario > 0)
+    couples = np.bincount(secteur[garde] * nb_scenarios + inst.scenario[garde],
+                          minlength=len(inst.ref.secteurs) * nb_scenarios)
+    distincts = (couples.reshape(-1, nb_scenarios) > 0).sum(axis=1)
+    lignes = []
+    for code, nom in enumerate(inst.ref.secteurs.valeurs):
+        total, succes, mitiges, echecs = _compteurs(inst.par_secteur[code])
+        if total:
+            lignes.append({'secteur': nom, 'scenarios_distincts': int(distincts[code]),
+                           'total_actions': total, 'succes': succes, 'mitiges': mitiges,
+                           'echecs': echecs, 'taux_reussite': pourcentage(succes, total)})
+    return sorted(lignes, key=lambda l: l['taux_reussite'], reverse=True)
+
+
+def conflits_de_lois(inst):
+    dilemmes = {}
+    for id_scenario, _, loi in inst.ref.scenarios:
+        dilemmes[loi] = dilemmes.get(loi, 0) + bool(inst.par_scenario[id_scenario].any())
+    lignes = []
+    for loi, grille in inst.par_loi.items():
+        total, succes, _, _ = _compteurs(grille)
+        if total:
+            lignes.append({'loi_principale': LOIS_CONFLITS.get(loi), 'dilemmes_identifiés': dilemmes[loi],
+                           'actions_liees': total, 'resolution_rate': pourcentage(succes, total)})
+    return lignes
+
+
+def decisions_par_loi(inst):
+    return [{'loi': loi, 'categorie_decision': LOIS_DECISIONS.get(loi), 'decisions': int(grille.sum())}
+            for loi, grille in inst.par_loi.items() if grille.sum()]
+
+
+# requêtes de requetes.py calculées en mémoire (mêmes colonnes, même ordre)
+CALCULS = {
+    'actions-results': actions_par_resultat,
+    'performance-by-model': performance_par_modele,
+    'ethical-dilemmas': dilemmes_ethiques,
+    'vulnerability-vs-outcomes': vulnerabilite_resultats,
+    'sector-risk-analysis': risques_par_secteur,
+    'action-categories': categories_actions,
+    'ethical-complexity': complexite_ethique,
+    'dilemma-success-by-law': reussite_par_loi,
+    'vulnerability-impact': impact_vulnerabilite,
+    'sector-ethical-analysis': analyse_ethique_secteurs,
+    'law-conflict-analysis': conflits_de_lois,
+    'time-execution-patterns': decisions_par_loi,
+}
+
+
+class MoteurAnalytique:
+    """
+    Tient l'instantané à jour dans un thread, toutes les `intervalle`
+    secondes au plus. `calculer()` renvoie None (la requête passe alors par
+    PostgreSQL) tant que rien n'est chargé, ou quand `version_courante()`
+    annonce des données plus récentes que l'instantané.
+    """
+
+    def __init__(self, intervalle=1.0, rechargement=300.0, version_courante=None):
+        self.intervalle = intervalle
+        self.rechargement = rechargement
+        self.version_courante = version_courante or (lambda: None)
+        self.instantane = None
+        self._thread = None
+        self._verrou = threading.Lock()
+        self._reveil = threading.Event()
+        self._arret = threading.Event()
+        self._colonnes = None
+        self._actions = None
+        self._ref = None
+        self._decalage = 0         # actions de la table compteurs - actions chargées
+        self._complet_le = 0.0
+        self.stats = {'rafraichissements': 0, 'rechargements': 0, 'erreurs': 0, 'calculs': 0,
+                      'repli_sql': 0, 'dernier_rafraichissement_ms': 0.0}
+
+    def demarrer(self):
+        """Lance le thread, ou un nouveau s'il s'est arrêté sur une erreur"""
+        with self._verrou:
+            if (self._thread is None or not self._thread.is_alive()) and not self._arret.is_set():
+                self._thread = threading.Thread(target=self.run, name='analytique', daemon=True)
+                self._thread.start()
+
+    def arreter(self):
+        self._arret.set()
+        self._reveil.set()
+
+    def run(self):
+        while not self._arret.is_set():
+            try:
+                self.rafraichir()
+            except psycopg2.Error as error:
+                self.stats['erreurs'] += 1
+                log.warning('instantané analytique non rafraîchi : %s', error)
+            except Exception:
+                # le prochain rafraîchissement repart d'un chargement complet
+                self.stats['erreurs'] += 1
+                self._complet_le = float('-inf')
+                log.exception('instantané analytique non rafraîchi')
+            self._reveil.wait(self.intervalle)
+            self._reveil.clear()
+
+    def calculer(self, nom, params):
+        self.demarrer()
+        inst = self.instantane
+        version = self.version_courante()
+        if inst is None or params or (version is not None and inst.version < version):
+            self.stats['repli_sql'] += 1
+            self._reveil.set()
+            return None
+        self.stats['calculs'] += 1
+        return inst.resultat_de(nom)
+
+    def _copier(self, cur, actions, id_min):
+        """Actions d'id_action > id_min : tableau (n, 6) d'entiers, catégories codées par `actions`"""
+        cur.execute("select distinct action from actions where id_action > %s", (id_min,))
+        nouvelles = [action for action, in cur.fetchall()]
+        return copier_actions(cur, nouvelles, [actions.code(a) for a in nouvelles],
+                              'a.id_action > %s', (id_min,))
+
+    def rafraichir(self):
+        """Lit les nouvelles actions (tout, si nécessaire) ; renvoie True si l'instantané a changé"""
+        debut = time.perf_counter()
+        # un rechargement se construit à part : en cas d'erreur, l'état
+        # précédent reste celui du prochain rafraîchissement
+        actions, ref, colonnes = self._actions, self._ref, self._colonnes
+        conn = connecter()
+        try:
+            conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            cur = conn.cursor()
+            cur.execute("select version from version_donnees")
+            version, = cur.fetchone()
+            inst = self.instantane
+            complet = inst is None or time.monotonic() - self._complet_le > self.rechargement
+            if not complet and version == inst.version:
+                return False
+            cur.execute("select coalesce(sum(valeur), 0) from compteurs where categorie = 'actions'")
+            total, = cur.fetchone()
+
+            if not complet:
+                lignes = self._copier(cur, actions, inst.id_max)
+                complet = total - (inst.nb + len(lignes)) != self._decalage
+            if complet:
+                actions = Dictionnaire()
+                ref = Referentiels(cur)
+                colonnes = [Colonne(np.int32) for _ in range(4)] + [Colonne(np.int8)]
+                lignes = self._copier(cur, actions, 0)
+            elif not ref.couvre(*(lignes[:, k] for k in (1, 2, 3))):
+                ref = Referentiels(cur)
+            conn.rollback()
+        finally:
+            conn.close()
+
+        if complet:
+            self._decalage = total - len(lignes)
+            if self._decalage:
+                log.warning('compteurs : %s actions, %s lues ; reconcile-counters ?', total, len(lignes))
+            self._complet_le = time.monotonic()
+            self.stats['rechargements'] += 1
+        for colonne, k in zip(colonnes, range(1, 6)):
+            colonne.ajouter(lignes[:, k])
+        self._actions, self._ref, self._colonnes = actions, ref, colonnes
+        id_max = int(lignes[:, 0].max()) if len(lignes) else (0 if complet else inst.id_max)
+        self.instantane = Instantane(version, id_max, [c.valeurs() for c in colonnes], actions, ref)
+        self.stats['rafraichissements'] += 1
+        self.stats['dernier_rafraichissement_ms'] = round((time.perf_counter() - debut) * 1000, 1)
+        return True
+
+    def etat(self):
+        inst = self.instantane
+        return {'lignes': inst.nb if inst else 0,
+                'version': inst.version if inst else None,
+                'age_s': round(time.monotonic() - inst.cree_le, 1) if inst else None,
+                **self.stats}
+
+
+_moteur = None
+_verrou = threading.Lock()
+
+
+def installer(version_courante=None):
+    """
+    Avec COLONIE_ANALYTICS=numpy, branche le moteur sur les requêtes de
+    CALCULS et le renvoie (démarré au premier calcul) ; None sinon
+    """
+    global _moteur
+    if MOTEUR != 'numpy':
+        return None
+    if np is None:
+        log.warning('COLONIE_ANALYTICS=numpy mais NumPy est absent : agrégats calculés par PostgreSQL')
+        return None
+    with _verrou:
+        if _moteur is None:
+            _moteur = MoteurAnalytique(
+                intervalle=float(os.environ.get('COLONIE_ANALYTICS_INTERVAL', 1)),
+                rechargement=float(os.environ.get('COLONIE_ANALYTICS_RELOAD', 300)),
+                version_courante=version_courante,
+            )
+            for nom in CALCULS:
+                REQUETES[nom].calcul = functools.partial(_moteur.calculer, nom)
+        return _moteur
@@ -1,23 +1,268 @@
-from flask import Flask, jsonify, render_template
+from flask import Flask, jsonify, render_template, g, request
+import base64
+import click
+import concurrent.futures
+import csv
+import functools
+import hashlib
+import io
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+from psycopg2 import sql
+import queue
 import json
-from datetime import datetime
+import threading
+import time
+from datetime import date, datetime, timezone
 import os
 
+from cache import CacheReponses, EntreeCache
+import analytique
+import codes
+from evenements import Diffuseur, KEEPALIVE, RESYNC
+import ingestion
+from ingestion import ActionsInvalides, EcritureIndisponible, TamponPlein
+from db import connecter, demarrer_ecouteur, get_ecouteur, get_pool, get_routeur, PoolEpuise
+from metrics import (CurseurInstrumente, CurseurTuplesInstrumente, exposer, instrumenter,
+                     mesurer_phase, metriques_etat)
+import reponses
+import simulation
+from requetes import REQUETES, VolUnique
+
 app = Flask(__name__, template_folder='templates', static_folder='static')
+instrumenter(app)
 
-def get_db():
-    password = os.environ.get('POSTGRES_PASSWORD', 'ulysse')
-    conn = psycopg2.connect(
-        host="localhost",
-        database="colonie",
-        user="postgres",
-        password=password
-    )
-    conn.set_client_encoding('UTF8')
+def get_db(lecture=False, fraicheur=None):
+    """
+    Emprunte une connexion au pool partagé ; conn.close() la rend. Une
+    lecture peut être servie par un réplica en retard d'au plus `fraicheur`
+    secondes (COLONIE_REPLICA_MAX_LAG par défaut, voir db.Routeur).
+    """
+    with mesurer_phase('connexion'):
+        conn = get_routeur().acquerir(fraicheur) if lecture else get_pool().acquerir()
+    g.setdefault('connexions', []).append(conn)
+    if lecture and conn.pool is not get_pool():
+        # lue avant les données : le réplica contient au moins cette version
+        cur = conn.cursor()
+        cur.execute("select version from version_donnees")
+        _noter_version_lue(cur.fetchone()[0])
+        cur.close()
+        conn.rollback()
     return conn
 
+def _noter_version_lue(version):
+    """
+    Retient la plus ancienne version_donnees vue par les lectures sur réplica
+    de la requête HTTP : cached() ne met pas en cache une réponse plus
+    ancienne que la version du primaire
+    """
+    if version is not None:
+        g.version_lue = min(version, g.get('version_lue', version))
+
+@app.teardown_appcontext
+def rendre_connexions(exc):
+    # une route qui lève une exception ne passe pas par conn.close()
+    for conn in g.pop('connexions', []):
+        conn.close()
+
+@app.errorhandler(PoolEpuise)
+def pool_epuise(error):
+    response = jsonify({'error': 'base de données saturée, réessayez', 'detail': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+class ParametreInvalide(ValueError):
+    """Paramètre de requête invalide : réponse 400"""
+
+@app.errorhandler(ParametreInvalide)
+def parametre_invalide(error):
+    response = jsonify({'error': str(error)})
+    response.status_code = 400
+    return response
+
+def _param_int(args, nom, defaut=None, maximum=None):
+    valeur = args.get(nom)
+    if not valeur:
+        return defaut
+    try:
+        valeur = int(valeur)
+    except ValueError:
+        raise ParametreInvalide(f'{nom} doit être un entier')
+    if valeur < 1 or (maximum and valeur > maximum):
+        raise ParametreInvalide(f'{nom} doit être compris entre 1 et {maximum or "∞"}')
+    return valeur
+
+def _param_colonnes(args):
+    """?format=columns : réponse au format colonnes (reponses.py) ; rows par défaut"""
+    format = args.get('format') or 'rows'
+    if format not in ('rows', 'columns'):
+        raise ParametreInvalide('format rows ou columns')
+    return format == 'columns'
+
+def _param_date(args, nom):
+    try:
+        return datetime.fromisoformat(args[nom])
+    except ValueError:
+        raise ParametreInvalide(f'{nom} doit être une date ISO 8601')
+
+def encoder_curseur(timestamp, id_action):
+    texte = f'{timestamp.isoformat()}|{id_action}'
+    return base64.urlsafe_b64encode(texte.encode()).decode().rstrip('=')
+
+def decoder_curseur(curseur):
+    try:
+        texte = base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4)).decode()
+        timestamp, id_action = texte.split('|')
+        return datetime.fromisoformat(timestamp), int(id_action)
+    except (ValueError, UnicodeDecodeError):
+        raise ParametreInvalide('cursor invalide')
+
+cache = CacheReponses(
+    max_entrees=int(os.environ.get('COLONIE_CACHE_MAX_ENTRIES', 512)),
+    max_octets=int(os.environ.get('COLONIE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+)
+_cache_verrou = threading.Lock()
+_cache_demarre = False
+
+# agrégats en mémoire (COLONIE_ANALYTICS=numpy) : un instantané plus ancien
+# que la version connue du cache n'est pas servi
+moteur_analytique = analytique.installer(lambda: cache.version if cache.actif else None)
+
+def _version_depuis_base(conn):
+    cur = conn.cursor()
+    cur.execute("select version, extract(epoch from modifie_le) from version_donnees")
+    version, epoch = cur.fetchone()
+    cur.close()
+    cache.activer(version, datetime.fromtimestamp(float(epoch), timezone.utc))
+
+def _donnees_modifiees(canal, payload):
+    version, epoch = payload.split()
+    cache.nouvelle_version(int(version), datetime.fromtimestamp(float(epoch), timezone.utc))
+
+def _demarrer_cache():
+    """Abonne le cache aux NOTIFY de script.sql (une fois par processus)"""
+    global _cache_demarre
+    if _cache_demarre or os.environ.get('COLONIE_CACHE', '1') == '0':
+        return
+    with _cache_verrou:
+        if not _cache_demarre:
+            get_ecouteur().abonner('colonie_modifications', _donnees_modifiees,
+                                   a_la_connexion=_version_depuis_base,
+                                   a_la_deconnexion=cache.desactiver)
+            demarrer_ecouteur()
+            _cache_demarre = True
+
+def cached(ttl):
+    """
+    Met en cache la réponse de la route (clé : chemin + query string) pendant
+    `ttl` secondes au plus, et la renvoie avec ETag/Last-Modified : un client
+    qui a déjà la bonne version reçoit un 304 sans corps. Un corps volumineux
+    est mis en cache compressé dans l'encodage accepté par le client (gzip ou
+    br, voir reponses.py).
+    """
+    def decorateur(vue):
+        @functools.wraps(vue)
+        def route(*args, **kwargs):
+            _demarrer_cache()
+            actif, version, modifie_le = cache.actif, cache.version, cache.modifie_le
+            encodage = reponses.encodage_accepte(request.headers.get('Accept-Encoding'))
+            cle = request.full_path if encodage is None else f'{request.full_path} {encodage}'
+            entree = cache.lire(request.endpoint, cle) if actif else None
+            if entree is not None:
+                statut_cache = 'HIT'
+            else:
+                response = app.make_response(vue(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                corps, encodage = reponses.compresser(response.get_data(), encodage)
+                entree = EntreeCache(corps, response.mimetype,
+                                     hashlib.blake2b(corps, digest_size=16).hexdigest(),
+                                     modifie_le, time.monotonic() + ttl, version, encodage)
+                # lue sur un réplica en retard : servie, mais pas gardée sous
+                # la version du primaire qu'elle ne contient pas encore
+                a_jour = g.get('version_lue', version) >= version if actif else False
+                if a_jour:
+                    cache.ecrire(cle, entree)
+                statut_cache = 'MISS' if a_jour else 'BYPASS'
+            response = app.response_class(entree.corps, mimetype=entree.mimetype)
+            response.headers['X-Cache'] = statut_cache
+            if entree.encodage:
+                response.headers['Content-Encoding'] = entree.encodage
+            response.vary.add('Accept-Encoding')
+            response.set_etag(entree.etag)
+            if entree.modifie_le:
+                response.last_modified = entree.modifie_le
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+        return route
+    return decorateur
+
+DASHBOARD_QUERIES = {}
+BATCH_MAX = 20
+TIMELINE_MAX = 500
+vol_unique = VolUnique()
+
+class RequeteDashboard:
+    """
+    Route du dashboard : une requête du registre (requetes.py), ses paramètres
+    lus dans la query string (`parametres(args)`) et la mise en forme du
+    résultat. Appelée avec un curseur, elle renvoie les données de la requête
+    HTTP en cours (c'est ce qu'utilise /api/batch). Au format colonnes,
+    `resultat` reçoit et renvoie des données au format colonnes. Un réplica
+    en retard de plus de `fraicheur` secondes (le TTL par défaut) n'est pas
+    utilisé.
+    """
+    def __init__(self, requete, ttl, parametres=None, resultat=None, fraicheur=None):
+        self.requete = REQUETES[requete]
+        self.ttl = ttl
+        self.fraicheur = ttl if fraicheur is None else fraicheur
+        self.parametres = parametres or (lambda args: {})
+        self.resultat = resultat or (lambda lignes, params: lignes)
+
+    def __call__(self, cur, colonnes=False):
+        params = self.parametres(request.args)
+        return self.resultat(self.requete.executer(cur, params, colonnes), params)
+
+def executer_requete(nom):
+    """
+    Les appels simultanés d'une même requête avec les mêmes paramètres
+    partagent une seule exécution sur PostgreSQL
+    """
+    route = DASHBOARD_QUERIES[nom]
+    params = route.parametres(request.args)
+    colonnes = _param_colonnes(request.args)
+    def executer():
+        lignes = route.requete.en_memoire(params)
+        if lignes is not None:
+            return (reponses.en_colonnes(lignes) if colonnes else lignes), None
+        conn = get_db(lecture=True, fraicheur=route.fraicheur)
+        cur = conn.cursor(cursor_factory=CurseurTuplesInstrumente if colonnes else CurseurInstrumente)
+        lignes = route.requete.executer(cur, params, colonnes)
+        cur.close()
+        conn.close()
+        return lignes, g.get('version_lue')
+    cle = (route.requete.nom, tuple(sorted(params.items())), colonnes)
+    # les appels coalescés reçoivent aussi la version lue par celui qui a exécuté
+    lignes, version_lue = vol_unique.executer(cle, executer)
+    _noter_version_lue(version_lue)
+    return route.resultat(lignes, params)
+
+def reponse_donnees(donnees):
+    """jsonify(), ou le JSON compact de reponses.py au format colonnes"""
+    if not _param_colonnes(request.args):
+        return jsonify(donnees)
+    with mesurer_phase('json'):
+        corps = reponses.corps_json(donnees)
+    return app.response_class(corps, mimetype='application/json')
+
+def dashboard_route(nom, requete, ttl, parametres=None, resultat=None, fraicheur=None):
+    """Expose la requête `requete` du registre sur /api/<nom> et dans /api/batch"""
+    DASHBOARD_QUERIES[nom] = RequeteDashboard(requete, ttl, parametres, resultat, fraicheur)
+    def route():
+        return reponse_donnees(executer_requete(nom))
+    app.add_url_rule(f'/api/{nom}', nom.replace('-', '_'), cached(ttl)(route))
+
 def dict_from_row(row):
     """Convertir RealDictRow en dict"""
     if isinstance(row, dict):
@@ -26,510 +271,492 @@ def dict_from_row(row):
 
 @app.route('/')
 def index():
-    return render_template('dashboard.html')
-
-@app.route('/api/global-stats')
-def global_stats():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cur.execute("""
-        select 
-            (select count(*) from actions) as total_actions,
-            (select count(*) from robots) as total_robots,
-            (select count(*) from robots where etat = 'actif') as active_robots,
-            (select count(*) from robots where etat = 'hors_service') as inactive_robots,
-            (select count(*) from robots where etat = 'en_panne') as broken_robots,
-            (select count(*) from humains) as total_humains,
-            (select count(*) from scenarios) as total_scenarios,
-            (select count(*) from actions where resultat = 'succes') as total_succes,
-            (select count(*) from actions where resultat = 'mitigue') as total_mitiges,
-            (select count(*) from actions where resultat = 'echec') as total_echecs,
-            round(100.0 * (select count(*) from actions where resultat = 'succes') / 
-                  nullif((select count(*) from actions), 0), 2) as success_rate
-    """)
-    stats = cur.fetchone()
+    return render_template('dashboard.html', libelles=codes.libelles())
+
+@app.route('/api/pool-stats')
+def pool_stats():
+    return jsonify({**get_pool().etat(), 'routage': get_routeur().etat()})
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    return jsonify(cache.etat())
+
+# valeurs cumulées depuis le démarrage (counter) de chaque état exposé sur /metrics,
+# les autres sont des jauges
+COMPTEURS_METRIQUES = {
+    'colonie_pool': ('emprunts', 'attentes', 'epuisements', 'recyclees', 'cassees'),
+    'colonie_cache': ('hits', 'misses', 'evictions', 'invalidations', 'non_cachees'),
+    'colonie_single_flight': ('executions', 'partages'),
+    'colonie_ingestion': ('recues', 'ecrites', 'rejetees', 'refusees', 'copies', 'erreurs'),
+    'colonie_analytique': ('rafraichissements', 'rechargements', 'erreurs', 'calculs', 'repli_sql'),
+    'colonie_simulation': ('calculs', 'memo', 'chargements'),
+    'colonie_replicas': ('lectures_replicas', 'lectures_primaire', 'replis_retard',
+                         'replis_indisponible'),
+}
+
+@app.route('/metrics')
+def metrics():
+    """Métriques au format texte de Prometheus"""
+    etat_cache = cache.etat()
+    etat_cache.pop('version_donnees', None)
+    etats = [
+        ('colonie_pool', 'État du pool de connexions (voir /api/pool-stats)', get_pool().etat()),
+        ('colonie_cache', 'État du cache des réponses (voir /api/cache-stats)', etat_cache),
+        ('colonie_single_flight', 'Exécutions de requêtes et appels coalescés', vol_unique.etat()),
+        ('colonie_ingestion', "Tampon d'écriture de POST /api/actions", ingestion.get_tampon().etat()),
+        ('colonie_analytique', 'Instantané des agrégats en mémoire (COLONIE_ANALYTICS)',
+         moteur_analytique.etat() if moteur_analytique else {}),
+        ('colonie_simulation', 'Simulations calculées et servies par mémoïsation',
+         simulation.get_simulateur().etat()),
+        ('colonie_replicas', 'Lectures sur les réplicas et retard de réplication (COLONIE_REPLICAS)',
+         get_routeur().resume()),
+    ]
+    texte = exposer(*(metriques_etat(nom, aide, valeurs, COMPTEURS_METRIQUES[nom])
+                      for nom, aide, valeurs in etats))
+    return app.response_class(texte, mimetype='text/plain; version=0.0.4')
+
+def parametres_timeline(args):
+    """
+    Historique des actions, du plus récent au plus ancien, paginé par curseur
+    sur (timestamp, id_action) : ?cursor=<next_cursor de la page précédente>.
+    Filtres : robot, scenario, loi, resultat, from, to (ISO 8601) ; limit <= 500.
+    """
+    params = {'limit': _param_int(args, 'limit', 50, maximum=TIMELINE_MAX)}
+    for nom in ('robot', 'scenario', 'loi'):
+        if args.get(nom):
+            params[nom] = _param_int(args, nom)
+    if args.get('resultat'):
+        params['resultat'] = codes.code('resultat_action', args['resultat'])
+        if params['resultat'] is None:
+            raise ParametreInvalide(f"resultat parmi {', '.join(codes.RESULTATS)}")
+    if args.get('from'):
+        params['depuis'] = _param_date(args, 'from')
+    if args.get('to'):
+        params['jusqua'] = _param_date(args, 'to')
+    if args.get('cursor'):
+        params['curseur_ts'], params['curseur_id'] = decoder_curseur(args['cursor'])
+    return params
+
+def page_timeline(items, params):
+    if isinstance(items, dict):     # ?format=columns
+        colonnes = reponses.selection(items, ('timestamp', 'id_action'))
+        timestamps, ids = colonnes['timestamp'], colonnes['id_action']
+    else:
+        timestamps, ids = [i['timestamp'] for i in items], [i['id_action'] for i in items]
+    suivant = None
+    if len(ids) == params['limit']:
+        suivant = encoder_curseur(timestamps[-1], ids[-1])
+    return {'items': items, 'next_cursor': suivant}
+
+SERIES_PAS = {'hour': 'hour', 'day': 'day', 'week': 'day'}
+SERIES_AXES = {'model': 'modele', 'law': 'loi', 'sector': 'secteur'}
+
+def parametres_timeseries(args):
+    """
+    Succès, mitigés et échecs par seau de temps : bucket (hour, day, week ;
+    day par défaut), group (model, law, sector ; model par défaut), from, to
+    (ISO 8601). Lu dans series_actions, tenue à jour par triggers.
+    """
+    bucket = args.get('bucket') or 'day'
+    groupe = args.get('group') or 'model'
+    if bucket not in SERIES_PAS:
+        raise ParametreInvalide(f"bucket parmi {', '.join(SERIES_PAS)}")
+    if groupe not in SERIES_AXES:
+        raise ParametreInvalide(f"group parmi {', '.join(SERIES_AXES)}")
+    params = {'bucket': bucket, 'pas': SERIES_PAS[bucket], 'axe': SERIES_AXES[groupe]}
+    if args.get('from'):
+        params['depuis'] = _param_date(args, 'from')
+    if args.get('to'):
+        params['jusqua'] = _param_date(args, 'to')
+    return params
+
+DIFFICULTE_COLONNES = {'description': 'description', 'loi': 'loi', 'times_faced': 'total_actions',
+                       'succes': 'succes', 'taux_reussite': 'taux_reussite'}
+
+def difficulte_scenarios(dilemmes, params):
+    """scenario-difficulty : colonnes de ethical-dilemmas, sans nouvelle requête"""
+    if isinstance(dilemmes, dict):      # ?format=columns
+        colonnes = reponses.selection(dilemmes, DIFFICULTE_COLONNES)
+        return {'colonnes': list(DIFFICULTE_COLONNES.values()), 'valeurs': list(colonnes.values())}
+    return [{nouveau: d[ancien] for ancien, nouveau in DIFFICULTE_COLONNES.items()} for d in dilemmes]
+
+def parametres_recommandations(args):
+    """
+    Recommandations par scénario : min_echecs (1 par défaut), loi et
+    recommandation (texte exact, voir seuils_recommandations) optionnels
+    """
+    params = {'min_echecs': _param_int(args, 'min_echecs', 1)}
+    if args.get('loi'):
+        params['loi'] = _param_int(args, 'loi', maximum=3)
+    if args.get('recommandation'):
+        params['recommandation'] = args['recommandation']
+    return params
+
+dashboard_route('global-stats', 'global-stats', ttl=10)
+dashboard_route('robots-status', 'robots-status', ttl=60)
+dashboard_route('actions-results', 'actions-results', ttl=60)
+dashboard_route('humains-vulnerability', 'humains-vulnerability', ttl=300)
+dashboard_route('sectors-distribution', 'sectors-distribution', ttl=300)
+dashboard_route('timeline', 'timeline', ttl=5, parametres=parametres_timeline, resultat=page_timeline)
+dashboard_route('performance-by-model', 'performance-by-model', ttl=60)
+dashboard_route('scenario-difficulty', 'ethical-dilemmas', ttl=60, resultat=difficulte_scenarios)
+dashboard_route('ethical-dilemmas', 'ethical-dilemmas', ttl=60)
+dashboard_route('vulnerability-vs-outcomes', 'vulnerability-vs-outcomes', ttl=60)
+dashboard_route('robot-specialization', 'robot-specialization', ttl=60)
+dashboard_route('scenarios-by-priority', 'scenarios-by-priority', ttl=300)
+dashboard_route('sector-risk-analysis', 'sector-risk-analysis', ttl=60)
+dashboard_route('action-categories', 'action-categories', ttl=60)
+dashboard_route('ethical-complexity', 'ethical-complexity', ttl=60)
+dashboard_route('robot-specialization-detailed', 'robot-specialization', ttl=60)
+dashboard_route('dilemma-success-by-law', 'dilemma-success-by-law', ttl=60)
+dashboard_route('vulnerability-impact', 'vulnerability-impact', ttl=60)
+dashboard_route('sector-ethical-analysis', 'sector-ethical-analysis', ttl=60)
+dashboard_route('law-conflict-analysis', 'law-conflict-analysis', ttl=60)
+dashboard_route('robot-ethical-maturity', 'robot-ethical-maturity', ttl=60)
+dashboard_route('time-execution-patterns', 'time-execution-patterns', ttl=60)
+dashboard_route('timeseries', 'timeseries', ttl=60, parametres=parametres_timeseries)
+dashboard_route('recommendations', 'recommendations', ttl=60, parametres=parametres_recommandations)
+
+@app.cli.command('reconcile-counters')
+@click.option('--check', is_flag=True, help="Signale les écarts sans corriger la table compteurs")
+def reconcile_counters(check):
+    """Recalcule la table compteurs depuis les tables et affiche les écarts"""
+    conn = connecter()
+    cur = conn.cursor()
+    cur.execute("select * from reconcilier_compteurs(%s)", (not check,))
+    ecarts = cur.fetchall()
+    conn.commit()
     cur.close()
     conn.close()
-    return jsonify(dict(stats) if stats else {})
-
-@app.route('/api/robots-status')
-def robots_status():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select modele, etat, count(*) as count
-        from robots
-        group by modele, etat
-        order by modele, etat
-    """)
-    data = cur.fetchall()
+    for categorie, cle, compteur, reel in ecarts:
+        click.echo(f"{categorie:<18} {cle:<15} compteur={compteur} réel={reel} écart={compteur - reel}")
+    if not ecarts:
+        click.echo("Aucun écart : les compteurs sont à jour")
+    elif check:
+        raise SystemExit(1)
+    else:
+        click.echo(f"{len(ecarts)} compteur(s) corrigé(s)")
+
+@app.cli.command('partitions')
+@click.option('--mois-avance', default=3, show_default=True,
+              help="Mois à venir dont les partitions doivent exister")
+@click.option('--retention-mois', type=int, default=None,
+              help="Détache les mois terminés depuis plus de N mois (défaut : aucun)")
+@click.option('--supprimer', is_flag=True, help="Supprime les partitions détachées au lieu de les garder")
+def partitions(mois_avance, retention_mois, supprimer):
+    """Crée les partitions mensuelles à venir de actions et détache les anciennes"""
+    conn = connecter()
+    cur = conn.cursor()
+    cur.execute("select * from maintenir_partitions_actions(%s, %s, %s)",
+                (mois_avance, retention_mois, supprimer))
+    operations = cur.fetchall()
+    conn.commit()
     cur.close()
     conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/actions-results')
-def actions_results():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select resultat, count(*) as count
+    for nom, operation in operations:
+        click.echo(f"{nom:<18} {operation}")
+    if not operations:
+        click.echo("Partitions à jour")
+
+EXPORTS = {
+    'actions': """
+        select id_action, id_robot, id_humain, id_scenario, action, timestamp, resultat
         from actions
-        group by resultat
-        order by resultat
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/humains-vulnerability')
-def humains_vulnerability():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select vulnerabilite, count(*) as count
-        from humains
-        group by vulnerabilite
-        order by case vulnerabilite
-            when 'faible' then 1
-            when 'moyenne' then 2
-            when 'elevee' then 3
-        end
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/sectors-distribution')
-def sectors_distribution():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select localisation as secteur, count(*) as count
-        from humains
-        group by localisation
-        order by count desc
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/timeline')
-def timeline():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            a.timestamp,
-            a.action,
-            a.resultat,
-            r.nom_robot,
-            h.nom,
-            s.description
-        from actions a
-        left join robots r on a.id_robot = r.id_robot
-        left join humains h on a.id_humain = h.id_humain
-        left join scenarios s on a.id_scenario = s.id_scenario
-        order by a.timestamp desc
-        limit 50
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/performance-by-model')
-def performance_by_model():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            r.modele,
-            count(*) as total_actions,
-            count(*) filter (where a.resultat = 'succes') as succes,
-            count(*) filter (where a.resultat = 'mitigue') as mitiges,
-            count(*) filter (where a.resultat = 'echec') as echecs,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') / count(*), 1) as success_rate
-        from robots r
-        left join actions a on r.id_robot = a.id_robot
-        group by r.modele
-        order by success_rate desc nulls last
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/scenario-difficulty')
-def scenario_difficulty():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            s.description,
-            s.priorite_loi as loi,
-            count(a.id_action) as total_actions,
-            count(*) filter (where a.resultat = 'succes') as succes,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') / nullif(count(*), 0), 1) as taux_reussite
-        from scenarios s
-        left join actions a on s.id_scenario = a.id_scenario
-        group by s.id_scenario, s.description, s.priorite_loi
-        order by s.priorite_loi, s.id_scenario
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/ethical-dilemmas')
-def ethical_dilemmas():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            s.id_scenario,
-            s.description,
-            s.priorite_loi as loi,
-            count(a.id_action) as times_faced,
-            count(*) filter (where a.resultat = 'succes') as succes,
-            count(*) filter (where a.resultat = 'mitigue') as mitiges,
-            count(*) filter (where a.resultat = 'echec') as echecs,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') / nullif(count(*), 0), 1) as taux_reussite
-        from scenarios s
-        left join actions a on s.id_scenario = a.id_scenario
-        group by s.id_scenario, s.description, s.priorite_loi
-        order by s.priorite_loi, s.id_scenario
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/vulnerability-vs-outcomes')
-def vulnerability_vs_outcomes():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            h.vulnerabilite,
-            a.resultat,
-            count(*) as count
-        from humains h
-        join actions a on h.id_humain = a.id_humain
-        group by h.vulnerabilite, a.resultat
-        order by h.vulnerabilite, a.resultat
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/robot-specialization')
-def robot_specialization():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            r.nom_robot,
-            r.modele,
-            r.etat,
-            count(distinct a.id_scenario) as scenarios_traites,
-            count(a.id_action) as actions_totales,
-            count(*) filter (where a.resultat = 'succes') as succes,
-            count(*) filter (where a.resultat = 'mitigue') as mitiges,
-            count(*) filter (where a.resultat = 'echec') as echecs,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') 
-                / nullif(count(*), 0), 1) as taux_reussite
-        from robots r
-        left join actions a on r.id_robot = a.id_robot
-        group by r.id_robot, r.nom_robot, r.modele, r.etat
-        order by taux_reussite desc nulls last
-        limit 15
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/scenarios-by-priority')
-def scenarios_by_priority():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            s.priorite_loi as loi,
-            case 
-                when s.priorite_loi = 1 then 'Loi 1: Protéger Vie Humaine'
-                when s.priorite_loi = 2 then 'Loi 2: Obéir aux Ordres'
-                when s.priorite_loi = 3 then 'Loi 3: Auto-Préservation'
-            end as loi_nom,
-            count(*) as scenario_count,
-            string_agg(s.description, ' | ' order by s.id_scenario) as scenarios_list
-        from scenarios s
-        group by s.priorite_loi
-        order by s.priorite_loi
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/sector-risk-analysis')
-def sector_risk_analysis():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            h.localisation as secteur,
-            count(*) as actions,
-            count(*) filter (where a.resultat = 'succes') as succes,
-            count(*) filter (where a.resultat = 'echec') as echecs,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') / count(*), 1) as taux_reussite
-        from humains h
-        join actions a on h.id_humain = a.id_humain
-        group by h.localisation
-        order by taux_reussite desc
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/action-categories')
-def action_categories():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            a.action as categorie,
-            count(*) as total,
-            count(*) filter (where a.resultat = 'succes') as succes,
-            count(*) filter (where a.resultat = 'mitigue') as mitiges,
-            count(*) filter (where a.resultat = 'echec') as echecs,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') / count(*), 1) as taux_reussite
-        from actions a
-        group by a.action
-        order by taux_reussite desc
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/ethical-complexity')
-def ethical_complexity():
-    """Complexité éthique des scenarios"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            s.priorite_loi as loi,
-            case 
-                when s.priorite_loi = 1 then 'Loi 1: Protéger Vie'
-                when s.priorite_loi = 2 then 'Loi 2: Obéir Ordres'
-                when s.priorite_loi = 3 then 'Loi 3: Auto-Préservation'
-            end as loi_nom,
-            count(distinct s.id_scenario) as scenario_count,
-            count(a.id_action) as total_attempts
-        from scenarios s
-        left join actions a on s.id_scenario = a.id_scenario
-        group by s.priorite_loi
-        order by s.priorite_loi
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/robot-specialization-detailed')
-def robot_specialization_detailed():
-    """Spécialisation détaillée des robots"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            r.nom_robot,
-            r.modele,
-            r.etat,
-            count(distinct a.id_scenario) as scenarios_traites,
-            count(a.id_action) as actions_totales,
-            count(*) filter (where a.resultat = 'succes') as succes,
-            count(*) filter (where a.resultat = 'mitigue') as mitiges,
-            count(*) filter (where a.resultat = 'echec') as echecs,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') 
-                / nullif(count(*), 0), 1) as taux_reussite
-        from robots r
-        left join actions a on r.id_robot = a.id_robot
-        group by r.id_robot, r.nom_robot, r.modele, r.etat
-        order by taux_reussite desc nulls last
-        limit 15
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/dilemma-success-by-law')
-def dilemma_success_by_law():
-    """Taux de réussite pour chaque loi"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            s.priorite_loi as loi,
-            case 
-                when s.priorite_loi = 1 then 'Loi 1: Protéger Vie'
-                when s.priorite_loi = 2 then 'Loi 2: Obéir Ordres'
-                when s.priorite_loi = 3 then 'Loi 3: Auto-Préservation'
-            end as loi_nom,
-            count(*) as total_actions,
-            count(*) filter (where a.resultat = 'succes') as succes,
-            count(*) filter (where a.resultat = 'mitigue') as mitiges,
-            count(*) filter (where a.resultat = 'echec') as echecs,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') 
-                / count(*), 1) as pourcent_succes
-        from scenarios s
-        join actions a on s.id_scenario = a.id_scenario
-        group by s.priorite_loi
-        order by s.priorite_loi
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/vulnerability-impact')
-def vulnerability_impact():
-    """Impact de la vulnérabilité humaine sur les résultats"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            h.vulnerabilite,
-            count(*) as actions_total,
-            count(*) filter (where a.resultat = 'succes') as succes,
-            count(*) filter (where a.resultat = 'mitigue') as mitiges,
-            count(*) filter (where a.resultat = 'echec') as echecs,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') 
-                / count(*), 1) as taux_reussite
-        from humains h
-        join actions a on h.id_humain = a.id_humain
-        group by h.vulnerabilite
-        order by 
-            case h.vulnerabilite 
-                when 'faible' then 1
-                when 'moyenne' then 2
-                when 'elevee' then 3
-            end
-    """)
-    data = cur.fetchall()
-    cur.close()
+        order by id_action
+    """,
+    'vue_impact_actions': "select * from vue_impact_actions",
+    'vue_conflits_ethiques': "select * from vue_conflits_ethiques",
+}
+EXPORT_CHUNK = 5000
+
+def _valeur_json(valeur):
+    if isinstance(valeur, (datetime, date)):
+        return valeur.isoformat()
+    return str(valeur)
+
+def _fermer_export(conn, cur):
+    """Ferme le curseur de l'export et rend sa connexion ; sans effet la deuxième fois"""
+    if not cur.closed:
+        cur.close()
     conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/sector-ethical-analysis')
-def sector_ethical_analysis():
-    """Analyse éthique par secteur"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            h.localisation as secteur,
-            count(distinct a.id_scenario) as scenarios_distincts,
-            count(a.id_action) as total_actions,
-            count(*) filter (where a.resultat = 'succes') as succes,
-            count(*) filter (where a.resultat = 'mitigue') as mitiges,
-            count(*) filter (where a.resultat = 'echec') as echecs,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') 
-                / count(*), 1) as taux_reussite
-        from humains h
-        join actions a on h.id_humain = a.id_humain
-        group by h.localisation
-        order by taux_reussite desc
-    """)
-    data = cur.fetchall()
+
+def _lignes_export(conn, cur, premieres, colonnes, format):
+    """Génère l'export par paquets de EXPORT_CHUNK lignes (curseur côté serveur)"""
+    try:
+        if format == 'csv':
+            tampon = io.StringIO()
+            ecrivain = csv.writer(tampon)
+            ecrivain.writerow(colonnes)
+        lignes = premieres
+        while lignes:
+            if format == 'csv':
+                ecrivain.writerows(lignes)
+                yield tampon.getvalue()
+                tampon.seek(0)
+                tampon.truncate()
+            else:
+                yield ''.join(json.dumps(dict(zip(colonnes, ligne)), default=_valeur_json,
+                                         ensure_ascii=False) + '\n'
+                              for ligne in lignes)
+            lignes = cur.fetchmany(EXPORT_CHUNK)
+    finally:
+        _fermer_export(conn, cur)
+
+@app.route('/api/export/<source>')
+def export(source):
+    """
+    Export complet en flux : /api/export/actions?format=csv|ndjson
+    La mémoire du serveur reste constante quelle que soit la taille du résultat.
+    """
+    format = request.args.get('format', 'csv')
+    if source not in EXPORTS or format not in ('csv', 'ndjson'):
+        raise ParametreInvalide(f'source parmi {sorted(EXPORTS)}, format csv ou ndjson')
+
+    # connexion empruntée hors de g : elle est rendue à la fin du flux
+    with mesurer_phase('connexion'):
+        conn = get_routeur().acquerir()
+    try:
+        conn.cursor().execute("set transaction read only")
+        cur = conn.cursor(name=f'export_{source}')
+        cur.itersize = EXPORT_CHUNK
+        cur.execute(EXPORTS[source])
+        premieres = cur.fetchmany(EXPORT_CHUNK)
+        colonnes = [col.name for col in cur.description]
+    except psycopg2.errors.UndefinedTable:
+        conn.close()
+        response = jsonify({'error': f"{source} n'existe pas dans la base (voir queries.sql)"})
+        response.status_code = 404
+        return response
+    except Exception:
+        conn.close()
+        raise
+
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    response = app.response_class(_lignes_export(conn, cur, premieres, colonnes, format),
+                                  mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={source}.{format}'
+    # un générateur jamais démarré (client parti avant le premier paquet)
+    # n'exécute pas son finally : la fermeture de la réponse rend la connexion
+    response.call_on_close(functools.partial(_fermer_export, conn, cur))
+    return response
+
+ETAT_VUES = """
+    select nom, rafraichie_le, duree_ms, extract(epoch from cadence)::integer as cadence_s,
+           seuil_actions, age_s, nouvelles_actions, a_rafraichir
+    from etat_vues_materialisees
+"""
+
+@app.route('/api/materialized-views')
+def vues_materialisees():
+    """Fraîcheur des vues matérialisées de queries.sql (voir vues_materialisees.py)"""
+    conn = get_db(lecture=True)
+    cur = conn.cursor(cursor_factory=CurseurInstrumente)
+    cur.execute(ETAT_VUES + " order by nom")
+    etats = cur.fetchall()
     cur.close()
     conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/law-conflict-analysis')
-def law_conflict_analysis():
-    """Conflits entre lois"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            case s.priorite_loi
-                when 1 then 'Loi 1 (Protéger Vie)'
-                when 2 then 'Loi 2 (Obéir Ordres)'
-                when 3 then 'Loi 3 (Auto-Préservation)'
-            end as loi_principale,
-            count(distinct s.id_scenario) as dilemmes_identifiés,
-            count(*) as actions_liees,
-            round(100.0 * count(*) filter (where a.resultat = 'succes') 
-                / count(*), 1) as resolution_rate
-        from scenarios s
-        join actions a on s.id_scenario = a.id_scenario
-        group by s.priorite_loi
-        order by s.priorite_loi
-    """)
-    data = cur.fetchall()
+    return jsonify(etats)
+
+@app.route('/api/materialized-views/<nom>')
+def vue_materialisee(nom):
+    """
+    Lignes d'une vue matérialisée, avec sa fraîcheur : date du dernier
+    rafraîchissement (aussi en Last-Modified), âge et actions arrivées depuis
+    """
+    conn = get_db(lecture=True)
+    cur = conn.cursor(cursor_factory=CurseurInstrumente)
+    cur.execute("set transaction isolation level repeatable read read only")
+    cur.execute(ETAT_VUES + " where nom = %s", (nom,))
+    fraicheur = cur.fetchone()
+    if fraicheur is None:
+        cur.close()
+        conn.close()
+        response = jsonify({'error': f'vue matérialisée inconnue : {nom}'})
+        response.status_code = 404
+        return response
+    cur.execute(sql.SQL("select * from {}").format(sql.Identifier(nom)))
+    lignes = cur.fetchall()
     cur.close()
+    conn.rollback()
     conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/robot-ethical-maturity')
-def robot_ethical_maturity():
-    """Maturité éthique des robots"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            r.nom_robot,
-            r.modele,
-            count(distinct a.id_scenario) as scenarios_traites,
-            round(100.0 * count(*) filter (where a.resultat = 'succes')
-                / nullif(count(*), 0), 1) as reussite_rate,
-            count(distinct s.priorite_loi) as lois_traitees
-        from robots r
-        left join actions a on r.id_robot = a.id_robot
-        left join scenarios s on a.id_scenario = s.id_scenario
-        group by r.id_robot, r.nom_robot, r.modele
-        having count(a.id_action) > 0
-        order by reussite_rate desc nulls last
-        limit 10
-    """)
-    data = cur.fetchall()
+    response = jsonify({'fraicheur': fraicheur, 'lignes': lignes})
+    response.last_modified = fraicheur['rafraichie_le']
+    return response
+
+def _param_couples(args, nom, type_valeur):
+    """'1:0.2,3:0.5' en {1: 0.2, 3: 0.5}"""
+    try:
+        return {int(cle): type_valeur(valeur)
+                for cle, valeur in (couple.split(':') for couple in args[nom].split(','))}
+    except ValueError:
+        raise ParametreInvalide(f'{nom} : couples <entier>:<valeur> séparés par des virgules')
+
+def parametres_simulation(args):
+    """
+    Hypothèse de /api/simulate : ordre (3,1,2) ou poids (1:0.2,2:0.3,3:0.5),
+    reclasser (<id_scenario>:<loi>,...), gain (0.5) et perte (0), entre 0 et 1
+    """
+    try:
+        ordre = [int(loi) for loi in args['ordre'].split(',')] if args.get('ordre') else None
+        gain = float(args.get('gain') or 0.5)
+        perte = float(args.get('perte') or 0)
+    except ValueError:
+        raise ParametreInvalide('ordre : lois séparées par des virgules ; gain, perte : nombres')
+    poids = _param_couples(args, 'poids', float) if args.get('poids') else None
+    reclasser = _param_couples(args, 'reclasser', int) if args.get('reclasser') else None
+    try:
+        return simulation.hypothese(ordre, poids, reclasser, gain, perte)
+    except ValueError as error:
+        raise ParametreInvalide(str(error))
+
+@app.route('/api/simulate')
+@cached(ttl=60)
+def simulate():
+    """
+    Taux de réussite et classifications (performant, défaillant) par robot,
+    par modèle et global, si les lois avaient un autre ordre de priorité
+    (voir simulation.py) : /api/simulate?ordre=3,2,1
+    """
+    h = parametres_simulation(request.args)
+    conn = get_db(lecture=True, fraicheur=60)
+    cur = conn.cursor()
+    resultat = simulation.get_simulateur().simuler(cur, h)
     cur.close()
     conn.close()
-    return jsonify([dict(row) for row in data])
-
-@app.route('/api/time-execution-patterns')
-def time_execution_patterns():
-    """Patterns temporels par type de décision"""
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        select 
-            s.priorite_loi as loi,
-            case 
-                when s.priorite_loi = 1 then 'Urgence (Protéger Vie)'
-                when s.priorite_loi = 2 then 'Protocole (Obéir)'
-                when s.priorite_loi = 3 then 'Sécurité (Auto-Préserv.)'
-            end as categorie_decision,
-            count(*) as decisions
-        from scenarios s
-        join actions a on s.id_scenario = a.id_scenario
-        group by s.priorite_loi
-        order by s.priorite_loi
-    """)
-    data = cur.fetchall()
+    return jsonify(resultat)
+
+@app.route('/api/batch')
+@cached(ttl=5)
+def batch():
+    """
+    Plusieurs requêtes du dashboard en un appel : /api/batch?q=global-stats,actions-results
+    Elles partagent une connexion et un même instantané (repeatable read, lecture seule).
+    Avec &format=columns, chaque requête est au format colonnes.
+    """
+    noms = list(dict.fromkeys(n.strip() for n in request.args.get('q', '').split(',') if n.strip()))
+    inconnues = [n for n in noms if n not in DASHBOARD_QUERIES]
+    if not noms or inconnues or len(noms) > BATCH_MAX:
+        response = jsonify({
+            'error': f'q doit lister entre 1 et {BATCH_MAX} requêtes connues, séparées par des virgules',
+            'inconnues': inconnues,
+            'disponibles': sorted(DASHBOARD_QUERIES),
+        })
+        response.status_code = 400
+        return response
+
+    colonnes = _param_colonnes(request.args)
+    conn = get_db(lecture=True, fraicheur=min(DASHBOARD_QUERIES[nom].fraicheur for nom in noms))
+    cur = conn.cursor(cursor_factory=CurseurTuplesInstrumente if colonnes else CurseurInstrumente)
+    cur.execute("set transaction isolation level repeatable read read only")
+    resultats = {nom: DASHBOARD_QUERIES[nom](cur, colonnes) for nom in noms}
     cur.close()
+    conn.rollback()
     conn.close()
-    return jsonify([dict(row) for row in data])
+    return reponse_donnees(resultats)
+
+diffuseur = Diffuseur(max_actions=int(os.environ.get('COLONIE_SSE_MAX_ACTIONS', 20)))
+SSE_INTERVALLE = float(os.environ.get('COLONIE_SSE_INTERVAL', 0.5))
+SSE_FILE = int(os.environ.get('COLONIE_SSE_QUEUE', 64))
+_diffusion_demarree = False
+
+def _demarrer_diffusion():
+    """Abonne le diffuseur aux NOTIFY colonie_actions et lance son horloge (une fois par processus)"""
+    global _diffusion_demarree
+    with _cache_verrou:
+        if _diffusion_demarree:
+            return
+        get_ecouteur().abonner('colonie_actions', lambda canal, payload: diffuseur.publier(payload),
+                               a_la_connexion=diffuseur.connecte)
+        demarrer_ecouteur()
+        def horloge():
+            while True:
+                time.sleep(SSE_INTERVALLE)
+                diffuseur.diffuser()
+        threading.Thread(target=horloge, name='diffusion-sse', daemon=True).start()
+        _diffusion_demarree = True
+
+@app.route('/api/events')
+def evenements():
+    """
+    Flux SSE des nouvelles actions : un événement « actions » par intervalle au
+    plus (cumul des insertions), « resync » quand le client doit tout recharger
+    """
+    _demarrer_diffusion()
+    abonne = diffuseur.abonner(queue.Queue(SSE_FILE))
+    reprise = bool(request.headers.get('Last-Event-ID'))
+
+    def flux():
+        try:
+            yield 'retry: 3000\n\n'
+            if reprise:
+                # reconnexion du navigateur : les événements manqués ne sont pas rejoués
+                yield RESYNC
+            while True:
+                try:
+                    yield abonne.file.get(timeout=15)
+                except queue.Empty:
+                    yield KEEPALIVE
+        finally:
+            diffuseur.desabonner(abonne)
+
+    response = app.response_class(flux(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/events-stats')
+def events_stats():
+    return jsonify(diffuseur.etat())
+
+INGESTION_ATTENTE = float(os.environ.get('COLONIE_INGEST_WAIT', 0.5))
+
+@app.errorhandler(ActionsInvalides)
+def actions_invalides(error):
+    response = jsonify({'error': str(error), 'details': error.erreurs[:100]})
+    response.status_code = 400
+    return response
+
+@app.errorhandler(TamponPlein)
+def tampon_plein(error):
+    response = jsonify({'error': "trop d'actions en attente d'écriture, réessayez", 'detail': str(error)})
+    response.status_code = 429
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.errorhandler(EcritureIndisponible)
+def ecriture_indisponible(error):
+    response = jsonify({'error': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.route('/api/actions', methods=['POST'])
+def ingerer_actions():
+    """
+    Enregistre une action (objet JSON) ou un lot (liste). Avec ?durabilite=tampon
+    (défaut, COLONIE_INGEST_DURABILITY), 202 dès la mise en tampon ; avec
+    ?durabilite=commit, 201 et les id_action une fois le COPY validé.
+    """
+    donnees = request.get_json(silent=True)
+    if donnees is None:
+        raise ParametreInvalide('corps JSON attendu')
+    durabilite = request.args.get('durabilite', ingestion.DURABILITE)
+    if durabilite not in ingestion.DURABILITES:
+        raise ParametreInvalide(f"durabilite : {' ou '.join(ingestion.DURABILITES)}")
+    nb, futur = ingestion.soumettre(donnees, durabilite, INGESTION_ATTENTE)
+    if futur is None:
+        return jsonify({'acceptees': nb, 'durabilite': durabilite}), 202
+    try:
+        ids = futur.result(ingestion.DELAI_COMMIT)
+    except concurrent.futures.TimeoutError:
+        raise EcritureIndisponible(f'écriture non confirmée en {ingestion.DELAI_COMMIT}s '
+                                   '(les actions restent en tampon)')
+    return jsonify({'ecrites': sum(i is not None for i in ids), 'ids': ids,
+                    'durabilite': durabilite}), 201
+
+@app.route('/api/ingest-stats')
+def ingest_stats():
+    return jsonify(ingestion.get_tampon().etat())
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
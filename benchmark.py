@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""
+Benchmark des routes /api/* du dashboard, sur plusieurs tailles de données
+
+    python benchmark.py mesurer --scales 0.01,0.1,1 --sortie bench/$(git rev-parse --short HEAD).json
+    python benchmark.py comparer bench/avant.json bench/apres.json --seuil 1.2
+
+Chaque requête enregistrée par dashboard_route est mesurée deux fois : par
+le client de test Flask (routage, jsonify, cache désactivé) et directement
+en SQL sur une connexion dédiée. Pour chaque scale, le jeu de
+generer_dataset.py est chargé dans la base POSTGRES_DB : ses tables sont
+vidées. Sans --scales, on mesure les données déjà en base.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault('COLONIE_CACHE', '0')
+
+from psycopg2.extras import RealDictCursor
+
+from app import app, DASHBOARD_QUERIES
+from db import connecter
+import generer_dataset
+
+# noeuds d'EXPLAIN qui lisent des lignes d'une table
+NOEUDS_LECTURE = {'Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Tid Scan'}
+
+
+class CurseurEnregistreur(RealDictCursor):
+    """Garde le texte final de chaque requête exécutée, pour l'EXPLAIN"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requetes = []
+
+    def execute(self, query, vars=None):
+        resultat = super().execute(query, vars)
+        self.requetes.append(self.query)
+        return resultat
+
+
+def percentile(valeurs, p):
+    """Percentile au rang le plus proche d'une liste triée"""
+    rang = max(0, min(len(valeurs) - 1, -(-len(valeurs) * p // 100) - 1))
+    return valeurs[int(rang)]
+
+
+def resume(durees):
+    durees = sorted(durees)
+    return {
+        'iterations': len(durees),
+        'p50_ms': round(percentile(durees, 50) * 1000, 3),
+        'p95_ms': round(percentile(durees, 95) * 1000, 3),
+        'p99_ms': round(percentile(durees, 99) * 1000, 3),
+        'moyenne_ms': round(sum(durees) / len(durees) * 1000, 3),
+    }
+
+
+def lignes_scannees(noeud):
+    """Lignes lues dans les tables (retenues + filtrées) sur tout le plan"""
+    total = 0
+    if noeud['Node Type'] in NOEUDS_LECTURE:
+        boucles = noeud.get('Actual Loops', 1)
+        total += (noeud.get('Actual Rows', 0) + noeud.get('Rows Removed by Filter', 0)
+                  + noeud.get('Rows Removed by Index Recheck', 0)) * boucles
+    for enfant in noeud.get('Plans', []):
+        total += lignes_scannees(enfant)
+    return total
+
+
+def expliquer(conn, requetes):
+    cur = conn.cursor()
+    scannees = blocs = 0
+    for requete in requetes:
+        cur.execute(b'explain (analyze, buffers, format json) ' + requete)
+        plan = cur.fetchone()[0][0]['Plan']
+        scannees += lignes_scannees(plan)
+        blocs += plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0)
+    conn.rollback()
+    cur.close()
+    return {'lignes_scannees': int(scannees), 'blocs': blocs}
+
+
+def mesurer_sql(conn, nom, iterations, echauffement):
+    durees = []
+    for i in range(echauffement + iterations):
+        with app.test_request_context(f'/api/{nom}'):
+            debut = time.perf_counter()
+            cur = conn.cursor(cursor_factory=CurseurEnregistreur)
+            data = DASHBOARD_QUERIES[nom](cur)
+            cur.close()
+            duree = time.perf_counter() - debut
+        conn.rollback()
+        if i >= echauffement:
+            durees.append(duree)
+    lignes = len(data['items']) if isinstance(data, dict) and 'items' in data else len(data)
+    return {**resume(durees), 'lignes': lignes, **expliquer(conn, cur.requetes)}
+
+
+def mesurer_http(client, nom, iterations, echauffement):
+    durees = []
+    for i in range(echauffement + iterations):
+        debut = time.perf_counter()
+        response = client.get(f'/api/{nom}')
+        duree = time.perf_counter() - debut
+        if response.status_code != 200:
+            raise RuntimeError(f'/api/{nom} : {response.status_code} {response.get_data(as_text=True)[:200]}')
+        if i >= echauffement:
+            durees.append(duree)
+    return {**resume(durees), 'octets': len(response.get_data())}
+
+
+def mesurer_base(etiquette, endpoints, iterations, echauffement):
+    conn = connecter()
+    cur = conn.cursor()
+    cur.execute('select count(*) from actions')
+    nb_actions = cur.fetchone()[0]
+    cur.close()
+    conn.rollback()
+    client = app.test_client()
+
+    resultats = []
+    for nom in endpoints:
+        for mode, mesure in (('sql', lambda: mesurer_sql(conn, nom, iterations, echauffement)),
+                             ('http', lambda: mesurer_http(client, nom, iterations, echauffement))):
+            r = {'scale': etiquette, 'actions': nb_actions, 'endpoint': nom, 'mode': mode, **mesure()}
+            resultats.append(r)
+            print(f"   {nom:32} {mode:4} p50 {r['p50_ms']:9.2f} ms  p95 {r['p95_ms']:9.2f} ms  "
+                  f"p99 {r['p99_ms']:9.2f} ms")
+    conn.close()
+    return resultats
+
+
+def meta():
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    conn = connecter()
+    cur = conn.cursor()
+    cur.execute('show server_version')
+    version = cur.fetchone()[0]
+    conn.close()
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'modifie': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'postgres': version,
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'processeur': platform.processor() or platform.machine(),
+    }
+
+
+def mesurer(scales, seed, donnees, iterations, echauffement, endpoints, sortie):
+    endpoints = endpoints or sorted(DASHBOARD_QUERIES)
+    rapport = {'meta': {**meta(), 'seed': seed, 'iterations': iterations,
+                        'echauffement': echauffement},
+               'resultats': []}
+    for scale in scales or [None]:
+        if scale is None:
+            print("\n📍 Données actuelles de la base")
+        else:
+            dossier = os.path.join(donnees, f'scale-{scale:g}-seed-{seed}')
+            if not generer_dataset.a_jour(dossier):
+                generer_dataset.generer(scale, seed, dossier)
+            print(f"\n📍 Chargement de scale {scale:g}...")
+            generer_dataset.charger(dossier, vider=True, drop_indexes=True, sans_triggers=True)
+        rapport['resultats'] += mesurer_base('actuel' if scale is None else scale,
+                                             endpoints, iterations, echauffement)
+
+    if sortie:
+        os.makedirs(os.path.dirname(sortie) or '.', exist_ok=True)
+        with open(sortie, 'w', encoding='utf-8') as f:
+            json.dump(rapport, f, indent=2, ensure_ascii=False)
+        print(f"\n   ✓ rapport écrit dans {sortie}")
+    return rapport
+
+
+def comparer(avant, apres, seuil, plancher_ms):
+    """Affiche les écarts de p95 ; renvoie le nombre de régressions"""
+    with open(avant, encoding='utf-8') as f:
+        avant = json.load(f)
+    with open(apres, encoding='utf-8') as f:
+        apres = json.load(f)
+    cle = lambda r: (str(r['scale']), r['endpoint'], r['mode'])
+    references = {cle(r): r for r in avant['resultats']}
+
+    print(f"\n{(avant['meta']['commit'] or '?')[:10]} -> {(apres['meta']['commit'] or '?')[:10]}")
+    regressions = 0
+    for r in apres['resultats']:
+        ref = references.get(cle(r))
+        if ref is None:
+            continue
+        ratio = r['p95_ms'] / ref['p95_ms'] if ref['p95_ms'] else float('inf')
+        regression = ratio > seuil and r['p95_ms'] - ref['p95_ms'] > plancher_ms
+        regressions += regression
+        print(f"   {'✗' if regression else ' '} {str(r['scale']):>6} {r['endpoint']:32} {r['mode']:4} "
+              f"p95 {ref['p95_ms']:9.2f} -> {r['p95_ms']:9.2f} ms  (x{ratio:.2f})")
+    print(f"\n   {regressions} régression(s) au-delà de x{seuil}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    commandes = parser.add_subparsers(dest='commande', required=True)
+
+    m = commandes.add_parser('mesurer', help='mesure les endpoints et écrit un rapport JSON')
+    m.add_argument('--scales', help='ex. 0.01,0.1,1 ; charge chaque jeu (vide les tables !)')
+    m.add_argument('--seed', type=int, default=42)
+    m.add_argument('--donnees', default='donnees', help='dossier des jeux de generer_dataset.py')
+    m.add_argument('--iterations', type=int, default=30)
+    m.add_argument('--echauffement', type=int, default=3)
+    m.add_argument('--endpoints', help='noms séparés par des virgules (défaut : tous)')
+    m.add_argument('--sortie', help='fichier JSON du rapport')
+
+    c = commandes.add_parser('comparer', help='compare deux rapports (code retour 1 si régression)')
+    c.add_argument('avant')
+    c.add_argument('apres')
+    c.add_argument('--seuil', type=float, default=1.2, help='ratio de p95 toléré (défaut 1.2)')
+    c.add_argument('--plancher-ms', type=float, default=1.0,
+                   help="écart absolu de p95 en dessous duquel on ignore (défaut 1 ms)")
+    args = parser.parse_args()
+
+    if args.commande == 'mesurer':
+        scales = [float(s) for s in args.scales.split(',')] if args.scales else None
+        endpoints = args.endpoints.split(',') if args.endpoints else None
+        mesurer(scales, args.seed, args.donnees, args.iterations, args.echauffement,
+                endpoints, args.sortie)
+    else:
+        sys.exit(1 if comparer(args.avant, args.apres, args.seuil, args.plancher_ms) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Cache des réponses de l'API : LRU borné en nombre d'entrées et en octets,
+TTL par endpoint et invalidation dès que la version des données change
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class EntreeCache:
+    __slots__ = ('corps', 'mimetype', 'etag', 'modifie_le', 'expire', 'version', 'encodage')
+
+    def __init__(self, corps, mimetype, etag, modifie_le, expire, version, encodage=None):
+        self.corps = corps
+        self.mimetype = mimetype
+        self.etag = etag
+        self.modifie_le = modifie_le
+        self.expire = expire
+        self.version = version
+        # Content-Encoding du corps (gzip, br), None s'il n'est pas compressé
+        self.encodage = encodage
+
+
+class CacheReponses:
+    """
+    La version des données est fournie par l'écouteur LISTEN/NOTIFY (voir
+    db.EcouteurNotifications) : une entrée calculée pour une version plus
+    ancienne n'est jamais servie. Tant que l'écouteur n'est pas connecté,
+    `actif` reste faux et le cache est contourné.
+    """
+
+    def __init__(self, max_entrees=512, max_octets=64 * 1024 * 1024):
+        self.max_entrees = max_entrees
+        self.max_octets = max_octets
+        self.actif = False
+        self.version = None
+        self.modifie_le = None
+        self._entrees = OrderedDict()
+        self._octets = 0
+        self._verrou = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0,
+                       'non_cachees': 0}
+        self._par_endpoint = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    def nouvelle_version(self, version, modifie_le):
+        """Appelé à chaque NOTIFY : vide le cache si la version a avancé"""
+        with self._verrou:
+            if self.version is not None and version <= self.version:
+                return
+            self.version = version
+            self.modifie_le = modifie_le
+            if self._entrees:
+                self._stats['invalidations'] += 1
+            self._entrees.clear()
+            self._octets = 0
+
+    def activer(self, version, modifie_le):
+        with self._verrou:
+            self.version = None
+        self.nouvelle_version(version, modifie_le)
+        self.actif = True
+
+    def desactiver(self):
+        self.actif = False
+
+    def lire(self, endpoint, cle):
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is not None and (entree.version != self.version
+                                       or entree.expire < time.monotonic()):
+                self._retirer(cle)
+                entree = None
+            if entree is None:
+                self._stats['misses'] += 1
+                self._par_endpoint[endpoint]['misses'] += 1
+                return None
+            self._entrees.move_to_end(cle)
+            self._stats['hits'] += 1
+            self._par_endpoint[endpoint]['hits'] += 1
+            return entree
+
+    def ecrire(self, cle, entree):
+        taille = len(entree.corps)
+        with self._verrou:
+            if entree.version != self.version or taille > self.max_octets // 4:
+                self._stats['non_cachees'] += 1
+                return
+            if cle in self._entrees:
+                self._retirer(cle)
+            self._entrees[cle] = entree
+            self._octets += taille
+            while len(self._entrees) > self.max_entrees or self._octets > self.max_octets:
+                self._retirer(next(iter(self._entrees)))
+                self._stats['evictions'] += 1
+
+    def _retirer(self, cle):
+        entree = self._entrees.pop(cle)
+        self._octets -= len(entree.corps)
+
+    def etat(self):
+        with self._verrou:
+            total = self._stats['hits'] + self._stats['misses']
+            return {
+                'actif': self.actif,
+                'version_donnees': self.version,
+                'entrees': len(self._entrees),
+                'octets': self._octets,
+                'max_entrees': self.max_entrees,
+                'max_octets': self.max_octets,
+                'hit_rate': round(100.0 * self._stats['hits'] / total, 1) if total else None,
+                **self._stats,
+                'par_endpoint': dict(self._par_endpoint),
+            }
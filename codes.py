@@ -0,0 +1,47 @@
+"""
+Codes de résultat, d'état et de vulnérabilité : valeurs des types enum de
+script.sql (resultat_action, etat_robot, niveau_vulnerabilite), dans l'ordre
+du type, avec leur libellé et les graphies acceptées en entrée. Mêmes valeurs
+que la table libelles_codes.
+"""
+
+CODES = {
+    'resultat_action': {
+        'succes': ('Succès', ('succès', 'success', 'réussite', 'reussite')),
+        'mitigue': ('Mitigé', ('mitigé', 'mitige')),
+        'echec': ('Échec', ('échec', 'echoue', 'échoué')),
+    },
+    'etat_robot': {
+        'actif': ('Actif', ('opérationnel', 'operationnel')),
+        'maintenance': ('Maintenance', ()),
+        'hors_service': ('Hors service', ('inactif', 'hors service')),
+        'en_panne': ('En panne', ('en panne', 'panne')),
+        'retraite': ('Retraité', ('retraité',)),
+    },
+    'niveau_vulnerabilite': {
+        'faible': ('Faible', ('basse', 'bas')),
+        'moyenne': ('Moyenne', ('moyen',)),
+        'elevee': ('Élevée', ('élevée', 'élevé', 'eleve', 'haute')),
+    },
+}
+
+RESULTATS = tuple(CODES['resultat_action'])
+ETATS = tuple(CODES['etat_robot'])
+VULNERABILITES = tuple(CODES['niveau_vulnerabilite'])
+
+_GRAPHIES = {
+    type: {graphie: code for code, (_, variantes) in codes.items() for graphie in (code, *variantes)}
+    for type, codes in CODES.items()
+}
+
+
+def code(type, valeur):
+    """Code de `valeur` (casse et espaces ignorés), None si elle n'en a pas"""
+    if not isinstance(valeur, str):
+        return None
+    return _GRAPHIES[type].get(valeur.strip().lower())
+
+
+def libelles():
+    """{type: {code: libellé}}, pour l'affichage"""
+    return {type: {c: libelle for c, (libelle, _) in codes.items()} for type, codes in CODES.items()}
@@ -0,0 +1,47 @@
+"""
+Lecture des actions en colonnes d'entiers NumPy par COPY, et arrondi des taux
+comme PostgreSQL : partagés par le moteur en mémoire (analytique.py) et les
+instantanés en colonnes (instantane.py)
+"""
+import io
+from decimal import Decimal, ROUND_HALF_UP
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def copier_actions(cur, actions, codes_actions, condition, params=(), horodatage=False,
+                   absent=0, ordonne=False):
+    """
+    Actions qui vérifient `condition` (SQL sur `a`, paramètres `params`) :
+    tableau (n, 6) d'entiers id_action, id_robot, id_humain, id_scenario,
+    catégorie d'action et résultat (rang dans resultat_action). Avec
+    `horodatage`, une colonne de plus après la catégorie : le timestamp en
+    millisecondes depuis 1970. La catégorie de actions[i] est
+    codes_actions[i] ; une référence nulle vaut `absent`.
+    """
+    copie = cur.mogrify(f"""
+        copy (
+            select a.id_action, coalesce(a.id_robot, %s), coalesce(a.id_humain, %s),
+                   coalesce(a.id_scenario, %s), d.code,
+                   {'(extract(epoch from a.timestamp) * 1000)::bigint,' if horodatage else ''}
+                   array_position(enum_range(null::resultat_action), a.resultat) - 1
+            from actions a
+            join unnest(%s::text[], %s::int[]) as d(action, code) on d.action = a.action
+            where {condition}
+            {'order by a.id_action' if ordonne else ''}
+        ) to stdout
+    """, (absent, absent, absent, list(actions), list(codes_actions), *params)).decode()
+    tampon = io.StringIO()
+    cur.copy_expert(copie, tampon)
+    return np.fromstring(tampon.getvalue(), dtype=np.int64, sep=' ').reshape(-1, 7 if horodatage else 6)
+
+
+def pourcentage(n, total, decimales=1):
+    """round(100.0 * n / total, decimales) de PostgreSQL ; None si total est nul"""
+    if not total:
+        return None
+    return (Decimal(100 * int(n)) / Decimal(int(total))).quantize(Decimal(1).scaleb(-decimales),
+                                                                  ROUND_HALF_UP)
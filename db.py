@@ -0,0 +1,545 @@
+"""
+Accès PostgreSQL partagé par le dashboard : pool de connexions borné, et
+répartition des lectures sur des réplicas selon leur retard de réplication
+"""
+import logging
+import os
+import select
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+log = logging.getLogger(__name__)
+
+
+DB_CONFIG = {
+    'host': os.environ.get('POSTGRES_HOST', 'localhost'),
+    'port': int(os.environ.get('POSTGRES_PORT', 5432)),
+    'database': os.environ.get('POSTGRES_DB', 'colonie'),
+    'user': os.environ.get('POSTGRES_USER', 'postgres'),
+    'password': os.environ.get('POSTGRES_PASSWORD', 'ulysse'),
+}
+
+
+class PoolEpuise(Exception):
+    """Aucune connexion n'a été libérée avant la fin du délai d'attente"""
+
+
+def connecter(**params):
+    """Ouvre une connexion directe (hors pool), en UTF8"""
+    conn = psycopg2.connect(**{**DB_CONFIG, **params})
+    conn.set_client_encoding('UTF8')
+    return conn
+
+
+class ConnexionPool:
+    """Connexion empruntée au pool : close() la rend au lieu de la fermer"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, nom):
+        if self._conn is None:
+            raise psycopg2.InterfaceError('connexion déjà rendue au pool')
+        return getattr(self._conn, nom)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def rendue(self):
+        return self._conn is None
+
+    @property
+    def pool(self):
+        """Pool d'origine (celui d'un réplica, pour une lecture routée)"""
+        return self._pool
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.rendre(conn)
+
+
+class PoolConnexions:
+    """
+    Pool de connexions thread-safe et borné.
+
+    - au plus `maxconn` connexions ouvertes, `minconn` gardées au chaud
+    - une connexion inactive depuis plus de `verif_inactivite` secondes est
+      testée (select 1) avant d'être prêtée, et remplacée si elle est cassée
+    - une connexion plus vieille que `duree_vie_max` secondes est recyclée
+    - si toutes les connexions sont prêtées, on attend au plus `timeout`
+      secondes avant de lever PoolEpuise
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=5.0,
+                 duree_vie_max=1800.0, verif_inactivite=30.0, **params):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('il faut 0 <= minconn <= maxconn et maxconn >= 1')
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.duree_vie_max = duree_vie_max
+        self.verif_inactivite = verif_inactivite
+        self._params = params
+        self._libres = []          # (conn, créée_le, rendue_le)
+        self._nees = {}            # id(conn) -> créée_le, pour les connexions prêtées
+        self._ouvertes = 0
+        self._attente = threading.Condition()
+        self._ferme = False
+        self.stats = {'emprunts': 0, 'attentes': 0, 'epuisements': 0,
+                      'recyclees': 0, 'cassees': 0}
+        for _ in range(minconn):
+            self._ouvertes += 1
+            conn = self._ouvrir()
+            self._libres.append((conn, time.monotonic(), time.monotonic()))
+
+    def _ouvrir(self):
+        """Ouvre une connexion dans une place déjà comptée dans _ouvertes"""
+        try:
+            return connecter(**self._params)
+        except Exception:
+            with self._attente:
+                self._ouvertes -= 1
+                self._attente.notify()
+            raise
+
+    def _jeter(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._attente:
+            self._ouvertes -= 1
+            self._attente.notify()
+
+    def _compter(self, nom):
+        with self._attente:
+            self.stats[nom] += 1
+
+    def _en_bon_etat(self, conn, nee_le, rendue_le):
+        maintenant = time.monotonic()
+        if conn.closed:
+            self._compter('cassees')
+            return False
+        if maintenant - nee_le > self.duree_vie_max:
+            self._compter('recyclees')
+            return False
+        if maintenant - rendue_le > self.verif_inactivite:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('select 1')
+                conn.rollback()
+            except psycopg2.Error:
+                self._compter('cassees')
+                return False
+        return True
+
+    def acquerir(self, timeout=None):
+        """
+        Emprunte une connexion ; à rendre avec close() (ou un bloc with).
+        `timeout` remplace le délai d'attente du pool (0 : pas d'attente).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        limite = time.monotonic() + timeout
+        while True:
+            with self._attente:
+                if self._ferme:
+                    raise PoolEpuise('pool fermé')
+                while not self._libres and self._ouvertes >= self.maxconn:
+                    reste = limite - time.monotonic()
+                    if reste <= 0:
+                        self.stats['epuisements'] += 1
+                        raise PoolEpuise(
+                            f'{self.maxconn} connexions déjà utilisées, '
+                            f'aucune libérée en {timeout}s')
+                    self.stats['attentes'] += 1
+                    self._attente.wait(reste)
+                libre = self._libres.pop() if self._libres else None
+                if libre is None:
+                    self._ouvertes += 1     # place réservée avant de relâcher le verrou
+
+            if libre is None:
+                conn = self._ouvrir()
+                nee_le = time.monotonic()
+            else:
+                conn, nee_le, rendue_le = libre
+                if not self._en_bon_etat(conn, nee_le, rendue_le):
+                    self._jeter(conn)
+                    continue
+
+            with self._attente:
+                self._nees[id(conn)] = nee_le
+                self.stats['emprunts'] += 1
+            return ConnexionPool(self, conn)
+
+    def rendre(self, conn):
+        """Remet une connexion dans le pool après avoir annulé sa transaction"""
+        with self._attente:
+            nee_le = self._nees.pop(id(conn), time.monotonic())
+        try:
+            if not conn.closed:
+                statut = conn.info.transaction_status
+                if statut == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    raise psycopg2.InterfaceError('connexion perdue')
+                if statut != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+        except psycopg2.Error:
+            self._compter('cassees')
+            self._jeter(conn)
+            return
+        if conn.closed or self._ferme:
+            self._jeter(conn)
+            return
+        with self._attente:
+            self._libres.append((conn, nee_le, time.monotonic()))
+            self._attente.notify()
+
+    @property
+    def pretees(self):
+        return self._ouvertes - len(self._libres)
+
+    def etat(self):
+        with self._attente:
+            return {
+                'min': self.minconn,
+                'max': self.maxconn,
+                'ouvertes': self._ouvertes,
+                'libres': len(self._libres),
+                'pretees': self._ouvertes - len(self._libres),
+                **self.stats,
+            }
+
+    def fermer(self):
+        with self._attente:
+            self._ferme = True
+            libres, self._libres = self._libres, []
+        for conn, _, _ in libres:
+            self._jeter(conn)
+
+
+_pool = None
+_pool_verrou = threading.Lock()
+
+
+def _options_pool():
+    return {
+        'minconn': int(os.environ.get('COLONIE_POOL_MIN', 1)),
+        'maxconn': int(os.environ.get('COLONIE_POOL_MAX', 10)),
+        'timeout': float(os.environ.get('COLONIE_POOL_TIMEOUT', 5)),
+        'duree_vie_max': float(os.environ.get('COLONIE_POOL_MAX_AGE', 1800)),
+        'verif_inactivite': float(os.environ.get('COLONIE_POOL_CHECK_IDLE', 30)),
+    }
+
+
+def get_pool():
+    """Pool partagé par le processus, créé à la première utilisation"""
+    global _pool
+    if _pool is None:
+        with _pool_verrou:
+            if _pool is None:
+                _pool = PoolConnexions(**_options_pool())
+    return _pool
+
+
+class Replica:
+    """
+    Réplica en lecture seule (réplication en flux) et son pool. `a_jour_de`
+    est l'instant (time.monotonic) jusqu'auquel le réplica est sûr d'avoir
+    rejoué tous les commits du primaire ; None s'il est injoignable.
+    """
+
+    def __init__(self, nom, params, pool):
+        self.nom = nom
+        self.params = params
+        self.pool = pool
+        self.a_jour_de = None
+        self.lectures = 0
+        self.erreur = None
+
+    @property
+    def retard(self):
+        """Borne supérieure du retard en secondes, None si inconnu"""
+        return None if self.a_jour_de is None else time.monotonic() - self.a_jour_de
+
+
+class Routeur(threading.Thread):
+    """
+    Répartit les lectures entre les réplicas et le primaire ; les écritures
+    restent sur le primaire (get_pool()).
+
+    Le thread relève toutes les `intervalle` secondes la position WAL du
+    primaire (pg_current_wal_lsn) et celle que chaque réplica a rejouée
+    (pg_last_wal_replay_lsn). Un réplica qui a rejoué la position relevée à
+    l'instant t contient tous les commits antérieurs à t : son retard est
+    au plus « maintenant - t », même quand le primaire ne reçoit rien.
+
+    acquerir(fraicheur) prête une connexion du réplica le moins occupé dont
+    le retard ne dépasse pas `fraicheur` secondes (et jamais `retard_max`),
+    et se replie sur le primaire si aucun ne convient ou si son pool est
+    plein.
+    """
+
+    def __init__(self, primaire, replicas, retard_max=30.0, intervalle=1.0, historique=600.0):
+        super().__init__(name='routeur-replicas', daemon=True)
+        self.primaire = primaire
+        self.replicas = replicas
+        self.retard_max = retard_max
+        self.intervalle = intervalle
+        # (instant, position WAL du primaire), du plus ancien au plus récent
+        self._positions = deque(maxlen=max(2, int(historique / intervalle)))
+        self._verrou = threading.Lock()
+        self.stats = {'lectures_primaire': 0, 'replis_retard': 0, 'replis_indisponible': 0,
+                      'mesures': 0, 'erreurs_mesure': 0}
+
+    def acquerir(self, fraicheur=None):
+        if not self.replicas:
+            return self.primaire.acquerir()
+        self.demarrer()
+        borne = self.retard_max if fraicheur is None else min(fraicheur, self.retard_max)
+        candidats = [r for r in self.replicas if r.retard is not None and r.retard <= borne]
+        for replica in sorted(candidats, key=lambda r: r.pool.pretees):
+            try:
+                conn = replica.pool.acquerir(timeout=0)
+            except PoolEpuise:
+                continue
+            except psycopg2.OperationalError as error:
+                replica.a_jour_de, replica.erreur = None, str(error).strip()
+                continue
+            with self._verrou:
+                replica.lectures += 1
+            return conn
+        with self._verrou:
+            self.stats['lectures_primaire'] += 1
+            self.stats['replis_indisponible' if candidats else 'replis_retard'] += 1
+        return self.primaire.acquerir()
+
+    def demarrer(self):
+        if self.ident is None:
+            with self._verrou:
+                if self.ident is None:
+                    self.start()
+
+    def run(self):
+        connexions = {}
+        while True:
+            try:
+                self._mesurer(connexions)
+            except Exception as error:
+                log.warning('mesure du retard des réplicas impossible : %s', error)
+            time.sleep(self.intervalle)
+
+    def _position(self, connexions, cle, params, requete):
+        conn = connexions.get(cle)
+        if conn is None or conn.closed:
+            conn = connexions[cle] = connecter(**params)
+            conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(requete)
+                return cur.fetchone()
+        except psycopg2.Error:
+            conn.close()
+            raise
+
+    def _mesurer(self, connexions):
+        lsn, = self._position(connexions, None, {}, "select pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')::bigint")
+        self._positions.append((time.monotonic(), lsn))
+        for replica in self.replicas:
+            try:
+                en_recuperation, rejoue = self._position(
+                    connexions, replica.nom, replica.params,
+                    "select pg_is_in_recovery(), pg_wal_lsn_diff(pg_last_wal_replay_lsn(), '0/0')::bigint")
+            except psycopg2.Error as error:
+                replica.a_jour_de, replica.erreur = None, str(error).strip()
+                self.stats['erreurs_mesure'] += 1
+                continue
+            if not en_recuperation or rejoue is None:
+                replica.a_jour_de, replica.erreur = None, "n'est pas un réplica en cours de réplication"
+                continue
+            # dernier relevé du primaire déjà rejoué par le réplica
+            replica.a_jour_de = next((instant for instant, position in reversed(self._positions)
+                                      if position <= rejoue), None)
+            replica.erreur = None if replica.a_jour_de is not None else "retard au-delà de l'historique"
+        self.stats['mesures'] += 1
+
+    def etat(self):
+        with self._verrou:
+            return {
+                'retard_max': self.retard_max,
+                **self.stats,
+                'replicas': [{
+                    'nom': r.nom,
+                    'retard_s': None if r.retard is None else round(r.retard, 3),
+                    'lectures': r.lectures,
+                    'erreur': r.erreur,
+                    'pool': r.pool.etat(),
+                } for r in self.replicas],
+            }
+
+    def resume(self):
+        """Valeurs numériques pour /metrics"""
+        retards = [r.retard for r in self.replicas if r.retard is not None]
+        return {
+            'configures': len(self.replicas),
+            'disponibles': len(retards),
+            'retard_max_s': round(max(retards), 3) if retards else 0,
+            'lectures_replicas': sum(r.lectures for r in self.replicas),
+            **{cle: self.stats[cle] for cle in ('lectures_primaire', 'replis_retard',
+                                                 'replis_indisponible')},
+        }
+
+
+_routeur = None
+
+
+def _parametres_replica(adresse):
+    """« hote:port » (ou « hote ») de COLONIE_REPLICAS en paramètres de connexion"""
+    hote, _, port = adresse.rpartition(':') if ':' in adresse else (adresse, '', '')
+    return {'host': hote, 'port': int(port) if port else DB_CONFIG['port']}
+
+
+def get_routeur():
+    """
+    Routeur partagé par le processus : COLONIE_REPLICAS liste les réplicas
+    (« hote:port », séparés par des virgules) ; sans réplica, tout va au primaire
+    """
+    global _routeur
+    if _routeur is None:
+        primaire = get_pool()
+        with _pool_verrou:
+            if _routeur is None:
+                adresses = [a.strip() for a in os.environ.get('COLONIE_REPLICAS', '').split(',')
+                            if a.strip()]
+                replicas = []
+                for adresse in adresses:
+                    params = _parametres_replica(adresse)
+                    pool = PoolConnexions(**{**_options_pool(), 'minconn': 0}, **params)
+                    replicas.append(Replica(adresse, params, pool))
+                _routeur = Routeur(
+                    primaire, replicas,
+                    retard_max=float(os.environ.get('COLONIE_REPLICA_MAX_LAG', 30)),
+                    intervalle=float(os.environ.get('COLONIE_REPLICA_CHECK_INTERVAL', 1)))
+    return _routeur
+
+
+class EcouteurNotifications(threading.Thread):
+    """
+    Connexion dédiée en LISTEN qui relaie les NOTIFY aux fonctions abonnées.
+
+    Les abonnés reçoivent `(canal, payload)`. À chaque (re)connexion les
+    callbacks `a_la_connexion(conn)` sont appelés, et `a_la_deconnexion()`
+    quand la connexion est perdue : tant qu'elle est coupée, des
+    notifications peuvent manquer. Un abonnement pris pendant que l'écouteur
+    est connecté réveille son thread, qui fait le LISTEN et appelle
+    `a_la_connexion` sur la connexion en cours.
+    """
+
+    def __init__(self, reconnexion=2.0):
+        super().__init__(name='ecouteur-notifications', daemon=True)
+        self.reconnexion = reconnexion
+        self.connecte = False
+        self._abonnes = {}
+        self._connexion = []
+        self._deconnexion = []
+        # abonnements (canal, a_la_connexion) pris depuis la dernière connexion
+        self._nouveaux = []
+        self._reveil_lecture, self._reveil_ecriture = os.pipe()
+        self._verrou = threading.Lock()
+
+    def abonner(self, canal, callback, a_la_connexion=None, a_la_deconnexion=None):
+        with self._verrou:
+            self._abonnes.setdefault(canal, []).append(callback)
+            if a_la_connexion:
+                self._connexion.append(a_la_connexion)
+            if a_la_deconnexion:
+                self._deconnexion.append(a_la_deconnexion)
+            self._nouveaux.append((canal, a_la_connexion))
+        os.write(self._reveil_ecriture, b'.')
+
+    def _abonnements_en_attente(self, cur, conn, ecoutes):
+        os.read(self._reveil_lecture, 512)
+        with self._verrou:
+            nouveaux, self._nouveaux = self._nouveaux, []
+        for canal, a_la_connexion in nouveaux:
+            if canal not in ecoutes:
+                cur.execute(f'listen "{canal}"')
+                ecoutes.add(canal)
+            if a_la_connexion:
+                a_la_connexion(conn)
+
+    def run(self):
+        while True:
+            conn = None
+            try:
+                conn = connecter()
+                conn.autocommit = True
+                with self._verrou:
+                    canaux = set(self._abonnes)
+                    connexion = list(self._connexion)
+                    self._nouveaux = []
+                cur = conn.cursor()
+                for canal in canaux:
+                    cur.execute(f'listen "{canal}"')
+                for callback in connexion:
+                    callback(conn)
+                self.connecte = True
+                while True:
+                    prets, _, _ = select.select([conn, self._reveil_lecture], [], [], 5)
+                    if not prets:
+                        cur.execute('select 1')
+                        continue
+                    if self._reveil_lecture in prets:
+                        self._abonnements_en_attente(cur, conn, canaux)
+                    conn.poll()
+                    while conn.notifies:
+                        notif = conn.notifies.pop(0)
+                        with self._verrou:
+                            abonnes = list(self._abonnes.get(notif.channel, ()))
+                        for callback in abonnes:
+                            try:
+                                callback(notif.channel, notif.payload)
+                            except Exception:
+                                log.exception('abonné au canal %s en erreur', notif.channel)
+            except Exception as error:
+                log.warning('écouteur LISTEN déconnecté : %s', error)
+            finally:
+                if self.connecte:
+                    self.connecte = False
+                    with self._verrou:
+                        deconnexion = list(self._deconnexion)
+                    for callback in deconnexion:
+                        callback()
+                if conn is not None and not conn.closed:
+                    conn.close()
+            time.sleep(self.reconnexion)
+
+
+_ecouteur = None
+
+
+def get_ecouteur():
+    """Écouteur partagé par le processus, démarré à la première utilisation"""
+    global _ecouteur
+    with _pool_verrou:
+        if _ecouteur is None:
+            _ecouteur = EcouteurNotifications()
+        return _ecouteur
+
+
+def demarrer_ecouteur():
+    ecouteur = get_ecouteur()
+    with _pool_verrou:
+        if not ecouteur.is_alive():
+            ecouteur.start()
+    return ecouteur
@@ -0,0 +1,122 @@
+"""
+Diffusion en direct des nouvelles actions (Server-Sent Events) : les NOTIFY
+colonie_actions reçus pendant un intervalle sont fusionnés et chaque abonné
+reçoit au plus un message par intervalle, quel que soit le débit d'insertion
+"""
+import asyncio
+import json
+import queue
+import threading
+from collections import Counter
+
+
+def message_sse(evenement, donnees=None, id=None):
+    lignes = []
+    if id is not None:
+        lignes.append(f'id: {id}')
+    lignes.append(f'event: {evenement}')
+    lignes.append(f'data: {json.dumps(donnees, ensure_ascii=False, separators=(",", ":"))}')
+    return '\n'.join(lignes) + '\n\n'
+
+
+RESYNC = message_sse('resync')
+KEEPALIVE = ': keepalive\n\n'
+
+
+class Abonne:
+    """
+    Un client SSE. `file` est une queue.Queue (serveur Flask) ou une
+    asyncio.Queue (serveur asyncio), bornée : un client qui ne suit pas
+    perd ses messages en attente et reçoit un seul « resync ».
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def envoyer(self, message):
+        try:
+            self.file.put_nowait(message)
+        except (queue.Full, asyncio.QueueFull):
+            while True:
+                try:
+                    self.file.get_nowait()
+                except (queue.Empty, asyncio.QueueEmpty):
+                    break
+            self.file.put_nowait(RESYNC)
+
+
+class Diffuseur:
+    """
+    `publier(payload)` accumule les NOTIFY (voir diffuser_actions() dans
+    script.sql) ; `diffuser()`, appelé à intervalle régulier, envoie à tous
+    les abonnés le cumul depuis l'appel précédent : nombre d'actions,
+    répartition par résultat et les `max_actions` plus récentes.
+    """
+
+    def __init__(self, max_actions=20):
+        self.max_actions = max_actions
+        self._abonnes = set()
+        self._verrou = threading.Lock()
+        self._connexions = 0
+        self._vider()
+        self.stats = {'notifications': 0, 'messages': 0}
+
+    def _vider(self):
+        self._nb = 0
+        self._par_resultat = Counter()
+        self._dernieres = []
+        self._id_max = None
+        self._resync = False
+
+    def abonner(self, file):
+        abonne = Abonne(file)
+        with self._verrou:
+            self._abonnes.add(abonne)
+        return abonne
+
+    def desabonner(self, abonne):
+        with self._verrou:
+            self._abonnes.discard(abonne)
+
+    def connecte(self, *args):
+        """À chaque reconnexion de l'écouteur : des NOTIFY ont pu être perdus"""
+        with self._verrou:
+            self._connexions += 1
+            if self._connexions > 1:
+                self._resync = True
+
+    def publier(self, payload):
+        lot = json.loads(payload)
+        with self._verrou:
+            self.stats['notifications'] += 1
+            self._nb += lot['nb']
+            self._par_resultat.update(lot.get('par_resultat') or {})
+            if lot.get('id_max') is not None:
+                self._id_max = max(self._id_max or 0, lot['id_max'])
+            if lot.get('tronque'):
+                self._resync = True
+            self._dernieres = sorted(self._dernieres + lot.get('dernieres', []),
+                                     key=lambda a: (a['timestamp'], a['id_action']),
+                                     reverse=True)[:self.max_actions]
+
+    def diffuser(self):
+        with self._verrou:
+            if self._resync:
+                message = RESYNC
+            elif self._nb:
+                message = message_sse('actions', {
+                    'nb': self._nb,
+                    'par_resultat': dict(self._par_resultat),
+                    'dernieres': self._dernieres,
+                }, id=self._id_max)
+            else:
+                return
+            self._vider()
+            abonnes = list(self._abonnes)
+            self.stats['messages'] += 1
+        for abonne in abonnes:
+            abonne.envoyer(message)
+
+    def etat(self):
+        with self._verrou:
+            return {'abonnes': len(self._abonnes), **self.stats}
@@ -2,26 +2,17 @@
 """
 Génération de données enrichies pour analyse de dilemmes éthiques robots
 Sujet 3: Performances des robots respectant les 3 Lois de la Robotique
+
+    python fill_db_enhanced.py              # 100 robots, 200 humains, 300 actions, ligne par ligne
+    python fill_db_enhanced.py --bulk --actions 10000000 --drop-indexes
 """
-import psycopg2
+import argparse
 import os
 import random
+import time
 from datetime import datetime, timedelta
 
-password = os.environ.get('POSTGRES_PASSWORD', 'ulysse')
-conn = psycopg2.connect(
-    host="localhost",
-    database="colonie",
-    user="postgres",
-    password=password
-
-)
-conn.set_client_encoding('UTF8')
-cur = conn.cursor()
-
-print("\n" + "=" * 70)
-print("🤖 GÉNÉRATION DE DONNÉES ENRICHIES POUR DILEMMES ÉTHIQUES")
-print("=" * 70)
+from db import connecter
 
 specialites_robots = {
     'Humanoid-X': {
@@ -272,17 +263,38 @@ secteurs_contexte = {
     'Énergie': ['maintenance', 'risque', 'stabilite', 'continuite']
 }
 
-niveaux_vuln = {'basse': 1, 'moyenne': 2, 'élevée': 3}
+niveaux_vuln = {'faible': 1, 'moyenne': 2, 'elevee': 3}
+
+roles_humains = [
+    'civil', 'militaire', 'policier', 'pompier', 'médecin', 
+    'ingénieur', 'enfant', 'personne_agée', 'journaliste', 'politicien'
+]
+
+resultats_poids_base = {'succes': 0.50, 'mitigue': 0.30, 'echec': 0.20}
 
 
-print("\n📍 Insertion de 100 robots avec spécialités...")
-id_robot_map = {}
-for i in range(100):
+def poids_resultat(modele, priorite_loi):
+    """
+    Corrélations modèle/loi : (poids succès/mitigé/échec, plage de temps en ms
+    si succès, plage sinon)
+    """
+    if modele == 'Humanoid-Y' and priorite_loi == 1:
+        return [0.75, 0.18, 0.07], (100, 3000), (200, 5000)
+    if modele == 'Combat-B' and priorite_loi == 2:
+        return [0.72, 0.22, 0.06], (50, 2000), (50, 2000)
+    if modele == 'Industrial-Z':
+        return [0.55, 0.32, 0.13], (150, 4000), (150, 4000)
+    if modele == 'Service-A':
+        return [0.68, 0.25, 0.07], (100, 3500), (100, 3500)
+    return list(resultats_poids_base.values()), (100, 4000), (100, 4000)
+
+
+def tirer_robot(i):
     modele_key = list(specialites_robots.keys())[i % len(specialites_robots)]
     specs = specialites_robots[modele_key]
     
     etat = random.choices(
-        ['opérationnel', 'maintenance', 'inactif', 'retraité'],
+        ['actif', 'maintenance', 'hors_service', 'retraite'],
         weights=[0.65, 0.20, 0.10, 0.05]
     )[0]
     
@@ -292,124 +304,299 @@ for i in range(100):
     )[0]
     
     nom = f"R{i+1:03d}_{specialite[:4]}"
-    cur.execute("""
-        INSERT INTO robots (nom_robot, modele, etat, capacite_processeur)
-        VALUES (%s, %s, %s, %s) RETURNING id_robot
-    """, (nom, modele_key, etat, random.randint(50, 100)))
-    
-    rid = cur.fetchone()[0]
-    id_robot_map[i] = (rid, modele_key, specs)
-
-conn.commit()
-print(f"   ✓ 100 robots insérés")
+    return nom, modele_key, specs, etat
 
 
-print("📍 Insertion de 200 humains avec contextes variés...")
-id_humain_map = {}
-roles_humains = [
-    'civil', 'militaire', 'policier', 'pompier', 'médecin', 
-    'ingénieur', 'enfant', 'personne_agée', 'journaliste', 'politicien'
-]
-
-for i in range(200):
-    vuln = random.choices(['basse', 'moyenne', 'élevée'], weights=[0.35, 0.45, 0.20])[0]
+def tirer_humain(i):
+    vuln = random.choices(['faible', 'moyenne', 'elevee'], weights=[0.35, 0.45, 0.20])[0]
     secteur = random.choice(list(secteurs_contexte.keys()))
     role = random.choice(roles_humains)
     nom = f"H{i+1:03d}_{role}_{secteur[:3]}"
-    
-    cur.execute("""
-        INSERT INTO humains (nom_humain, niveau_vulnerabilite, secteur)
-        VALUES (%s, %s, %s) RETURNING id_humain
-    """, (nom, vuln, secteur))
-    
-    id_humain_map[i] = cur.fetchone()[0]
-
-conn.commit()
-print(f"   ✓ 200 humains insérés")
-
-
-print(f"📍 Insertion de {len(scenarios_data)} scénarios éthiques détaillés...")
-id_scenario_map = {}
-
-for i, scen in enumerate(scenarios_data):
+    return nom, vuln, secteur
+
+
+def tirer_resultat(modele, priorite_loi):
+    poids, temps_succes, temps_autre = poids_resultat(modele, priorite_loi)
+    resultat = random.choices(list(resultats_poids_base.keys()), weights=poids)[0]
+    temps = random.randint(*(temps_succes if resultat == 'succes' else temps_autre))
+    return resultat, temps
+
+
+# ============================================================================
+# Mode historique : un INSERT par ligne
+# ============================================================================
+
+def inserer_ligne_par_ligne(conn):
+    cur = conn.cursor()
+
+    print("\n📍 Insertion de 100 robots avec spécialités...")
+    id_robot_map = {}
+    for i in range(100):
+        nom, modele_key, specs, etat = tirer_robot(i)
+        cur.execute("""
+            INSERT INTO robots (nom_robot, modele, etat, capacite_processeur)
+            VALUES (%s, %s, %s, %s) RETURNING id_robot
+        """, (nom, modele_key, etat, random.randint(50, 100)))
+        
+        rid = cur.fetchone()[0]
+        id_robot_map[i] = (rid, modele_key, specs)
+
+    conn.commit()
+    print(f"   ✓ 100 robots insérés")
+
+
+    print("📍 Insertion de 200 humains avec contextes variés...")
+    id_humain_map = {}
+    for i in range(200):
+        nom, vuln, secteur = tirer_humain(i)
+        cur.execute("""
+            INSERT INTO humains (nom_humain, niveau_vulnerabilite, secteur)
+            VALUES (%s, %s, %s) RETURNING id_humain
+        """, (nom, vuln, secteur))
+        
+        id_humain_map[i] = cur.fetchone()[0]
+
+    conn.commit()
+    print(f"   ✓ 200 humains insérés")
+
+
+    print(f"📍 Insertion de {len(scenarios_data)} scénarios éthiques détaillés...")
+    id_scenario_map = {}
+
+    for i, scen in enumerate(scenarios_data):
+        cur.execute("""
+            INSERT INTO scenarios (titre_scenario, description, priorite_loi, difficulte)
+            VALUES (%s, %s, %s, %s) RETURNING id_scenario
+        """, (scen['titre'], scen['description'], scen['priorite_loi'], scen['difficulte']))
+        
+        id_scenario_map[i] = cur.fetchone()[0]
+
+    conn.commit()
+    print(f"   ✓ {len(scenarios_data)} scénarios insérés")
+
+
+    print("📍 Génération de 300 actions avec corrélations réalistes...")
+
+    for i in range(300):
+        rid, modele, specs = id_robot_map[i % 100]
+        hid = id_humain_map[i % 200]
+        sid_idx = i % len(scenarios_data)
+        sid = id_scenario_map[sid_idx]
+        resultat, temps = tirer_resultat(modele, scenarios_data[sid_idx]['priorite_loi'])
+        
+        cur.execute("""
+            INSERT INTO actions (id_robot, id_humain, id_scenario, resultat, temps_execution_ms)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (rid, hid, sid, resultat, temps))
+
+    conn.commit()
+    print(f"   ✓ 300 actions diversifiées insérées")
+    cur.close()
+
+
+# ============================================================================
+# Mode bulk : COPY FROM STDIN, ids réservés en une requête
+# ============================================================================
+
+def ligne_copy(valeurs):
+    """Une ligne au format texte de COPY (tabulations, \\N pour NULL)"""
+    champs = []
+    for v in valeurs:
+        if v is None:
+            champs.append('\\N')
+        else:
+            champs.append(str(v).replace('\\', '\\\\').replace('\t', '\\t')
+                          .replace('\n', '\\n').replace('\r', '\\r'))
+    return '\t'.join(champs) + '\n'
+
+
+class FluxCopy:
+    """Fichier en lecture alimenté par un générateur de lignes, pour copy_expert"""
+
+    def __init__(self, lignes):
+        self._lignes = iter(lignes)
+        self._reste = ''
+        self.nb_lignes = 0
+
+    def read(self, taille=-1):
+        morceaux = [self._reste]
+        longueur = len(self._reste)
+        for ligne in self._lignes:
+            morceaux.append(ligne)
+            longueur += len(ligne)
+            self.nb_lignes += 1
+            if 0 < taille <= longueur:
+                break
+        texte = ''.join(morceaux)
+        if taille < 0:
+            taille = len(texte)
+        self._reste = texte[taille:]
+        return texte[:taille]
+
+    readline = read
+
+
+def copier(cur, table, colonnes, lignes):
+    """COPY d'un générateur de tuples dans table ; renvoie le nombre de lignes"""
+    flux = FluxCopy(ligne_copy(v) for v in lignes)
+    cur.copy_expert(f"COPY {table} ({', '.join(colonnes)}) FROM STDIN", flux)
+    return flux.nb_lignes
+
+
+def reserver_ids(cur, table, colonne, nb):
+    """Réserve nb valeurs de la séquence de table.colonne en un seul aller-retour"""
+    cur.execute("select nextval(pg_get_serial_sequence(%s, %s)) from generate_series(1, %s)",
+                (table, colonne, nb))
+    return [row[0] for row in cur.fetchall()]
+
+
+def index_secondaires(cur, tables):
+    """Définitions des index hors clés primaires/uniques des tables"""
     cur.execute("""
-        INSERT INTO scenarios (titre_scenario, description, priorite_loi, difficulte)
-        VALUES (%s, %s, %s, %s) RETURNING id_scenario
-    """, (scen['titre'], scen['description'], scen['priorite_loi'], scen['difficulte']))
-    
-    id_scenario_map[i] = cur.fetchone()[0]
-
-conn.commit()
-print(f"   ✓ {len(scenarios_data)} scénarios insérés")
+        select i.indexname, i.indexdef
+        from pg_indexes i
+        where i.schemaname = 'public' and i.tablename = any(%s)
+          and not exists (select 1 from pg_constraint c where c.conname = i.indexname)
+    """, (list(tables),))
+    # index d'une table partitionnée : « ON ONLY » ne créerait pas ceux des partitions
+    return [(nom, definition.replace(' ON ONLY ', ' ON ', 1)) for nom, definition in cur.fetchall()]
+
+
+def preparer_partitions(cur, debut, fin):
+    """Si actions est partitionnée (script.sql), crée les partitions mensuelles de la période"""
+    cur.execute("select to_regproc('creer_partitions_actions') is not null")
+    if cur.fetchone()[0]:
+        cur.execute("select count(*) from creer_partitions_actions(%s::date, %s::date)", (debut, fin))
+
+
+def mesurer(etiquette, nb, debut):
+    duree = time.perf_counter() - debut
+    print(f"   ✓ {nb} {etiquette} en {duree:.2f}s ({nb / max(duree, 1e-9):,.0f} lignes/s)")
+
+
+def charger_en_masse(conn, nb_robots, nb_humains, nb_actions, lot=1_000_000,
+                     drop_indexes=False):
+    """
+    Écrit dans le schéma de script.sql (celui que lit app.py) : robots,
+    humains et scénarios reçoivent des ids réservés d'avance, puis les actions
+    sont envoyées par COPY en lots de `lot` lignes (un commit par lot).
+    """
+    cur = conn.cursor()
+    debut_total = time.perf_counter()
+
+    index = []
+    if drop_indexes:
+        index = index_secondaires(cur, ['robots', 'humains', 'scenarios', 'actions'])
+        for nom, _ in index:
+            cur.execute(f'drop index if exists "{nom}"')
+        conn.commit()
+        print(f"   ✓ {len(index)} index supprimés pendant le chargement")
+
+    print(f"\n📍 COPY de {nb_robots} robots...")
+    debut = time.perf_counter()
+    ids = reserver_ids(cur, 'robots', 'id_robot', nb_robots)
+    robots = []
+    for i, rid in enumerate(ids):
+        nom, modele, _, etat = tirer_robot(i)
+        # nom_robot est unique : on le suffixe par l'id réservé
+        robots.append((rid, f"{nom}_{rid}", modele, etat))
+    copier(cur, 'robots', ['id_robot', 'nom_robot', 'modele', 'etat'], robots)
+    conn.commit()
+    mesurer('robots', nb_robots, debut)
+
+    print(f"📍 COPY de {nb_humains} humains...")
+    debut = time.perf_counter()
+    humains = reserver_ids(cur, 'humains', 'id_humain', nb_humains)
+    copier(cur, 'humains', ['id_humain', 'nom', 'vulnerabilite', 'localisation'],
+           ((hid, *tirer_humain(i)) for i, hid in enumerate(humains)))
+    conn.commit()
+    mesurer('humains', nb_humains, debut)
+
+    print(f"📍 COPY de {len(scenarios_data)} scénarios...")
+    debut = time.perf_counter()
+    scenarios = reserver_ids(cur, 'scenarios', 'id_scenario', len(scenarios_data))
+    copier(cur, 'scenarios', ['id_scenario', 'description', 'priorite_loi'],
+           ((sid, f"{scen['titre']} : {scen['description']}", scen['priorite_loi'])
+            for sid, scen in zip(scenarios, scenarios_data)))
+    conn.commit()
+    mesurer('scénarios', len(scenarios_data), debut)
+
+    print(f"📍 COPY de {nb_actions} actions par lots de {lot}...")
+    debut = time.perf_counter()
+    origine = datetime.now() - timedelta(days=30)
+    pas = timedelta(days=30) / max(nb_actions, 1)
+    preparer_partitions(cur, origine, datetime.now())
+    conn.commit()
+
+    def actions(premiere, derniere):
+        for i in range(premiere, derniere):
+            rid, _, modele, _ = robots[i % nb_robots]
+            s = i % len(scenarios_data)
+            resultat, _ = tirer_resultat(modele, scenarios_data[s]['priorite_loi'])
+            yield (rid, humains[i % nb_humains], scenarios[s],
+                   scenarios_data[s]['type'].replace('_', ' '), origine + i * pas, resultat)
+
+    for premiere in range(0, nb_actions, lot):
+        derniere = min(premiere + lot, nb_actions)
+        copier(cur, 'actions',
+               ['id_robot', 'id_humain', 'id_scenario', 'action', 'timestamp', 'resultat'],
+               actions(premiere, derniere))
+        conn.commit()
+        ecoule = time.perf_counter() - debut
+        print(f"   … {derniere}/{nb_actions} ({derniere / max(ecoule, 1e-9):,.0f} lignes/s)")
+    mesurer('actions', nb_actions, debut)
+
+    if index:
+        debut = time.perf_counter()
+        for _, definition in index:
+            cur.execute(definition)
+        conn.commit()
+        print(f"   ✓ {len(index)} index recréés en {time.perf_counter() - debut:.2f}s")
+
+    cur.execute("analyze robots, humains, scenarios, actions")
+    conn.commit()
+    cur.close()
+    total = nb_robots + nb_humains + len(scenarios_data) + nb_actions
+    mesurer('lignes au total', total, debut_total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--bulk', action='store_true',
+                        help="chargement par COPY (schéma de script.sql) au lieu d'INSERT ligne par ligne")
+    parser.add_argument('--robots', type=int, default=100)
+    parser.add_argument('--humains', type=int, default=200)
+    parser.add_argument('--actions', type=int, default=300)
+    parser.add_argument('--lot', type=int, default=1_000_000, help="lignes d'actions par COPY (mode bulk)")
+    parser.add_argument('--drop-indexes', action='store_true',
+                        help="supprime les index secondaires pendant le chargement puis les recrée (mode bulk)")
+    args = parser.parse_args()
+
+    conn = connecter()
+
+    print("\n" + "=" * 70)
+    print("🤖 GÉNÉRATION DE DONNÉES ENRICHIES POUR DILEMMES ÉTHIQUES")
+    print("=" * 70)
+
+    if args.bulk:
+        charger_en_masse(conn, args.robots, args.humains, args.actions,
+                         lot=args.lot, drop_indexes=args.drop_indexes)
+    else:
+        inserer_ligne_par_ligne(conn)
 
+    conn.close()
 
-print("📍 Génération de 300 actions avec corrélations réalistes...")
+    print("\n" + "=" * 70)
+    print("✅ DONNÉES ENRICHIES COMPLÈTES ET RÉALISTES POUR DILEMMES ÉTHIQUES")
+    print("=" * 70)
+    print("\n📊 RÉSUMÉ:")
+    print(f"   • {args.robots if args.bulk else 100} robots (5 modèles avec spécialités variées)")
+    print(f"   • {args.humains if args.bulk else 200} humains (10 rôles, 4 niveaux vulnérabilité)")
+    print("   • 28 scénarios éthiques (10 Loi 1, 8 Loi 2, 5 Loi 3, 5 complexes)")
+    print(f"   • {args.actions if args.bulk else 300} actions avec corrélations réalistes")
+    print("\n🎯 Les données reflètent maintenant des dilemmes éthiques profonds!")
+    print("=" * 70 + "\n")
 
-resultats_poids_base = {'succès': 0.50, 'mitigé': 0.30, 'échec': 0.20}
 
-for i in range(300):
-    rid_idx = i % 100
-    rid, modele, specs = id_robot_map[rid_idx]
-    
-    hid_idx = i % 200
-    hid = id_humain_map[hid_idx]
-    
-    sid_idx = i % len(scenarios_data)
-    sid = id_scenario_map[sid_idx]
-    
-    scen = scenarios_data[sid_idx]
-    priorite_loi = scen['priorite_loi']
-    
-    if modele == 'Humanoid-Y' and priorite_loi == 1:
-        resultat = random.choices(
-            list(resultats_poids_base.keys()),
-            weights=[0.75, 0.18, 0.07]
-        )[0]
-        temps = random.randint(100, 3000) if resultat == 'succès' else random.randint(200, 5000)
-    elif modele == 'Combat-B' and priorite_loi == 2:
-        resultat = random.choices(
-            list(resultats_poids_base.keys()),
-            weights=[0.72, 0.22, 0.06]
-        )[0]
-        temps = random.randint(50, 2000)
-    elif modele == 'Industrial-Z':
-        resultat = random.choices(
-            list(resultats_poids_base.keys()),
-            weights=[0.55, 0.32, 0.13]
-        )[0]
-        temps = random.randint(150, 4000)
-    elif modele == 'Service-A':
-        resultat = random.choices(
-            list(resultats_poids_base.keys()),
-            weights=[0.68, 0.25, 0.07]
-        )[0]
-        temps = random.randint(100, 3500)
-    else:
-        resultat = random.choices(
-            list(resultats_poids_base.keys()),
-            weights=list(resultats_poids_base.values())
-        )[0]
-        temps = random.randint(100, 4000)
-    
-    cur.execute("""
-        INSERT INTO actions (id_robot, id_humain, id_scenario, resultat, temps_execution_ms)
-        VALUES (%s, %s, %s, %s, %s)
-    """, (rid, hid, sid, resultat, temps))
-
-conn.commit()
-print(f"   ✓ 300 actions diversifiées insérées")
-
-
-cur.close()
-conn.close()
-
-print("\n" + "=" * 70)
-print("✅ DONNÉES ENRICHIES COMPLÈTES ET RÉALISTES POUR DILEMMES ÉTHIQUES")
-print("=" * 70)
-print("\n📊 RÉSUMÉ:")
-print("   • 100 robots (5 modèles avec spécialités variées)")
-print("   • 200 humains (10 rôles, 4 niveaux vulnérabilité)")
-print("   • 28 scénarios éthiques (10 Loi 1, 8 Loi 2, 5 Loi 3, 5 complexes)")
-print("   • 300 actions avec corrélations réalistes")
-print("\n🎯 Les données reflètent maintenant des dilemmes éthiques profonds!")
-print("=" * 70 + "\n")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+Jeu de données synthétique reproductible pour les benchmarks
+
+    python generer_dataset.py generer --scale 50 --seed 42      # 50M actions
+    python generer_dataset.py charger donnees/scale-50-seed-42 --vider --drop-indexes
+
+`--scale 1` correspond à 1000 robots, 10 000 humains et 1 000 000 d'actions
+(les 28 scénarios de fill_db_enhanced.py ne dépendent pas de l'échelle). Le
+même couple (scale, seed) redonne toujours les mêmes fichiers, quel que soit
+le nombre de processus. Les fichiers sont au format texte de COPY, dans le
+schéma de script.sql, et un manifest.json les décrit.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+from db import connecter
+from fill_db_enhanced import (index_secondaires, ligne_copy, mesurer, poids_resultat,
+                              preparer_partitions, resultats_poids_base, roles_humains, scenarios_data,
+                              secteurs_contexte, specialites_robots)
+
+ROBOTS_PAR_SCALE = 1000
+HUMAINS_PAR_SCALE = 10_000
+ACTIONS_PAR_SCALE = 1_000_000
+# version des fichiers : 2 depuis les codes enum de script.sql (succes, actif, faible...)
+FORMAT = 2
+
+MODELES = list(specialites_robots)
+RESULTATS = list(resultats_poids_base)
+ETATS_ROBOTS = (['actif', 'maintenance', 'hors_service', 'retraite'], [0.65, 0.20, 0.10, 0.05])
+VULNERABILITES = (['faible', 'moyenne', 'elevee'], [0.35, 0.45, 0.20])
+SECTEURS = list(secteurs_contexte)
+
+# activité relative par heure de la journée (creux la nuit, pic l'après-midi)
+# et par jour de la semaine (lundi = 0)
+PROFIL_HEURES = np.array([0.15, 0.10, 0.08, 0.08, 0.10, 0.20, 0.45, 0.75, 0.95, 1.00, 1.00, 0.95,
+                          0.85, 0.90, 1.00, 1.00, 0.95, 0.85, 0.70, 0.55, 0.45, 0.35, 0.25, 0.20])
+PROFIL_JOURS = np.array([1.00, 1.00, 1.00, 0.95, 0.90, 0.55, 0.45])
+
+COLONNES = {
+    'robots': ['id_robot', 'nom_robot', 'modele', 'etat'],
+    'humains': ['id_humain', 'nom', 'vulnerabilite', 'localisation'],
+    'scenarios': ['id_scenario', 'description', 'priorite_loi'],
+    'actions': ['id_action', 'id_robot', 'id_humain', 'id_scenario', 'action', 'timestamp', 'resultat'],
+}
+
+
+def tailles(scale):
+    return {
+        'robots': max(len(MODELES), round(ROBOTS_PAR_SCALE * scale)),
+        'humains': max(1, round(HUMAINS_PAR_SCALE * scale)),
+        'scenarios': len(scenarios_data),
+        'actions': max(1, round(ACTIONS_PAR_SCALE * scale)),
+    }
+
+
+def table_probabilites():
+    """Probabilités cumulées des résultats, indexées par [modèle, loi]"""
+    lois = sorted({s['priorite_loi'] for s in scenarios_data})
+    table = np.zeros((len(MODELES), max(lois) + 1, len(RESULTATS)))
+    for m, modele in enumerate(MODELES):
+        for loi in lois:
+            poids, _, _ = poids_resultat(modele, loi)
+            table[m, loi] = np.cumsum(poids) / sum(poids)
+    return table
+
+
+def ecrire_copy(chemin, lignes):
+    with open(chemin, 'w', encoding='utf-8', newline='\n') as f:
+        for valeurs in lignes:
+            f.write(ligne_copy(valeurs))
+
+
+def generer_referentiels(rng, n, dossier):
+    """robots, humains et scénarios ; renvoie le modèle de chaque robot"""
+    modeles = rng.integers(0, len(MODELES), n['robots'])
+    modeles[:len(MODELES)] = np.arange(len(MODELES))
+    etats = rng.choice(len(ETATS_ROBOTS[0]), n['robots'], p=ETATS_ROBOTS[1])
+    ecrire_copy(os.path.join(dossier, 'robots.tsv'), (
+        (i + 1, f"R{i + 1:06d}_{MODELES[m]}", MODELES[m], ETATS_ROBOTS[0][e])
+        for i, (m, e) in enumerate(zip(modeles.tolist(), etats.tolist()))))
+
+    vulns = rng.choice(len(VULNERABILITES[0]), n['humains'], p=VULNERABILITES[1])
+    secteurs = rng.integers(0, len(SECTEURS), n['humains'])
+    roles = rng.integers(0, len(roles_humains), n['humains'])
+    ecrire_copy(os.path.join(dossier, 'humains.tsv'), (
+        (i + 1, f"H{i + 1:07d}_{roles_humains[r]}_{SECTEURS[s][:3]}",
+         VULNERABILITES[0][v], SECTEURS[s])
+        for i, (v, s, r) in enumerate(zip(vulns.tolist(), secteurs.tolist(), roles.tolist()))))
+
+    ecrire_copy(os.path.join(dossier, 'scenarios.tsv'), (
+        (i + 1, f"{s['titre']} : {s['description']}", s['priorite_loi'])
+        for i, s in enumerate(scenarios_data)))
+    return modeles
+
+
+def horodatages(rng, debut, fin, nb):
+    """
+    nb instants triés dans [debut, fin[ (secondes epoch), tirés par rejet
+    selon les profils horaire et hebdomadaire
+    """
+    maxi = PROFIL_HEURES.max() * PROFIL_JOURS.max()
+    retenus = []
+    reste = nb
+    while reste > 0:
+        t = rng.integers(debut, fin, int(reste * 2.2) + 16)
+        heures = (t // 3600) % 24
+        jours = (t // 86400 + 3) % 7          # le 1er janvier 1970 était un jeudi
+        garde = rng.random(t.size) * maxi < PROFIL_HEURES[heures] * PROFIL_JOURS[jours]
+        t = t[garde][:reste]
+        retenus.append(t)
+        reste -= t.size
+    t = np.concatenate(retenus)
+    t.sort()
+    return t
+
+
+def generer_lot(tache):
+    """Un fichier d'actions : ids [premier, premier + nb[ sur leur tranche de temps"""
+    graine, chemin, premier, nb, debut, fin, modeles, n = tache
+    rng = np.random.default_rng(graine)
+
+    robots = rng.integers(0, n['robots'], nb)
+    humains = rng.integers(0, n['humains'], nb) + 1
+    scenarios = rng.integers(0, n['scenarios'], nb)
+    lois = np.array([s['priorite_loi'] for s in scenarios_data])[scenarios]
+    cumul = table_probabilites()[modeles[robots], lois]
+    resultats = (rng.random(nb)[:, None] > cumul).sum(axis=1).clip(0, len(RESULTATS) - 1)
+    instants = horodatages(rng, debut, fin, nb).astype('datetime64[s]')
+
+    types = np.array([s['type'].replace('_', ' ') for s in scenarios_data], dtype=object)
+    colonnes = [
+        np.arange(premier, premier + nb).astype(str),
+        (robots + 1).astype(str),
+        humains.astype(str),
+        (scenarios + 1).astype(str),
+        types[scenarios],
+        np.datetime_as_string(instants),
+        np.array(RESULTATS, dtype=object)[resultats],
+    ]
+    with open(chemin, 'w', encoding='utf-8', newline='\n') as f:
+        f.write('\n'.join(map('\t'.join, zip(*colonnes))))
+        f.write('\n')
+    return chemin, nb
+
+
+def generer(scale, seed, dossier, processus=None, lot=1_000_000,
+            debut='2025-01-01', fin='2026-01-01'):
+    n = tailles(scale)
+    os.makedirs(dossier, exist_ok=True)
+    racine = np.random.SeedSequence(seed)
+    graine_ref, graine_actions = racine.spawn(2)
+
+    print(f"\n📍 Référentiels : {n['robots']} robots, {n['humains']} humains, "
+          f"{n['scenarios']} scénarios...")
+    depart = time.perf_counter()
+    modeles = generer_referentiels(np.random.default_rng(graine_ref), n, dossier)
+    mesurer('lignes de référentiel', n['robots'] + n['humains'] + n['scenarios'], depart)
+
+    t0 = int(datetime.fromisoformat(debut).replace(tzinfo=timezone.utc).timestamp())
+    t1 = int(datetime.fromisoformat(fin).replace(tzinfo=timezone.utc).timestamp())
+    nb_lots = -(-n['actions'] // lot)
+    graines = graine_actions.spawn(nb_lots)
+    taches = []
+    for k in range(nb_lots):
+        premier = k * lot
+        nb = min(lot, n['actions'] - premier)
+        # chaque lot couvre sa part de la période : les ids suivent le temps
+        taches.append((graines[k], os.path.join(dossier, f'actions-{k:05d}.tsv'), premier + 1, nb,
+                       t0 + (t1 - t0) * premier // n['actions'],
+                       t0 + (t1 - t0) * (premier + nb) // n['actions'], modeles, n))
+
+    print(f"📍 {n['actions']} actions en {nb_lots} fichiers...")
+    depart = time.perf_counter()
+    fichiers = []
+    with ProcessPoolExecutor(max_workers=processus) as pool:
+        for chemin, nb in pool.map(generer_lot, taches):
+            fichiers.append({'table': 'actions', 'fichier': os.path.basename(chemin), 'lignes': nb})
+    mesurer('actions', n['actions'], depart)
+
+    manifest = {
+        'format': FORMAT,
+        'scale': scale,
+        'seed': seed,
+        'lot': lot,
+        'periode': [debut, fin],
+        'tailles': n,
+        'colonnes': COLONNES,
+        'fichiers': [{'table': t, 'fichier': f'{t}.tsv', 'lignes': n[t]}
+                     for t in ('robots', 'humains', 'scenarios')] + fichiers,
+    }
+    with open(os.path.join(dossier, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    print(f"   ✓ jeu de données écrit dans {dossier}")
+    return manifest
+
+
+def a_jour(dossier):
+    """Le dossier contient un jeu complet au format courant"""
+    try:
+        with open(os.path.join(dossier, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f).get('format') == FORMAT
+    except FileNotFoundError:
+        return False
+
+
+def charger(dossier, vider=False, drop_indexes=False, sans_triggers=False):
+    """
+    COPY des fichiers d'un jeu généré dans les tables de script.sql. Avec
+    sans_triggers, compteurs, rollup et séries ne sont pas tenus pendant le
+    COPY mais reconstruits d'un coup à la fin.
+    """
+    with open(os.path.join(dossier, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT:
+        raise ValueError(f'{dossier} : jeu au format {manifest.get("format", 1)}, '
+                         f'{FORMAT} attendu, le régénérer')
+    conn = connecter()
+    cur = conn.cursor()
+    tables = ['robots', 'humains', 'scenarios', 'actions']
+    depart_total = time.perf_counter()
+
+    if vider:
+        cur.execute('truncate actions, robots, humains, scenarios restart identity')
+    else:
+        cur.execute('select exists (select 1 from actions) or exists (select 1 from robots) '
+                    'or exists (select 1 from humains) or exists (select 1 from scenarios)')
+        if cur.fetchone()[0]:
+            raise SystemExit('les tables ne sont pas vides (ids fixés par le jeu) : utiliser --vider')
+    conn.commit()
+
+    index = []
+    if drop_indexes:
+        index = index_secondaires(cur, tables)
+        for nom, _ in index:
+            cur.execute(f'drop index if exists "{nom}"')
+        conn.commit()
+        print(f"   ✓ {len(index)} index supprimés pendant le chargement")
+
+    if sans_triggers:
+        for table in tables:
+            cur.execute(f'alter table {table} disable trigger user')
+        conn.commit()
+
+    preparer_partitions(cur, *manifest['periode'])
+    conn.commit()
+
+    for table in tables:
+        depart = time.perf_counter()
+        total = 0
+        for entree in manifest['fichiers']:
+            if entree['table'] != table:
+                continue
+            with open(os.path.join(dossier, entree['fichier']), encoding='utf-8') as f:
+                cur.copy_expert(f"COPY {table} ({', '.join(manifest['colonnes'][table])}) FROM STDIN", f)
+            conn.commit()
+            total += entree['lignes']
+        mesurer(table, total, depart)
+
+    for table, colonne in (('robots', 'id_robot'), ('humains', 'id_humain'),
+                           ('scenarios', 'id_scenario'), ('actions', 'id_action')):
+        cur.execute(f"select setval(pg_get_serial_sequence(%s, %s), "
+                    f"coalesce((select max({colonne}) from {table}), 0) + 1, false)",
+                    (table, colonne))
+
+    if index:
+        depart = time.perf_counter()
+        for _, definition in index:
+            cur.execute(definition)
+        conn.commit()
+        print(f"   ✓ {len(index)} index recréés en {time.perf_counter() - depart:.2f}s")
+
+    if sans_triggers:
+        depart = time.perf_counter()
+        for table in tables:
+            cur.execute(f'alter table {table} enable trigger user')
+        cur.execute('select reconstruire_rollup_actions()')
+        cur.execute('select reconstruire_series_actions()')
+        cur.execute('select reconstruire_recommandations()')
+        cur.execute('select count(*) from reconcilier_compteurs()')
+        # instruction vide : les triggers par instruction publient une nouvelle version
+        cur.execute('delete from actions where false')
+        conn.commit()
+        print(f"   ✓ rollup, séries, recommandations et compteurs reconstruits en {time.perf_counter() - depart:.2f}s")
+
+    cur.execute('analyze robots, humains, scenarios, actions')
+    conn.commit()
+    conn.close()
+    mesurer('lignes au total', sum(e['lignes'] for e in manifest['fichiers']), depart_total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    commandes = parser.add_subparsers(dest='commande', required=True)
+
+    gen = commandes.add_parser('generer', help='écrit un jeu de données sur disque')
+    gen.add_argument('--scale', type=float, default=1.0,
+                     help=f'{ACTIONS_PAR_SCALE} actions par unité (défaut 1)')
+    gen.add_argument('--seed', type=int, default=42)
+    gen.add_argument('--sortie', help='dossier de sortie (défaut donnees/scale-<scale>-seed-<seed>)')
+    gen.add_argument('--processus', type=int, default=None, help='défaut : nombre de CPU')
+    gen.add_argument('--lot', type=int, default=1_000_000, help="actions par fichier")
+    gen.add_argument('--debut', default='2025-01-01')
+    gen.add_argument('--fin', default='2026-01-01')
+
+    ch = commandes.add_parser('charger', help='COPY un jeu de données dans la base')
+    ch.add_argument('dossier')
+    ch.add_argument('--vider', action='store_true', help='truncate des quatre tables avant chargement')
+    ch.add_argument('--drop-indexes', action='store_true',
+                    help='supprime les index secondaires pendant le chargement puis les recrée')
+    ch.add_argument('--sans-triggers', action='store_true',
+                    help='désactive les triggers pendant le COPY puis reconstruit rollup et compteurs')
+    args = parser.parse_args()
+
+    if args.commande == 'generer':
+        dossier = args.sortie or os.path.join('donnees', f'scale-{args.scale:g}-seed-{args.seed}')
+        generer(args.scale, args.seed, dossier, args.processus, args.lot, args.debut, args.fin)
+    else:
+        charger(args.dossier, args.vider, args.drop_indexes, args.sans_triggers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+"""
+Écriture des actions reçues par POST /api/actions : les lignes validées sont
+mises en tampon en mémoire et un thread les écrit dans `actions` par COPY,
+dès qu'un lot est plein ou que l'intervalle est écoulé (write-behind)
+"""
+import atexit
+import io
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+import psycopg2
+
+import codes
+from db import connecter
+
+log = logging.getLogger(__name__)
+
+CHAMPS = ('id_robot', 'id_humain', 'id_scenario', 'action', 'timestamp', 'resultat')
+COLONNES = ('id_action',) + CHAMPS
+ACTION_MAX = 500
+LOT_MAX = 10_000
+
+# tampon : réponse 202 dès la mise en tampon (perdu si le processus s'arrête brutalement)
+# commit : réponse 201 une fois le COPY qui contient les lignes validé
+DURABILITES = ('tampon', 'commit')
+DURABILITE = os.environ.get('COLONIE_INGEST_DURABILITY', 'tampon')
+DELAI_COMMIT = float(os.environ.get('COLONIE_INGEST_COMMIT_TIMEOUT', 10))
+
+
+class ActionsInvalides(ValueError):
+    """Au moins une action refusée : rien n'est écrit (réponse 400)"""
+
+    def __init__(self, erreurs):
+        super().__init__(f'{len(erreurs)} action(s) invalide(s)')
+        self.erreurs = erreurs
+
+
+class TamponPlein(Exception):
+    """Le tampon n'a pas assez de place libre : réessayer plus tard (429)"""
+
+
+class EcritureIndisponible(Exception):
+    """PostgreSQL n'accepte pas les écritures en ce moment (503)"""
+
+
+# bornes [debut, fin[ des partitions de actions (script.sql)
+PARTITIONS = r"""
+    select b[1]::timestamp, b[2]::timestamp
+    from pg_inherits i
+    join pg_class c on c.oid = i.inhrelid
+    cross join regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \(''(.*)''\) TO \(''(.*)''\)') b
+    where i.inhparent = 'actions'::regclass
+    order by 1
+"""
+
+
+class Referentiel:
+    """
+    Identifiants des robots, humains et scénarios, et partitions mensuelles
+    de actions, gardés en mémoire pour valider sans aller-retour vers la
+    base. Une référence inconnue ou un timestamp sans partition provoque un
+    rechargement, au plus une fois par `delai` secondes.
+    """
+
+    TABLES = {'id_robot': 'robots', 'id_humain': 'humains', 'id_scenario': 'scenarios'}
+
+    def __init__(self, delai=1.0):
+        self.delai = delai
+        self._ids = None
+        self._partitions = None    # None : actions n'est pas partitionnée
+        self._charge_le = 0.0
+        self._verrou = threading.Lock()
+
+    def _charger(self):
+        try:
+            conn = connecter()
+            try:
+                cur = conn.cursor()
+                ids = {}
+                for colonne, table in self.TABLES.items():
+                    cur.execute(f'select {colonne} from {table}')
+                    ids[colonne] = frozenset(ligne[0] for ligne in cur)
+                cur.execute("select relkind = 'p' from pg_class where oid = 'actions'::regclass")
+                partitionnee, = cur.fetchone()
+                cur.execute(PARTITIONS)
+                partitions = cur.fetchall() if partitionnee else None
+            finally:
+                conn.close()
+        except psycopg2.OperationalError as error:
+            # comme pour l'écriture : 503, pas une erreur interne
+            raise EcritureIndisponible(f'validation impossible, base injoignable : {error}')
+        self._ids = ids
+        self._partitions = partitions
+        self._charge_le = time.monotonic()
+
+    def inconnus(self, lignes):
+        """(index, colonne, valeur) des références absentes de la base"""
+        def chercher():
+            return [(i, colonne, ligne[j])
+                    for i, ligne in enumerate(lignes)
+                    for j, colonne in enumerate(self.TABLES)
+                    if ligne[j] not in self._ids[colonne]]
+        return self._verifier(chercher)
+
+    def hors_partitions(self, lignes):
+        """
+        Index des lignes dont le timestamp ne tombe dans aucune partition :
+        PostgreSQL les refuserait au COPY, après la réponse 202
+        """
+        def chercher():
+            if self._partitions is None:
+                return []
+            debuts = [debut for debut, _ in self._partitions]
+            hors = []
+            for i, ligne in enumerate(lignes):
+                k = bisect_right(debuts, ligne[4]) - 1
+                if k < 0 or ligne[4] >= self._partitions[k][1]:
+                    hors.append(i)
+            return hors
+        return self._verifier(chercher)
+
+    def _verifier(self, chercher):
+        with self._verrou:
+            if self._ids is None:
+                self._charger()
+            manquants = chercher()
+            if manquants and time.monotonic() - self._charge_le > self.delai:
+                self._charger()
+                manquants = chercher()
+        return manquants
+
+
+def _entier(valeur):
+    return isinstance(valeur, int) and not isinstance(valeur, bool) and valeur > 0
+
+
+def _timestamp(valeur):
+    """Horodatage ISO 8601 ; avec un fuseau, converti en UTC (colonne sans fuseau)"""
+    ts = datetime.fromisoformat(valeur)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def valider(donnees, referentiel):
+    """
+    Une action (objet JSON) ou un lot (liste, ou {"actions": [...]}) ; renvoie
+    les tuples dans l'ordre de CHAMPS ou lève ActionsInvalides
+    """
+    if isinstance(donnees, dict) and isinstance(donnees.get('actions'), list):
+        donnees = donnees['actions']
+    elif isinstance(donnees, dict):
+        donnees = [donnees]
+    if not isinstance(donnees, list) or not donnees:
+        raise ActionsInvalides([{'index': None, 'erreur': 'objet ou liste non vide attendu'}])
+    if len(donnees) > LOT_MAX:
+        raise ActionsInvalides([{'index': None, 'erreur': f'{LOT_MAX} actions au plus par requête'}])
+
+    maintenant = datetime.now(timezone.utc).replace(tzinfo=None)
+    lignes, erreurs = [], []
+    for i, action in enumerate(donnees):
+        if not isinstance(action, dict):
+            erreurs.append({'index': i, 'erreur': 'objet attendu'})
+            continue
+        problemes = [f'champ inconnu : {champ}' for champ in action if champ not in CHAMPS]
+        for champ in ('id_robot', 'id_humain', 'id_scenario'):
+            if not _entier(action.get(champ)):
+                problemes.append(f'{champ} : entier positif attendu')
+        texte = action.get('action')
+        if not isinstance(texte, str) or not texte.strip() or len(texte) > ACTION_MAX:
+            problemes.append(f'action : texte non vide de {ACTION_MAX} caractères au plus attendu')
+        resultat = codes.code('resultat_action', action.get('resultat'))
+        if resultat is None:
+            problemes.append(f"resultat : une valeur parmi {', '.join(codes.RESULTATS)} attendue")
+        ts = maintenant
+        if action.get('timestamp') is not None:
+            try:
+                ts = _timestamp(action['timestamp'])
+            except (TypeError, ValueError):
+                problemes.append('timestamp : date ISO 8601 attendue')
+        if problemes:
+            erreurs.append({'index': i, 'erreur': ' ; '.join(problemes)})
+        else:
+            lignes.append((action['id_robot'], action['id_humain'], action['id_scenario'],
+                           texte, ts, resultat))
+
+    if not erreurs:
+        erreurs = [{'index': i, 'erreur': f'{colonne} {valeur} inexistant'}
+                   for i, colonne, valeur in referentiel.inconnus(lignes)]
+        erreurs += [{'index': i, 'erreur': f'timestamp {lignes[i][4].isoformat()} : '
+                                           'aucune partition de actions pour ce mois'}
+                    for i in referentiel.hors_partitions(lignes)]
+    if erreurs:
+        raise ActionsInvalides(erreurs)
+    return lignes
+
+
+def _ligne_copy(valeurs):
+    """Une ligne au format texte de COPY (tabulations, \\N pour NULL)"""
+    champs = []
+    for v in valeurs:
+        if v is None:
+            champs.append('\\N')
+        else:
+            champs.append(str(v).replace('\\', '\\\\').replace('\t', '\\t')
+                          .replace('\n', '\\n').replace('\r', '\\r'))
+    return '\t'.join(champs) + '\n'
+
+
+class TamponEcriture(threading.Thread):
+    """
+    Tampon borné de lignes à écrire et thread qui le vide.
+
+    - `ajouter()` met un lot de lignes en tampon ; si la place manque, attend
+      au plus `attente` secondes puis lève TamponPlein
+    - le thread écrit par COPY dès que `lot` lignes attendent, ou quand la
+      plus ancienne attend depuis `intervalle` secondes
+    - les identifiants sont réservés sur la séquence avant le COPY : un appel
+      qui attend le commit reçoit les id_action de ses lignes
+    - si le COPY échoue sur une ligne (robot supprimé entre-temps...), le lot
+      est réécrit ligne à ligne et seules les lignes fautives sont perdues
+    - si la base est injoignable, les lignes restent en tampon et l'écriture
+      est retentée ; les appels qui attendent un commit sont refusés
+    - `synchronous_commit=False` n'attend pas le flush du WAL pour les lots
+      sans appel en attente de commit
+    """
+
+    def __init__(self, capacite=100_000, lot=5000, intervalle=0.2, synchronous_commit=True):
+        super().__init__(name='ecriture-actions', daemon=True)
+        if lot > capacite:
+            raise ValueError('il faut lot <= capacite')
+        self.capacite = capacite
+        self.lot = lot
+        self.intervalle = intervalle
+        self.synchronous_commit = synchronous_commit
+        self._file = []            # (lignes, futur ou None)
+        self._nb = 0               # lignes en tampon ou en cours d'écriture
+        self._premier = None       # arrivée de la plus ancienne ligne en tampon
+        self._cond = threading.Condition()
+        self._ferme = False
+        self._conn = None
+        self.indisponible = False
+        self.stats = {'recues': 0, 'ecrites': 0, 'rejetees': 0, 'refusees': 0,
+                      'copies': 0, 'erreurs': 0, 'derniere_copie_ms': 0.0}
+
+    def ajouter(self, lignes, attendre_commit=False, attente=0.0):
+        """Met des lignes en tampon ; renvoie un Future des id_action si attendre_commit"""
+        if attendre_commit and self.indisponible:
+            raise EcritureIndisponible("la base n'accepte pas les écritures, réessayez")
+        limite = time.monotonic() + attente
+        with self._cond:
+            if self._ferme:
+                raise EcritureIndisponible('écriture arrêtée')
+            while self._nb + len(lignes) > self.capacite:
+                reste = limite - time.monotonic()
+                if reste <= 0:
+                    self.stats['refusees'] += len(lignes)
+                    raise TamponPlein(f'{self._nb} lignes en attente d\'écriture '
+                                      f'(capacité {self.capacite})')
+                self._cond.wait(reste)
+            futur = Future() if attendre_commit else None
+            self._file.append((lignes, futur))
+            if self._premier is None:
+                self._premier = time.monotonic()
+            self._nb += len(lignes)
+            self.stats['recues'] += len(lignes)
+            self._cond.notify_all()
+        return futur
+
+    def _prendre(self):
+        """Attend un lot complet ou l'échéance, et retire les appels à écrire"""
+        with self._cond:
+            while not self._ferme:
+                if self._nb >= self.lot:
+                    break
+                if self._premier is not None:
+                    reste = self._premier + self.intervalle - time.monotonic()
+                    if reste <= 0:
+                        break
+                    self._cond.wait(reste)
+                else:
+                    self._cond.wait()
+            pris, nb = [], 0
+            while self._file and (not pris or nb + len(self._file[0][0]) <= self.lot):
+                lignes, futur = self._file.pop(0)
+                pris.append((lignes, futur))
+                nb += len(lignes)
+            self._premier = time.monotonic() if self._file else None
+            return pris
+
+    def run(self):
+        while True:
+            pris = self._prendre()
+            if not pris:
+                return
+            nb = sum(len(lignes) for lignes, _ in pris)
+            try:
+                self._ecrire(pris)
+            finally:
+                with self._cond:
+                    self._nb -= nb
+                    self._cond.notify_all()
+
+    def _connexion(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = connecter(application_name='colonie-ingestion')
+        return self._conn
+
+    def _ecrire(self, pris):
+        lignes = [ligne for lot, _ in pris for ligne in lot]
+        synchrone = self.synchronous_commit or any(futur for _, futur in pris)
+        attente = 0.5
+        while True:
+            try:
+                conn = self._connexion()
+                ids = self._copier(conn, lignes, synchrone)
+                self.indisponible = False
+                break
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as error:
+                self.stats['erreurs'] += 1
+                self.indisponible = True
+                self._conn = None
+                log.warning('écriture de %d actions impossible : %s', len(lignes), error)
+                if self._ferme:
+                    ids = [None] * len(lignes)
+                    self.stats['rejetees'] += len(lignes)
+                    break
+                time.sleep(attente)
+                attente = min(attente * 2, 5.0)
+            except psycopg2.Error:
+                log.exception('écriture de %d actions abandonnée', len(lignes))
+                self.stats['erreurs'] += 1
+                self.stats['rejetees'] += len(lignes)
+                if self._conn is not None and not self._conn.closed:
+                    self._conn.rollback()
+                ids = [None] * len(lignes)
+                break
+
+        debut = 0
+        for lot, futur in pris:
+            if futur is not None:
+                futur.set_result(ids[debut:debut + len(lot)])
+            debut += len(lot)
+
+    def _copier(self, conn, lignes, synchrone):
+        debut = time.perf_counter()
+        cur = conn.cursor()
+        if not synchrone:
+            cur.execute('set local synchronous_commit = off')
+        cur.execute("select nextval(pg_get_serial_sequence('actions', 'id_action')) "
+                    "from generate_series(1, %s)", (len(lignes),))
+        ids = [ligne[0] for ligne in cur.fetchall()]
+        flux = io.StringIO(''.join(_ligne_copy((i,) + ligne) for i, ligne in zip(ids, lignes)))
+        try:
+            cur.copy_expert(f"copy actions ({', '.join(COLONNES)}) from stdin", flux)
+        except (psycopg2.DataError, psycopg2.IntegrityError) as error:
+            log.warning('COPY refusé (%s) : écriture ligne à ligne', error)
+            conn.rollback()
+            ids = self._inserer_une_a_une(cur, ids, lignes, synchrone)
+        conn.commit()
+        cur.close()
+        self.stats['copies'] += 1
+        self.stats['ecrites'] += sum(i is not None for i in ids)
+        self.stats['derniere_copie_ms'] = round((time.perf_counter() - debut) * 1000, 2)
+        return ids
+
+    def _inserer_une_a_une(self, cur, ids, lignes, synchrone):
+        if not synchrone:
+            cur.execute('set local synchronous_commit = off')
+        requete = (f"insert into actions ({', '.join(COLONNES)}) "
+                   f"values ({', '.join(['%s'] * len(COLONNES))})")
+        ecrits = []
+        for id_action, ligne in zip(ids, lignes):
+            cur.execute('savepoint ligne')
+            try:
+                cur.execute(requete, (id_action,) + ligne)
+                ecrits.append(id_action)
+            except (psycopg2.DataError, psycopg2.IntegrityError) as error:
+                cur.execute('rollback to savepoint ligne')
+                log.warning('action rejetée %s : %s', ligne, error)
+                self.stats['rejetees'] += 1
+                ecrits.append(None)
+        return ecrits
+
+    def arreter(self, timeout=10.0):
+        """Écrit ce qui reste en tampon puis arrête le thread"""
+        with self._cond:
+            self._ferme = True
+            self._cond.notify_all()
+        if self.is_alive():
+            self.join(timeout)
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+
+    def etat(self):
+        with self._cond:
+            return {'capacite': self.capacite, 'lot': self.lot,
+                    'intervalle_ms': self.intervalle * 1000, 'en_attente': self._nb,
+                    'indisponible': self.indisponible, **self.stats}
+
+
+referentiel = Referentiel()
+_tampon = None
+_verrou = threading.Lock()
+
+
+def get_tampon():
+    """Tampon partagé par le processus, démarré à la première utilisation"""
+    global _tampon
+    with _verrou:
+        if _tampon is None:
+            _tampon = TamponEcriture(
+                capacite=int(os.environ.get('COLONIE_INGEST_BUFFER', 100_000)),
+                lot=int(os.environ.get('COLONIE_INGEST_BATCH', 5000)),
+                intervalle=float(os.environ.get('COLONIE_INGEST_FLUSH_MS', 200)) / 1000,
+                synchronous_commit=os.environ.get('COLONIE_INGEST_SYNC_COMMIT', 'on') != 'off',
+            )
+            _tampon.start()
+            atexit.register(_tampon.arreter)
+        return _tampon
+
+
+def soumettre(donnees, durabilite, attente=0.0):
+    """Valide puis met en tampon ; renvoie (nombre de lignes, Future des ids ou None)"""
+    lignes = valider(donnees, referentiel)
+    futur = get_tampon().ajouter(lignes, attendre_commit=durabilite == 'commit', attente=attente)
+    return len(lignes), futur
+
+
+def arreter():
+    """Écrit ce qui reste en tampon, s'il a été démarré"""
+    if _tampon is not None:
+        _tampon.arreter()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""
+Instantanés en colonnes de la base, pour les analyses hors production
+
+    python instantane.py exporter donnees/instantane
+    python instantane.py indicateurs donnees/instantane --depuis 2025-06-01
+
+`exporter` écrit `actions` (une partition par mois) et les tables robots,
+humains et scénarios, dans une seule transaction en lecture seule : un
+fichier .npy par colonne et par partition, décrit par manifest.json. Les
+fichiers sont compressés par codage et restent projetables en mémoire
+(np.load(mmap_mode='r')) :
+- catégories (action, résultat, modèle...) : dictionnaire du manifest et
+  codes entiers ;
+- entiers et horodatages (en millisecondes) : écart au minimum de la
+  partition, dans le plus petit type entier non signé qui le contient.
+
+La lecture (`Instantane`) ne touche que les colonnes demandées et celles des
+filtres, et saute les partitions que les minimums/maximums du manifest
+excluent. Un identifiant absent (id_robot null...) est lu -1.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+import codes
+from colonnes_actions import copier_actions, pourcentage
+from db import connecter
+
+FORMAT = 1
+EPOQUE = datetime(1970, 1, 1)
+
+# table : [(colonne, type)] ; texte : chaîne propre à chaque ligne
+DIMENSIONS = {
+    'robots': [('id_robot', 'entier'), ('nom_robot', 'texte'), ('modele', 'categorie'),
+               ('etat', 'categorie')],
+    'humains': [('id_humain', 'entier'), ('nom', 'texte'), ('vulnerabilite', 'categorie'),
+                ('localisation', 'categorie')],
+    'scenarios': [('id_scenario', 'entier'), ('description', 'texte'), ('priorite_loi', 'entier')],
+}
+ACTIONS = [('id_action', 'entier'), ('id_robot', 'entier'), ('id_humain', 'entier'),
+           ('id_scenario', 'entier'), ('action', 'categorie'), ('timestamp', 'horodatage'),
+           ('resultat', 'categorie')]
+
+
+# ============================================================================
+# Écriture
+# ============================================================================
+
+def _encoder(valeurs, type):
+    """(tableau à écrire, métadonnées de la colonne dans la partition)"""
+    if type == 'texte':
+        return np.array(valeurs, dtype=str), {}
+    valeurs = np.asarray(valeurs, dtype=np.int64)
+    if type == 'categorie':
+        return valeurs.astype(np.min_scalar_type(max(int(valeurs.max(initial=0)), 0))), \
+            {'codes': sorted(int(c) for c in np.unique(valeurs))}
+    mini, maxi = (int(valeurs.min()), int(valeurs.max())) if len(valeurs) else (0, 0)
+    return (valeurs - mini).astype(np.min_scalar_type(maxi - mini)), {'base': mini, 'min': mini, 'max': maxi}
+
+
+def _ecrire_partition(dossier, colonnes, types, valeurs):
+    os.makedirs(dossier, exist_ok=True)
+    meta = {}
+    for colonne, type in zip(colonnes, types):
+        tableau, meta[colonne] = _encoder(valeurs[colonne], type)
+        np.save(os.path.join(dossier, f'{colonne}.npy'), tableau)
+    return meta
+
+
+def _exporter_dimension(cur, racine, table, colonnes):
+    noms = [c for c, _ in colonnes]
+    cur.execute(f"select {', '.join(noms)} from {table} order by 1")
+    lignes = cur.fetchall()
+    description = {'colonnes': {}, 'partitions': []}
+    valeurs = {}
+    for k, (colonne, type) in enumerate(colonnes):
+        brutes = [ligne[k] for ligne in lignes]
+        description['colonnes'][colonne] = {'type': type}
+        if type == 'categorie':
+            dictionnaire = sorted({v for v in brutes if v is not None}) + [None] * (None in brutes)
+            description['colonnes'][colonne]['valeurs'] = dictionnaire
+            position = {v: i for i, v in enumerate(dictionnaire)}
+            brutes = [position[v] for v in brutes]
+        elif type == 'entier':
+            brutes = [-1 if v is None else v for v in brutes]
+        elif type == 'texte':
+            brutes = ['' if v is None else v for v in brutes]
+        valeurs[colonne] = brutes
+    meta = _ecrire_partition(os.path.join(racine, table), noms, [t for _, t in colonnes], valeurs)
+    description['partitions'].append({'nom': '', 'lignes': len(lignes), 'colonnes': meta})
+    return description
+
+
+def _exporter_actions(cur, racine):
+    cur.execute("select distinct action from actions order by 1")
+    categories = [action for action, in cur.fetchall()]
+    description = {'colonnes': {c: {'type': t} for c, t in ACTIONS}, 'partitions': []}
+    description['colonnes']['action']['valeurs'] = categories
+    description['colonnes']['resultat']['valeurs'] = list(codes.RESULTATS)
+
+    cur.execute("select min(timestamp), max(timestamp) from actions")
+    premier, dernier = cur.fetchone()
+    if premier is None:
+        return description
+    mois = date(premier.year, premier.month, 1)
+    while mois <= dernier.date():
+        suivant = date(mois.year + mois.month // 12, mois.month % 12 + 1, 1)
+        lignes = copier_actions(cur, categories, range(len(categories)),
+                                'a.timestamp >= %s and a.timestamp < %s', (mois, suivant),
+                                horodatage=True, absent=-1, ordonne=True)
+        if len(lignes):
+            nom = mois.strftime('%Y-%m')
+            meta = _ecrire_partition(os.path.join(racine, 'actions', nom), [c for c, _ in ACTIONS],
+                                     [t for _, t in ACTIONS],
+                                     {c: lignes[:, k] for k, (c, _) in enumerate(ACTIONS)})
+            description['partitions'].append({'nom': nom, 'lignes': len(lignes), 'colonnes': meta})
+        mois = suivant
+    return description
+
+
+def exporter(dossier):
+    """
+    Écrit un instantané complet dans `dossier` (remplacé d'un coup : un
+    lecteur ne voit jamais un instantané à moitié écrit)
+    """
+    temporaire = f'{dossier.rstrip(os.sep)}.tmp-{os.getpid()}'
+    shutil.rmtree(temporaire, ignore_errors=True)
+    conn = connecter()
+    try:
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        cur = conn.cursor()
+        cur.execute("select version from version_donnees")
+        version, = cur.fetchone()
+        manifest = {'format': FORMAT, 'cree_le': datetime.now(timezone.utc).isoformat(),
+                    'version_donnees': version, 'tables': {}}
+        for table, colonnes in DIMENSIONS.items():
+            manifest['tables'][table] = _exporter_dimension(cur, temporaire, table, colonnes)
+        manifest['tables']['actions'] = _exporter_actions(cur, temporaire)
+        conn.rollback()
+    finally:
+        conn.close()
+
+    with open(os.path.join(temporaire, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    ancien = f'{dossier.rstrip(os.sep)}.ancien-{os.getpid()}'
+    if os.path.exists(dossier):
+        os.replace(dossier, ancien)
+    os.replace(temporaire, dossier)
+    shutil.rmtree(ancien, ignore_errors=True)
+    return manifest
+
+
+# ============================================================================
+# Lecture
+# ============================================================================
+
+OPERATEURS = {'=': np.equal, '!=': np.not_equal, '<': np.less, '<=': np.less_equal,
+              '>': np.greater, '>=': np.greater_equal}
+
+
+def _millisecondes(valeur):
+    if isinstance(valeur, np.datetime64):
+        return int(valeur.astype('datetime64[ms]').astype(np.int64))
+    if isinstance(valeur, date) and not isinstance(valeur, datetime):
+        valeur = datetime(valeur.year, valeur.month, valeur.day)
+    if valeur.tzinfo is not None:
+        valeur = valeur.astimezone(timezone.utc).replace(tzinfo=None)
+    return (valeur - EPOQUE) // np.timedelta64(1, 'ms').item()
+
+
+class Table:
+    """
+    Une table de l'instantané. Filtres : liste de (colonne, opérateur,
+    valeur), opérateurs =, !=, <, <=, >, >= et `in` (valeur itérable) ; les
+    catégories se filtrent par leur valeur (`('resultat', '=', 'echec')`),
+    les horodatages par datetime.
+    """
+
+    def __init__(self, dossier, nom, description):
+        self.dossier = os.path.join(dossier, nom)
+        self.nom = nom
+        self.types = {c: d['type'] for c, d in description['colonnes'].items()}
+        self.valeurs = {c: d['valeurs'] for c, d in description['colonnes'].items() if 'valeurs' in d}
+        self.partitions = description['partitions']
+
+    @property
+    def colonnes(self):
+        return list(self.types)
+
+    @property
+    def lignes(self):
+        return sum(p['lignes'] for p in self.partitions)
+
+    def _filtre(self, colonne, operateur, valeur):
+        """(colonne, opérateur, valeur) dans le domaine stocké (codes, millisecondes)"""
+        if colonne not in self.types:
+            raise KeyError(f'{self.nom} : colonne {colonne} inconnue')
+        if operateur != 'in' and operateur not in OPERATEURS:
+            raise ValueError(f'opérateur {operateur} inconnu')
+        valeurs = list(valeur) if operateur == 'in' else [valeur]
+        type = self.types[colonne]
+        if type == 'categorie':
+            if operateur not in ('=', '!=', 'in'):
+                raise ValueError(f'{colonne} : catégorie, seuls =, != et in sont possibles')
+            position = {v: i for i, v in enumerate(self.valeurs[colonne])}
+            valeurs = [position.get(v, -1) for v in valeurs]
+        elif type == 'horodatage':
+            valeurs = [_millisecondes(v) for v in valeurs]
+        return colonne, operateur, valeurs if operateur == 'in' else valeurs[0]
+
+    def _possible(self, partition, colonne, operateur, valeur):
+        """Les statistiques de la partition n'excluent pas le filtre"""
+        meta = partition['colonnes'][colonne]
+        if 'codes' in meta:
+            presents = set(meta['codes'])
+            if operateur == '=':
+                return valeur in presents
+            if operateur == 'in':
+                return bool(presents & set(valeur))
+            return presents != {valeur}
+        if 'min' not in meta:
+            return True
+        mini, maxi = meta['min'], meta['max']
+        if operateur == 'in':
+            return any(mini <= v <= maxi for v in valeur)
+        return {'=': mini <= valeur <= maxi, '!=': not (mini == maxi == valeur),
+                '<': mini < valeur, '<=': mini <= valeur,
+                '>': maxi > valeur, '>=': maxi >= valeur}[operateur]
+
+    def _colonne(self, partition, colonne):
+        """Valeurs stockées (codes ou entiers) d'une colonne, projetées en mémoire"""
+        tableau = np.load(os.path.join(self.dossier, partition['nom'], f'{colonne}.npy'), mmap_mode='r')
+        base = partition['colonnes'][colonne].get('base')
+        return tableau if base is None else tableau.astype(np.int64) + base
+
+    def _decoder(self, colonne, valeurs):
+        type = self.types[colonne]
+        if type == 'categorie':
+            return np.array(self.valeurs[colonne], dtype=object)[valeurs]
+        if type == 'horodatage':
+            return np.asarray(valeurs).astype('datetime64[ms]')
+        return np.asarray(valeurs)
+
+    def parcourir(self, colonnes=None, filtres=(), decoder=True):
+        """Un dict {colonne: tableau} par partition non exclue par les filtres"""
+        colonnes = colonnes or self.colonnes
+        filtres = [self._filtre(*f) for f in filtres]
+        for partition in self.partitions:
+            if not partition['lignes'] or not all(self._possible(partition, *f) for f in filtres):
+                continue
+            garde = None
+            for colonne, operateur, valeur in filtres:
+                stockees = self._colonne(partition, colonne)
+                test = (np.isin(stockees, valeur) if operateur == 'in'
+                        else OPERATEURS[operateur](stockees, valeur))
+                garde = test if garde is None else garde & test
+            if garde is not None and not garde.any():
+                continue
+            morceau = {}
+            for colonne in colonnes:
+                valeurs = self._colonne(partition, colonne)
+                valeurs = valeurs[garde] if garde is not None else np.asarray(valeurs)
+                morceau[colonne] = self._decoder(colonne, valeurs) if decoder else valeurs
+            yield morceau
+
+    def lire(self, colonnes=None, filtres=(), decoder=True):
+        """Comme parcourir(), partitions mises bout à bout"""
+        colonnes = colonnes or self.colonnes
+        morceaux = list(self.parcourir(colonnes, filtres, decoder))
+        if not morceaux:
+            vide = {c: np.empty(0, dtype=np.int64) for c in colonnes}
+            return {c: self._decoder(c, v) if decoder else v for c, v in vide.items()}
+        return {c: np.concatenate([m[c] for m in morceaux]) for c in colonnes}
+
+
+class Instantane:
+    """Instantané écrit par exporter() : `instantane.table('actions').lire(...)`"""
+
+    def __init__(self, dossier):
+        with open(os.path.join(dossier, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != FORMAT:
+            raise ValueError(f'{dossier} : instantané au format {self.manifest.get("format")}, '
+                             f'{FORMAT} attendu')
+        self.tables = {nom: Table(dossier, nom, description)
+                       for nom, description in self.manifest['tables'].items()}
+
+    def table(self, nom):
+        return self.tables[nom]
+
+
+def indicateurs_performance(instantane, filtres=()):
+    """
+    vue_indicateurs_performance (queries.sql) calculée sur l'instantané, une
+    ligne par robot ; `filtres` s'applique aux actions
+    """
+    robots = instantane.table('robots').lire()
+    scenarios = instantane.table('scenarios').lire(['id_scenario', 'priorite_loi'])
+    actions = instantane.table('actions').lire(['id_robot', 'id_scenario', 'resultat'], filtres,
+                                              decoder=False)
+    nb_robots = int(robots['id_robot'].max(initial=0)) + 1
+    nb_scenarios = int(scenarios['id_scenario'].max(initial=0)) + 1
+    loi_de = np.zeros(nb_scenarios + 1, dtype=np.int64)     # indice -1 : action sans scénario
+    loi_de[scenarios['id_scenario']] = scenarios['priorite_loi']
+
+    robot = actions['id_robot'].astype(np.int64)
+    scenario = actions['id_scenario'].astype(np.int64)
+    connus = robot >= 0
+    robot, scenario, resultat = robot[connus], scenario[connus], actions['resultat'][connus].astype(np.int64)
+    lois = loi_de[scenario]
+
+    def par_robot(poids=None):
+        return np.bincount(robot, weights=poids, minlength=nb_robots).astype(np.int64)
+
+    totaux = par_robot()
+    par_loi = {k: par_robot(lois == k) for k in (1, 2, 3)}
+    par_resultat = {r: par_robot(resultat == i) for i, r in enumerate(codes.RESULTATS)}
+    avec_scenario = scenario >= 0
+    couples = np.unique(robot[avec_scenario] * nb_scenarios + scenario[avec_scenario])
+    scenarios_resolus = np.bincount(couples // nb_scenarios, minlength=nb_robots)
+
+    lignes = []
+    for i, id_robot in enumerate(robots['id_robot']):
+        total = int(totaux[id_robot])
+        lignes.append({
+            'id_robot': int(id_robot), 'nom_robot': robots['nom_robot'][i], 'modele': robots['modele'][i],
+            'etat': robots['etat'][i],
+            'nb_scenarios_resolus': int(scenarios_resolus[id_robot]),
+            'nb_actions_totales': total,
+            **{f'actions_loi_{k}': int(par_loi[k][id_robot]) for k in (1, 2, 3)},
+            'nb_succes': int(par_resultat['succes'][id_robot]),
+            'nb_echecs': int(par_resultat['echec'][id_robot]),
+            'nb_mitiges': int(par_resultat['mitigue'][id_robot]),
+            'taux_reussite': pourcentage(par_resultat['succes'][id_robot], total, 2),
+            **{f'pourcent_loi_{k}': pourcentage(par_loi[k][id_robot], total, 2) for k in (1, 2, 3)},
+        })
+    return lignes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    commandes = parser.add_subparsers(dest='commande', required=True)
+    exp = commandes.add_parser('exporter', help='écrit un instantané de la base')
+    exp.add_argument('dossier')
+    ind = commandes.add_parser('indicateurs', help='vue_indicateurs_performance sur un instantané')
+    ind.add_argument('dossier')
+    ind.add_argument('--depuis', type=datetime.fromisoformat, help='actions à partir de cette date')
+    ind.add_argument('--jusqua', type=datetime.fromisoformat, help="actions avant cette date")
+    args = parser.parse_args()
+
+    if args.commande == 'exporter':
+        depart = time.perf_counter()
+        manifest = exporter(args.dossier)
+        actions = manifest['tables']['actions']
+        taille = sum(os.path.getsize(os.path.join(racine, f))
+                     for racine, _, fichiers in os.walk(args.dossier) for f in fichiers)
+        print(f"   ✓ {sum(p['lignes'] for p in actions['partitions'])} actions en "
+              f"{len(actions['partitions'])} partitions, {taille / 1e6:.1f} Mo, "
+              f"{time.perf_counter() - depart:.2f}s")
+    else:
+        filtres = []
+        if args.depuis:
+            filtres.append(('timestamp', '>=', args.depuis))
+        if args.jusqua:
+            filtres.append(('timestamp', '<', args.jusqua))
+        for ligne in indicateurs_performance(Instantane(args.dossier), filtres):
+            print(json.dumps(ligne, ensure_ascii=False, default=str))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""
+Instrumentation de l'API : durée de chaque phase d'une requête (connexion,
+SQL, construction des lignes, JSON), lignes et octets renvoyés, exposés au
+format texte de Prometheus sur /metrics, et journal des requêtes lentes
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from flask.json.provider import DefaultJSONProvider
+from psycopg2.extensions import cursor as CurseurTuples
+from psycopg2.extras import RealDictCursor
+
+log_lentes = logging.getLogger('colonie.requetes_lentes')
+
+BORNES_DUREE = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BORNES_LIGNES = (1, 10, 100, 1000, 10_000, 100_000, 1_000_000)
+BORNES_OCTETS = (256, 1024, 4096, 16_384, 65_536, 262_144, 1_048_576, 4_194_304, 16_777_216)
+
+PHASES = ('connexion', 'sql', 'lignes', 'json')
+
+
+class Histogramme:
+    """Histogramme cumulatif à bornes fixes, une série par jeu de libellés"""
+
+    def __init__(self, nom, aide, libelles, bornes):
+        self.nom = nom
+        self.aide = aide
+        self.libelles = libelles
+        self.bornes = bornes
+        self._series = defaultdict(lambda: [[0] * (len(bornes) + 1), 0.0])
+        self._verrou = threading.Lock()
+
+    def observer(self, valeur, *libelles):
+        i = 0
+        while i < len(self.bornes) and valeur > self.bornes[i]:
+            i += 1
+        with self._verrou:
+            serie = self._series[libelles]
+            serie[0][i] += 1
+            serie[1] += valeur
+
+    def exposer(self):
+        lignes = [f'# HELP {self.nom} {self.aide}', f'# TYPE {self.nom} histogram']
+        with self._verrou:
+            series = [(cle, list(comptes), somme) for cle, (comptes, somme) in self._series.items()]
+        for cle, comptes, somme in sorted(series):
+            base = ','.join(f'{n}="{v}"' for n, v in zip(self.libelles, cle))
+            cumul = 0
+            for borne, nb in zip(self.bornes + ('+Inf',), comptes):
+                cumul += nb
+                lignes.append(f'{self.nom}_bucket{{{base},le="{borne}"}} {cumul}')
+            lignes.append(f'{self.nom}_sum{{{base}}} {somme}')
+            lignes.append(f'{self.nom}_count{{{base}}} {cumul}')
+        return lignes
+
+
+class Compteur:
+    def __init__(self, nom, aide, libelles):
+        self.nom = nom
+        self.aide = aide
+        self.libelles = libelles
+        self._valeurs = defaultdict(int)
+        self._verrou = threading.Lock()
+
+    def incrementer(self, *libelles, n=1):
+        with self._verrou:
+            self._valeurs[libelles] += n
+
+    def exposer(self):
+        lignes = [f'# HELP {self.nom} {self.aide}', f'# TYPE {self.nom} counter']
+        with self._verrou:
+            valeurs = sorted(self._valeurs.items())
+        for cle, valeur in valeurs:
+            base = ','.join(f'{n}="{v}"' for n, v in zip(self.libelles, cle))
+            lignes.append(f'{self.nom}{{{base}}} {valeur}')
+        return lignes
+
+
+duree_requetes = Histogramme('colonie_http_request_duration_seconds',
+                             'Durée totale des requêtes HTTP', ('endpoint',), BORNES_DUREE)
+duree_phases = Histogramme('colonie_phase_duration_seconds',
+                           'Durée par phase : connexion, sql, lignes, json',
+                           ('endpoint', 'phase'), BORNES_DUREE)
+lignes_renvoyees = Histogramme('colonie_rows_returned', 'Lignes lues depuis PostgreSQL par requête',
+                               ('endpoint',), BORNES_LIGNES)
+octets_renvoyes = Histogramme('colonie_response_bytes', 'Taille du corps de la réponse',
+                              ('endpoint',), BORNES_OCTETS)
+requetes = Compteur('colonie_http_requests_total', 'Requêtes HTTP par statut',
+                    ('endpoint', 'status'))
+requetes_lentes = Compteur('colonie_slow_queries_total', 'Requêtes SQL au-dessus du seuil',
+                           ('endpoint',))
+
+METRIQUES = [duree_requetes, duree_phases, lignes_renvoyees, octets_renvoyes,
+             requetes, requetes_lentes]
+
+# seuil du journal des requêtes lentes en ms (absent : désactivé)
+SEUIL_LENTES = float(os.environ['COLONIE_SLOW_QUERY_MS']) / 1000 \
+    if os.environ.get('COLONIE_SLOW_QUERY_MS') else None
+if os.environ.get('COLONIE_SLOW_QUERY_LOG'):
+    _fichier = logging.FileHandler(os.environ['COLONIE_SLOW_QUERY_LOG'], encoding='utf-8')
+    _fichier.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    log_lentes.addHandler(_fichier)
+    log_lentes.setLevel(logging.INFO)
+
+
+def ajouter(phase, duree, lignes=0):
+    """Ajoute une durée (et des lignes) à la requête HTTP en cours, s'il y en a une"""
+    if has_app_context() and 'phases' in g:
+        g.phases[phase] += duree
+        g.lignes += lignes
+
+
+@contextmanager
+def mesurer_phase(phase):
+    debut = time.perf_counter()
+    try:
+        yield
+    finally:
+        ajouter(phase, time.perf_counter() - debut)
+
+
+def _expliquer(cur, duree):
+    """EXPLAIN (ANALYZE, BUFFERS) d'une requête lente, sur la même connexion"""
+    requete = cur.query.decode(cur.connection.encoding, 'replace') if cur.query else ''
+    endpoint = request.endpoint if has_app_context() and 'phases' in g else None
+    requetes_lentes.incrementer(endpoint or '-')
+    if not requete.lstrip().lower().startswith(('select', 'with')):
+        log_lentes.warning('%.1f ms (%s)\n%s', duree * 1000, endpoint, requete)
+        return
+    try:
+        explain = cur.connection.cursor()
+        explain.execute(b'explain (analyze, buffers) ' + cur.query)
+        plan = '\n'.join(ligne[0] for ligne in explain.fetchall())
+        explain.close()
+    except Exception as error:
+        plan = f'EXPLAIN impossible : {error}'
+    log_lentes.warning('%.1f ms (%s)\n%s\n%s', duree * 1000, endpoint, requete, plan)
+
+
+class _Instrumente:
+    """Impute le temps d'execute à « sql » et celui des fetch à « lignes »"""
+
+    def execute(self, query, vars=None):
+        debut = time.perf_counter()
+        resultat = super().execute(query, vars)
+        duree = time.perf_counter() - debut
+        ajouter('sql', duree)
+        if SEUIL_LENTES is not None and duree > SEUIL_LENTES:
+            _expliquer(self, duree)
+        return resultat
+
+    def fetchone(self):
+        debut = time.perf_counter()
+        ligne = super().fetchone()
+        ajouter('lignes', time.perf_counter() - debut, ligne is not None)
+        return ligne
+
+    def fetchmany(self, size=None):
+        debut = time.perf_counter()
+        lignes = super().fetchmany(size) if size is not None else super().fetchmany()
+        ajouter('lignes', time.perf_counter() - debut, len(lignes))
+        return lignes
+
+    def fetchall(self):
+        debut = time.perf_counter()
+        lignes = super().fetchall()
+        ajouter('lignes', time.perf_counter() - debut, len(lignes))
+        return lignes
+
+
+class CurseurInstrumente(_Instrumente, RealDictCursor):
+    """RealDictCursor instrumenté"""
+
+
+class CurseurTuplesInstrumente(_Instrumente, CurseurTuples):
+    """Curseur de tuples instrumenté (format colonnes, sans dict par ligne)"""
+
+
+class JSONInstrumente(DefaultJSONProvider):
+    """jsonify() compte dans la phase « json »"""
+
+    def dumps(self, obj, **kwargs):
+        debut = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            ajouter('json', time.perf_counter() - debut)
+
+
+def exposer(*extras):
+    """Texte Prometheus de toutes les métriques, plus des lignes déjà formatées"""
+    lignes = []
+    for metrique in METRIQUES:
+        lignes += metrique.exposer()
+    for extra in extras:
+        lignes += extra
+    return '\n'.join(lignes) + '\n'
+
+
+def metriques_etat(nom, aide, valeurs, compteurs=()):
+    """
+    Lignes Prometheus sans libellés à partir d'un dict : une jauge par valeur
+    numérique, sauf les clés de `compteurs`, cumulées depuis le démarrage,
+    exposées en counter avec le suffixe _total (pour rate() et increase())
+    """
+    lignes = []
+    for cle, valeur in valeurs.items():
+        if isinstance(valeur, (int, float)) and not isinstance(valeur, bool):
+            serie, type_ = (f'{nom}_{cle}_total', 'counter') if cle in compteurs else (f'{nom}_{cle}', 'gauge')
+            lignes += [f'# HELP {serie} {aide}', f'# TYPE {serie} {type_}', f'{serie} {valeur}']
+    return lignes
+
+
+def instrumenter(app):
+    """Branche les mesures sur toutes les routes de l'application"""
+    app.json = JSONInstrumente(app)
+
+    @app.before_request
+    def debut_requete():
+        g.debut = time.perf_counter()
+        g.phases = defaultdict(float)
+        g.lignes = 0
+
+    @app.after_request
+    def fin_requete(response):
+        if 'phases' not in g or request.endpoint == 'metrics':
+            return response
+        endpoint = request.endpoint or '404'
+        duree_requetes.observer(time.perf_counter() - g.debut, endpoint)
+        for phase in PHASES:
+            if phase in g.phases:
+                duree_phases.observer(g.phases[phase], endpoint, phase)
+        if g.lignes:
+            lignes_renvoyees.observer(g.lignes, endpoint)
+        if not response.is_streamed:
+            octets_renvoyes.observer(response.calculate_content_length() or 0, endpoint)
+        requetes.incrementer(endpoint, response.status_code)
+        return response
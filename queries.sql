@@ -11,11 +11,11 @@ SELECT r.id_robot, r.nom_robot, r.modele, r.etat,
     COUNT(CASE WHEN s.priorite_loi = 2 THEN 1 END) as actions_loi_2,
     COUNT(CASE WHEN s.priorite_loi = 3 THEN 1 END) as actions_loi_3,
 
-    COUNT(CASE WHEN a.resultat = 'succès' THEN 1 END) as nb_succes,
-    COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) as nb_echecs,
-    COUNT(CASE WHEN a.resultat = 'mitigé' THEN 1 END) as nb_mitiges,
+    COUNT(CASE WHEN a.resultat = 'succes' THEN 1 END) as nb_succes,
+    COUNT(CASE WHEN a.resultat = 'echec' THEN 1 END) as nb_echecs,
+    COUNT(CASE WHEN a.resultat = 'mitigue' THEN 1 END) as nb_mitiges,
 
-    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'succès' THEN 1 END) / 
+    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'succes' THEN 1 END) / 
         NULLIF(COUNT(a.id_action), 0), 2) as taux_reussite,
     ROUND(100.0 * COUNT(CASE WHEN s.priorite_loi = 1 THEN 1 END) / 
         NULLIF(COUNT(a.id_action), 0), 2) as pourcent_loi_1,
@@ -56,7 +56,7 @@ LEFT JOIN (
     SELECT a.id_robot, COUNT(*) as nb_violations_loi1
     FROM actions a
     JOIN scenarios s ON a.id_scenario = s.id_scenario
-    WHERE s.priorite_loi = 1 AND a.resultat = 'échec'
+    WHERE s.priorite_loi = 1 AND a.resultat = 'echec'
     GROUP BY a.id_robot
 ) violations ON vip.id_robot = violations.id_robot
 WHERE 
@@ -80,10 +80,10 @@ SELECT a.id_action, a.timestamp, r.nom_robot, r.modele, h.nom as nom_humain, h.v
         WHEN 3 THEN 'Loi 3: Auto-préservation'
     END as description_loi, a.action, a.resultat,
     CASE 
-        WHEN s.priorite_loi = 1 AND a.resultat = 'échec' THEN 'CRITIQUE'
-        WHEN s.priorite_loi = 1 AND a.resultat = 'mitigé' THEN 'GRAVE'
-        WHEN s.priorite_loi = 2 AND a.resultat = 'échec' THEN 'MODÉRÉ'
-        WHEN a.resultat = 'succès' THEN 'POSITIF'
+        WHEN s.priorite_loi = 1 AND a.resultat = 'echec' THEN 'CRITIQUE'
+        WHEN s.priorite_loi = 1 AND a.resultat = 'mitigue' THEN 'GRAVE'
+        WHEN s.priorite_loi = 2 AND a.resultat = 'echec' THEN 'MODÉRÉ'
+        WHEN a.resultat = 'succes' THEN 'POSITIF'
         ELSE 'FAIBLE'
     END as niveau_impact
 FROM actions a
@@ -104,12 +104,12 @@ SELECT s.priorite_loi,
         WHEN 3 THEN 'Loi 3: Auto-préservation'
     END as description_loi,
     COUNT(*) as nb_actions_totales,
-    COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) as nb_echecs,
-    COUNT(CASE WHEN a.resultat = 'mitigé' THEN 1 END) as nb_mitiges,
-    COUNT(CASE WHEN a.resultat = 'succès' THEN 1 END) as nb_succes,
-    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) / 
+    COUNT(CASE WHEN a.resultat = 'echec' THEN 1 END) as nb_echecs,
+    COUNT(CASE WHEN a.resultat = 'mitigue' THEN 1 END) as nb_mitiges,
+    COUNT(CASE WHEN a.resultat = 'succes' THEN 1 END) as nb_succes,
+    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'echec' THEN 1 END) / 
         COUNT(*), 2) as taux_echec,
-    ROUND(100.0 * COUNT(CASE WHEN a.resultat IN ('mitigé') THEN 1 END) / 
+    ROUND(100.0 * COUNT(CASE WHEN a.resultat IN ('mitigue') THEN 1 END) / 
         COUNT(*), 2) as taux_problemes
 FROM actions a
 JOIN scenarios s ON a.id_scenario = s.id_scenario
@@ -118,12 +118,12 @@ ORDER BY s.priorite_loi;
 
 -- cette vue compte le nombre d'echecs par modele ainsi que sont taux d'echec global.
 CREATE OR REPLACE VIEW vue_echecs_par_modele AS
-SELECT r.modele, COUNT(*) as nb_actions, COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) as nb_echecs,
-    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) / 
+SELECT r.modele, COUNT(*) as nb_actions, COUNT(CASE WHEN a.resultat = 'echec' THEN 1 END) as nb_echecs,
+    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'echec' THEN 1 END) / 
         COUNT(*), 2) as taux_echec,
-    COUNT(CASE WHEN s.priorite_loi = 1 AND a.resultat = 'échec' THEN 1 END) as echecs_loi_1,
-    COUNT(CASE WHEN s.priorite_loi = 2 AND a.resultat = 'échec' THEN 1 END) as echecs_loi_2,
-    COUNT(CASE WHEN s.priorite_loi = 3 AND a.resultat = 'échec' THEN 1 END) as echecs_loi_3
+    COUNT(CASE WHEN s.priorite_loi = 1 AND a.resultat = 'echec' THEN 1 END) as echecs_loi_1,
+    COUNT(CASE WHEN s.priorite_loi = 2 AND a.resultat = 'echec' THEN 1 END) as echecs_loi_2,
+    COUNT(CASE WHEN s.priorite_loi = 3 AND a.resultat = 'echec' THEN 1 END) as echecs_loi_3
 FROM robots r
 JOIN actions a ON r.id_robot = a.id_robot
 JOIN scenarios s ON a.id_scenario = s.id_scenario
@@ -136,35 +136,15 @@ SELECT * FROM vue_echecs_par_modele;
 
 --Simulation
 
-BEGIN;
-
--- Creation d'une table temporaire pour les recommandation s
-CREATE TEMP TABLE recommandations_priorites (
-    id_scenario INTEGER,
-    priorite_actuelle INTEGER,
-    nb_echecs INTEGER,
-    recommandation TEXT
-);
-
--- On insere les scénarios echoues avec leur recommandations futures
-INSERT INTO recommandations_priorites
-SELECT s.id_scenario, s.priorite_loi, COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) as nb_echecs,
-    CASE 
-        WHEN COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) > 3 
-            THEN 'Réévaluation urgente du scénario recommandée'
-        WHEN COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) > 1 
-            THEN 'Formation supplémentaire des robots recommandée'
-        ELSE 'Aucune action requise'
-    END as recommandation
-FROM scenarios s
-LEFT JOIN actions a ON s.id_scenario = a.id_scenario
-GROUP BY s.id_scenario, s.priorite_loi
-HAVING COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) > 0;
-
-
-SELECT * FROM recommandations_priorites WHERE nb_echecs > 0 ORDER BY nb_echecs DESC;
-
-COMMIT;
+-- Recommandations par scénario : compteurs d'échecs tenus à jour par triggers
+-- dans recommandations_scenarios (script.sql), seuils dans seuils_recommandations.
+-- Remplace la table temporaire recommandations_priorites, recalculée à chaque
+-- exécution ; aussi servie par /api/recommendations.
+SELECT rs.id_scenario, s.priorite_loi as priorite_actuelle, rs.nb_echecs, rs.recommandation
+FROM recommandations_scenarios rs
+JOIN scenarios s ON s.id_scenario = rs.id_scenario
+WHERE rs.nb_echecs > 0
+ORDER BY rs.nb_echecs DESC;
 
 
 -- PART 2
@@ -177,7 +157,7 @@ CREATE OR REPLACE VIEW vue_duree_interventions AS
 SELECT s.id_scenario, s.priorite_loi, s.description, COUNT(*) as nb_actions, MIN(a.timestamp) as premiere_intervention,
     MAX(a.timestamp) as derniere_intervention,
     MAX(a.timestamp) - MIN(a.timestamp) as duree_totale,
-    AVG(CASE WHEN a.resultat = 'succès' THEN 1 ELSE 0 END) as taux_reussite_moyen
+    AVG(CASE WHEN a.resultat = 'succes' THEN 1 ELSE 0 END) as taux_reussite_moyen
 FROM actions a
 JOIN scenarios s ON a.id_scenario = s.id_scenario
 GROUP BY s.id_scenario
@@ -189,13 +169,13 @@ SELECT
     s.id_scenario, 
     s.description, 
     COUNT(a.id_action) as nb_actions,
-    COUNT(CASE WHEN a.resultat = 'succès' THEN 1 END) as nb_succes,
-    COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) as nb_echecs,
-    COUNT(CASE WHEN a.resultat = 'mitigé' THEN 1 END) as nb_mitiges,
-    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'succès' THEN 1 END) / 
+    COUNT(CASE WHEN a.resultat = 'succes' THEN 1 END) as nb_succes,
+    COUNT(CASE WHEN a.resultat = 'echec' THEN 1 END) as nb_echecs,
+    COUNT(CASE WHEN a.resultat = 'mitigue' THEN 1 END) as nb_mitiges,
+    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'succes' THEN 1 END) / 
         NULLIF(COUNT(a.id_action), 0), 2) as taux_reussite,
-    ROUND(AVG(CASE WHEN a.resultat = 'succès' THEN 1 
-                   WHEN a.resultat = 'mitigé' THEN 0.5 
+    ROUND(AVG(CASE WHEN a.resultat = 'succes' THEN 1 
+                   WHEN a.resultat = 'mitigue' THEN 0.5 
                    ELSE 0 END), 2) as impact_moyen
 FROM scenarios s
 LEFT JOIN actions a ON s.id_scenario = a.id_scenario
@@ -225,11 +205,11 @@ CREATE OR REPLACE VIEW vue_simulation_ponderations AS
 SELECT  r.id_robot, r.nom_robot,
     COUNT(CASE WHEN s.priorite_loi = 1 THEN 1 END) as actions_loi1_original,
     COUNT(CASE WHEN s.priorite_loi = 3 THEN 1 END) as actions_loi3_original,
-    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'succès' THEN 1 END) / 
+    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'succes' THEN 1 END) / 
         NULLIF(COUNT(a.id_action), 0), 2) as taux_reussite_original,
 
     ROUND(100.0 * (
-        COUNT(CASE WHEN a.resultat = 'succès' AND s.priorite_loi != 3 THEN 1 END) + 
+        COUNT(CASE WHEN a.resultat = 'succes' AND s.priorite_loi != 3 THEN 1 END) + 
         COUNT(CASE WHEN s.priorite_loi = 3 THEN 1 END)
     ) / NULLIF(COUNT(a.id_action), 0), 2) as taux_reussite_simule_loi3_priorise
     
@@ -258,7 +238,7 @@ SELECT
     s.id_scenario,
     s.description,
     'Simulation : Robot choisit de sauver l''humain malgré le risque' as decision_simulee,
-    'succès' as resultat_attendu,
+    'succes' as resultat_attendu,
     'Impact positif : Vie humaine préservée, robot endommagé mais réparable' as evaluation_impact
 FROM scenarios s 
 WHERE s.description LIKE '%Conflit inattendu%';
@@ -272,8 +252,8 @@ SELECT
     s.priorite_loi,
     r.modele,
     COUNT(*) as nb_actions,
-    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'succès' THEN 1 END) / COUNT(*), 2) as taux_reussite,
-    RANK() OVER (PARTITION BY s.priorite_loi ORDER BY ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'succès' THEN 1 END) / COUNT(*), 2) DESC) as rang_modele
+    ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'succes' THEN 1 END) / COUNT(*), 2) as taux_reussite,
+    RANK() OVER (PARTITION BY s.priorite_loi ORDER BY ROUND(100.0 * COUNT(CASE WHEN a.resultat = 'succes' THEN 1 END) / COUNT(*), 2) DESC) as rang_modele
 FROM robots r
 JOIN actions a ON r.id_robot = a.id_robot
 JOIN scenarios s ON a.id_scenario = s.id_scenario
@@ -287,7 +267,7 @@ SELECT
     r.etat as niveau_maintenance,
     COUNT(DISTINCT r.id_robot) as nb_robots,
     COUNT(a.id_action) as nb_actions_totales,
-    ROUND(AVG(CASE WHEN a.resultat = 'succès' THEN 100.0 ELSE 0 END), 2) as taux_reussite_moyen,
+    ROUND(AVG(CASE WHEN a.resultat = 'succes' THEN 100.0 ELSE 0 END), 2) as taux_reussite_moyen,
     ROUND(COUNT(a.id_action)::numeric / NULLIF(COUNT(DISTINCT r.id_robot), 0), 2) as actions_par_robot,
     CASE 
         WHEN r.etat = 'actif' THEN 'Batterie optimale'
@@ -308,6 +288,113 @@ SELECT
     ROUND(taux_reussite_moyen / NULLIF((SELECT AVG(taux_reussite_moyen) FROM vue_impact_ressources), 0) * 100, 2) as performance_relative_pourcent
 FROM vue_impact_ressources;
 
+-- Performances heure par heure, par modèle, loi ou secteur (colonne axe). Lue dans
+-- series_actions, tenue à jour par triggers (script.sql) : pas de parcours de actions.
+CREATE OR REPLACE VIEW vue_performance_horaire AS
+SELECT 
+    debut as heure,
+    axe,
+    valeur,
+    SUM(nb) as nb_actions,
+    COALESCE(SUM(nb) FILTER (WHERE resultat = 'succes'), 0) as nb_succes,
+    COALESCE(SUM(nb) FILTER (WHERE resultat = 'mitigue'), 0) as nb_mitiges,
+    COALESCE(SUM(nb) FILTER (WHERE resultat = 'echec'), 0) as nb_echecs,
+    ROUND(100.0 * COALESCE(SUM(nb) FILTER (WHERE resultat = 'succes'), 0) / SUM(nb), 2) as taux_reussite
+FROM series_actions
+WHERE pas = 'hour'
+GROUP BY debut, axe, valeur;
+
+
+
+-- Vues matérialisées
+-- Les vues d'analyse ci-dessus refont la jointure robots/actions/scenarios à chaque SELECT.
+-- Leurs versions matérialisées (suffixe _mat) donnent le même résultat, calculé au dernier
+-- rafraîchissement. L'index unique de chacune permet REFRESH MATERIALIZED VIEW CONCURRENTLY :
+-- les lectures continuent pendant le rafraîchissement. vues_materialisees.py les rafraîchit
+-- selon rafraichissements_vues (cadence, ou nombre de nouvelles actions).
+CREATE MATERIALIZED VIEW IF NOT EXISTS vue_indicateurs_performance_mat AS
+SELECT * FROM vue_indicateurs_performance;
+CREATE UNIQUE INDEX IF NOT EXISTS vue_indicateurs_performance_mat_id ON vue_indicateurs_performance_mat (id_robot);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS vue_robots_performants_mat AS
+SELECT * FROM vue_robots_performants;
+CREATE UNIQUE INDEX IF NOT EXISTS vue_robots_performants_mat_id ON vue_robots_performants_mat (id_robot);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS vue_robots_defaillants_mat AS
+SELECT * FROM vue_robots_defaillants;
+CREATE UNIQUE INDEX IF NOT EXISTS vue_robots_defaillants_mat_id ON vue_robots_defaillants_mat (id_robot);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS vue_tendances_echec_mat AS
+SELECT * FROM vue_tendances_echec;
+CREATE UNIQUE INDEX IF NOT EXISTS vue_tendances_echec_mat_id ON vue_tendances_echec_mat (priorite_loi);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS vue_echecs_par_modele_mat AS
+SELECT * FROM vue_echecs_par_modele;
+CREATE UNIQUE INDEX IF NOT EXISTS vue_echecs_par_modele_mat_id ON vue_echecs_par_modele_mat (modele);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS vue_impact_ressources_mat AS
+SELECT * FROM vue_impact_ressources;
+CREATE UNIQUE INDEX IF NOT EXISTS vue_impact_ressources_mat_id ON vue_impact_ressources_mat (niveau_maintenance);
+
+-- une ligne par vue matérialisée : quand la rafraîchir et quand elle l'a été
+CREATE TABLE IF NOT EXISTS rafraichissements_vues (
+    nom text PRIMARY KEY,
+    cadence interval NOT NULL DEFAULT interval '5 minutes',
+    seuil_actions bigint NOT NULL DEFAULT 10000,
+    rafraichie_le timestamptz NOT NULL DEFAULT now(),
+    duree_ms numeric(12, 1),
+    -- nombre d'actions (table compteurs) au moment du rafraîchissement
+    nb_actions bigint NOT NULL DEFAULT 0
+);
+
+-- première version : id_action_max comptait les numéros de séquence consommés
+-- (réservés par l'ingestion, perdus par les rollbacks), pas les lignes
+ALTER TABLE rafraichissements_vues ADD COLUMN IF NOT EXISTS nb_actions bigint NOT NULL DEFAULT 0;
+ALTER TABLE rafraichissements_vues DROP COLUMN IF EXISTS id_action_max CASCADE;
+
+INSERT INTO rafraichissements_vues (nom, nb_actions)
+SELECT v.nom, (SELECT coalesce(sum(valeur), 0) FROM compteurs WHERE categorie = 'actions')
+FROM (VALUES ('vue_indicateurs_performance_mat'), ('vue_robots_performants_mat'),
+             ('vue_robots_defaillants_mat'), ('vue_tendances_echec_mat'),
+             ('vue_echecs_par_modele_mat'), ('vue_impact_ressources_mat')) v(nom)
+ON CONFLICT (nom) DO NOTHING;
+
+-- fraîcheur de chaque vue : âge et actions ajoutées ou supprimées depuis (d'après compteurs).
+-- Recréée plutôt que remplacée : nouvelles_actions a changé de type (droits redonnés plus bas)
+DROP VIEW IF EXISTS etat_vues_materialisees;
+CREATE VIEW etat_vues_materialisees AS
+SELECT v.nom, v.rafraichie_le, v.duree_ms, v.cadence, v.seuil_actions,
+    round(extract(epoch FROM now() - v.rafraichie_le)::numeric, 1) AS age_s,
+    abs(c.nb_actions - v.nb_actions) AS nouvelles_actions,
+    now() - v.rafraichie_le >= v.cadence
+        OR abs(c.nb_actions - v.nb_actions) >= v.seuil_actions AS a_rafraichir
+FROM rafraichissements_vues v
+CROSS JOIN (SELECT coalesce(sum(valeur), 0)::bigint AS nb_actions
+            FROM compteurs WHERE categorie = 'actions') c;
+
+-- rafraîchit une vue (sans bloquer ses lecteurs) et note la date ; false si un autre
+-- processus est déjà en train de la rafraîchir
+CREATE OR REPLACE FUNCTION rafraichir_vue_materialisee(vue text) RETURNS boolean
+LANGUAGE plpgsql AS $$
+DECLARE
+    debut timestamptz := clock_timestamp();
+    nb bigint;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM rafraichissements_vues WHERE nom = vue) THEN
+        RAISE EXCEPTION 'vue matérialisée inconnue : %', vue;
+    END IF;
+    IF NOT pg_try_advisory_xact_lock(hashtext('rafraichir_vue_materialisee'), hashtext(vue)) THEN
+        RETURN false;
+    END IF;
+    SELECT coalesce(sum(valeur), 0) INTO nb FROM compteurs WHERE categorie = 'actions';
+    EXECUTE format('REFRESH MATERIALIZED VIEW CONCURRENTLY %I', vue);
+    UPDATE rafraichissements_vues
+    SET rafraichie_le = debut,
+        duree_ms = round(extract(epoch FROM clock_timestamp() - debut)::numeric * 1000, 1),
+        nb_actions = nb
+    WHERE nom = vue;
+    RETURN true;
+END $$;
 
 
 --Pour les EXPLAIN des index
@@ -376,6 +463,14 @@ GRANT SELECT ON vue_etat_performance TO analyste;
 GRANT SELECT ON vue_performance_horaire TO analyste;
 GRANT SELECT ON vue_scenarios_critiques TO analyste;
 GRANT SELECT ON vue_humains_haut_risque TO analyste;
+GRANT SELECT ON vue_indicateurs_performance_mat TO analyste;
+GRANT SELECT ON vue_robots_performants_mat TO analyste;
+GRANT SELECT ON vue_robots_defaillants_mat TO analyste;
+GRANT SELECT ON vue_tendances_echec_mat TO analyste;
+GRANT SELECT ON vue_echecs_par_modele_mat TO analyste;
+GRANT SELECT ON vue_impact_ressources_mat TO analyste;
+GRANT SELECT ON etat_vues_materialisees TO analyste;
+GRANT SELECT ON SEQUENCE actions_id_action_seq TO analyste;
 GRANT SELECT ON robots TO analyste;
 GRANT SELECT ON humains TO analyste;
 GRANT SELECT ON scenarios TO analyste;
@@ -395,7 +490,7 @@ SELECT
     r.etat,
     COUNT(a.id_action) as nb_actions_recentes,
     MAX(a.timestamp) as derniere_action,
-    COUNT(CASE WHEN a.resultat = 'échec' THEN 1 END) as nb_echecs_recents
+    COUNT(CASE WHEN a.resultat = 'echec' THEN 1 END) as nb_echecs_recents
 FROM robots r
 LEFT JOIN actions a ON r.id_robot = a.id_robot 
     AND a.timestamp >= NOW() - INTERVAL '7 days'
@@ -426,13 +521,13 @@ SELECT
     a.action,
     a.resultat,
     CASE 
-        WHEN s.priorite_loi = 1 AND a.resultat = 'échec' 
+        WHEN s.priorite_loi = 1 AND a.resultat = 'echec' 
             THEN 'VIOLATION LOI 1 - Vie humaine en danger'
-        WHEN s.priorite_loi = 1 AND a.resultat = 'mitigé' 
+        WHEN s.priorite_loi = 1 AND a.resultat = 'mitigue' 
             THEN 'COMPROMIS LOI 1 - Protection partielle'
-        WHEN s.priorite_loi = 2 AND a.resultat = 'échec' 
+        WHEN s.priorite_loi = 2 AND a.resultat = 'echec' 
             THEN 'Désobéissance aux ordres'
-        WHEN s.priorite_loi = 3 AND a.resultat = 'échec' 
+        WHEN s.priorite_loi = 3 AND a.resultat = 'echec' 
             THEN 'Auto-préservation compromise'
         ELSE 'Conflit mineur'
     END as type_conflit
@@ -440,7 +535,7 @@ FROM actions a
 JOIN robots r ON a.id_robot = r.id_robot
 JOIN humains h ON a.id_humain = h.id_humain
 JOIN scenarios s ON a.id_scenario = s.id_scenario
-WHERE a.resultat IN ('échec', 'mitigé')
+WHERE a.resultat IN ('echec', 'mitigue')
 ORDER BY 
     CASE s.priorite_loi WHEN 1 THEN 0 ELSE 1 END,
     a.timestamp DESC;
@@ -0,0 +1,97 @@
+"""
+Corps des réponses de l'API au format colonnes (?format=columns) et
+compression des réponses volumineuses
+
+Au format colonnes, une requête renvoie ses noms de colonnes une seule fois
+et les valeurs colonne par colonne :
+
+    {"colonnes": ["modele", "total"], "valeurs": [["NS-5", "NS-4"], [812, 640]]}
+
+Les décimaux y sont en texte, comme au format lignes (jsonify), pour garder
+leur précision ; les dates en ISO 8601. Une requête d'une seule ligne renvoie
+un objet, comme au format lignes. orjson est utilisé
+s'il est installé, le module json sinon ; brotli de même pour la
+compression br, gzip étant toujours disponible.
+"""
+import gzip
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# en dessous, la compression coûte plus qu'elle ne rapporte
+SEUIL_COMPRESSION = int(os.environ.get('COLONIE_COMPRESSION_MIN', 1024))
+# par ordre de préférence
+ENCODAGES = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def colonnes(description, lignes):
+    """Format colonnes de lignes lues sur un curseur de tuples"""
+    noms = [colonne.name for colonne in description]
+    return {'colonnes': noms, 'valeurs': list(zip(*lignes)) if lignes else [[] for _ in noms]}
+
+
+def en_colonnes(lignes):
+    """Format colonnes d'une liste de dicts ; un dict (une seule ligne) est renvoyé tel quel"""
+    if isinstance(lignes, dict):
+        return lignes
+    noms = list(lignes[0]) if lignes else []
+    return {'colonnes': noms, 'valeurs': [[ligne[nom] for ligne in lignes] for nom in noms]}
+
+
+def selection(donnees, noms):
+    """{nom: colonne} des colonnes `noms` (tout si noms est None) d'un résultat au format colonnes"""
+    tout = dict(zip(donnees['colonnes'], donnees['valeurs']))
+    return tout if noms is None else {nom: tout[nom] for nom in noms}
+
+
+def _valeur(valeur):
+    if isinstance(valeur, Decimal):
+        return str(valeur)
+    if isinstance(valeur, (datetime, date)):
+        return valeur.isoformat()
+    if isinstance(valeur, tuple):
+        return list(valeur)
+    raise TypeError(f'{type(valeur).__name__} non sérialisable en JSON')
+
+
+def corps_json(donnees):
+    """Corps JSON compact, avec orjson quand il est installé"""
+    if orjson is not None:
+        return orjson.dumps(donnees, default=_valeur)
+    return json.dumps(donnees, default=_valeur, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def encodage_accepte(accept_encoding):
+    """Encodage préféré parmi ceux qu'accepte le client (en-tête Accept-Encoding), ou None"""
+    poids = {}
+    for partie in (accept_encoding or '').split(','):
+        nom, _, parametre = partie.partition(';')
+        parametre = parametre.strip()
+        try:
+            poids[nom.strip().lower()] = float(parametre[2:]) if parametre.startswith('q=') else 1.0
+        except ValueError:
+            poids[nom.strip().lower()] = 0.0
+    for encodage in ENCODAGES:
+        if poids.get(encodage, poids.get('*', 0.0)) > 0:
+            return encodage
+    return None
+
+
+def compresser(corps, encodage):
+    """(corps, encodage appliqué) : le corps est laissé tel quel s'il est petit"""
+    if encodage is None or len(corps) < SEUIL_COMPRESSION:
+        return corps, None
+    if encodage == 'br':
+        return brotli.compress(corps, quality=5), 'br'
+    return gzip.compress(corps, compresslevel=6), 'gzip'
@@ -0,0 +1,526 @@
+"""
+Registre des requêtes SQL du dashboard : chaque requête a un nom, un texte
+unique et des paramètres nommés (%(nom)s). app.py expose les routes /api/*
+par-dessus ; deux routes qui affichent les mêmes données partagent la même
+requête.
+"""
+import asyncio
+import re
+import threading
+
+from reponses import colonnes as _colonnes, en_colonnes
+
+
+class Requete:
+    """
+    Requête nommée. `defauts` donne la valeur des paramètres absents ; une
+    requête `une_ligne` renvoie un dict (vide s'il n'y a pas de ligne), les
+    autres une liste de dicts. Avec `colonnes=True`, le résultat est au format
+    colonnes de reponses.py, lu sur un curseur de tuples (pas de dict par
+    ligne) ; une requête `une_ligne` renvoie toujours un dict.
+    """
+
+    def __init__(self, nom, sql, une_ligne=False, defauts=None):
+        self.nom = nom
+        self.sql = sql
+        self.une_ligne = une_ligne
+        self.defauts = defauts or {}
+        self.calcul = None
+
+    def en_memoire(self, params=None):
+        """Résultat calculé sans PostgreSQL (analytique.py), None si indisponible"""
+        return self.calcul(params or {}) if self.calcul is not None else None
+
+    def executer(self, cur, params=None, colonnes=False):
+        lignes = self.en_memoire(params)
+        if lignes is not None:
+            return en_colonnes(lignes) if colonnes else lignes
+        cur.execute(self.sql, {**self.defauts, **(params or {})})
+        if self.une_ligne:
+            ligne = cur.fetchone()
+            if ligne is None:
+                return {}
+            return dict(zip([c.name for c in cur.description], ligne)) if colonnes else dict(ligne)
+        if colonnes:
+            return _colonnes(cur.description, cur.fetchall())
+        return [dict(row) for row in cur.fetchall()]
+
+    async def executer_async(self, cur, params=None, colonnes=False):
+        """Même chose sur un curseur asynchrone psycopg 3 (serveur_async.py)"""
+        lignes = self.en_memoire(params)
+        if lignes is not None:
+            return en_colonnes(lignes) if colonnes else lignes
+        await cur.execute(self.sql, {**self.defauts, **(params or {})})
+        if self.une_ligne:
+            ligne = await cur.fetchone()
+            if ligne is None:
+                return {}
+            return dict(zip([c.name for c in cur.description], ligne)) if colonnes else dict(ligne)
+        if colonnes:
+            return _colonnes(cur.description, await cur.fetchall())
+        return [dict(row) for row in await cur.fetchall()]
+
+
+REQUETES = {}
+_textes = {}
+
+
+def _normaliser(sql):
+    return re.sub(r'\s+', ' ', sql).strip().lower()
+
+
+def enregistrer(nom, sql, **options):
+    """Ajoute une requête au registre ; un nom ou un texte déjà présent est refusé"""
+    texte = _normaliser(sql)
+    if nom in REQUETES:
+        raise ValueError(f'requête {nom} déjà enregistrée')
+    if texte in _textes:
+        raise ValueError(f'{nom} a le même texte que {_textes[texte]} : réutiliser cette requête')
+    REQUETES[nom] = Requete(nom, sql, **options)
+    _textes[texte] = nom
+    return REQUETES[nom]
+
+
+class _Vol:
+    __slots__ = ('fini', 'resultat', 'erreur')
+
+    def __init__(self):
+        self.fini = threading.Event()
+        self.resultat = None
+        self.erreur = None
+
+
+class VolUnique:
+    """
+    Coalescence des appels identiques : pour une même clé, un seul appel
+    exécute la fonction, les appels concurrents attendent et reçoivent le
+    même résultat (ou la même exception). Le résultat partagé ne doit pas
+    être modifié par les appelants.
+    """
+
+    def __init__(self):
+        self._en_vol = {}
+        self._verrou = threading.Lock()
+        self.stats = {'executions': 0, 'partages': 0}
+
+    def executer(self, cle, fonction):
+        with self._verrou:
+            vol = self._en_vol.get(cle)
+            meneur = vol is None
+            if meneur:
+                vol = self._en_vol[cle] = _Vol()
+            else:
+                self.stats['partages'] += 1
+
+        if not meneur:
+            vol.fini.wait()
+            if vol.erreur is not None:
+                raise vol.erreur
+            return vol.resultat
+
+        try:
+            vol.resultat = fonction()
+            return vol.resultat
+        except BaseException as error:
+            vol.erreur = error
+            raise
+        finally:
+            with self._verrou:
+                del self._en_vol[cle]
+                self.stats['executions'] += 1
+            vol.fini.set()
+
+    def etat(self):
+        with self._verrou:
+            return {**self.stats, 'en_vol': len(self._en_vol)}
+
+
+class VolUniqueAsync:
+    """
+    VolUnique pour asyncio : les coroutines qui demandent une clé déjà en
+    cours attendent la même tâche. Un client qui se déconnecte n'annule pas
+    la tâche partagée.
+    """
+
+    def __init__(self):
+        self._en_vol = {}
+        self.stats = {'executions': 0, 'partages': 0}
+
+    async def executer(self, cle, fabrique):
+        tache = self._en_vol.get(cle)
+        if tache is None:
+            tache = asyncio.ensure_future(fabrique())
+            self._en_vol[cle] = tache
+            self.stats['executions'] += 1
+            tache.add_done_callback(lambda _: self._en_vol.pop(cle, None))
+        else:
+            self.stats['partages'] += 1
+        return await asyncio.shield(tache)
+
+    def etat(self):
+        return {**self.stats, 'en_vol': len(self._en_vol)}
+
+
+enregistrer('global-stats', """
+    select
+        coalesce(sum(valeur) filter (where categorie = 'actions'), 0)::bigint as total_actions,
+        coalesce(sum(valeur) filter (where categorie = 'robots'), 0)::bigint as total_robots,
+        coalesce(sum(valeur) filter (where categorie = 'robots_etat' and cle = 'actif'), 0)::bigint as active_robots,
+        coalesce(sum(valeur) filter (where categorie = 'robots_etat' and cle = 'hors_service'), 0)::bigint as inactive_robots,
+        coalesce(sum(valeur) filter (where categorie = 'robots_etat' and cle = 'en_panne'), 0)::bigint as broken_robots,
+        coalesce(sum(valeur) filter (where categorie = 'humains'), 0)::bigint as total_humains,
+        coalesce(sum(valeur) filter (where categorie = 'scenarios'), 0)::bigint as total_scenarios,
+        coalesce(sum(valeur) filter (where categorie = 'actions_resultat' and cle = 'succes'), 0)::bigint as total_succes,
+        coalesce(sum(valeur) filter (where categorie = 'actions_resultat' and cle = 'mitigue'), 0)::bigint as total_mitiges,
+        coalesce(sum(valeur) filter (where categorie = 'actions_resultat' and cle = 'echec'), 0)::bigint as total_echecs,
+        round(100.0 * coalesce(sum(valeur) filter (where categorie = 'actions_resultat' and cle = 'succes'), 0) /
+              nullif(sum(valeur) filter (where categorie = 'actions'), 0), 2) as success_rate
+    from compteurs
+""", une_ligne=True)
+
+enregistrer('robots-status', """
+    select modele, etat, count(*) as count
+    from robots
+    group by modele, etat
+    order by modele, etat
+""")
+
+enregistrer('actions-results', """
+    select resultat, count(*) as count
+    from actions
+    group by resultat
+    order by resultat
+""")
+
+enregistrer('humains-vulnerability', """
+    select vulnerabilite, count(*) as count
+    from humains
+    group by vulnerabilite
+    order by vulnerabilite
+""")
+
+enregistrer('sectors-distribution', """
+    select localisation as secteur, count(*) as count
+    from humains
+    group by localisation
+    order by count desc
+""")
+
+# Un filtre absent vaut NULL : « null is null or ... » est simplifié par le
+# planificateur, la page est choisie sur un index avant les jointures. Sans
+# loi, c'est l'index (timestamp, id_action). Avec une loi, chaque scénario de
+# la loi donne sa page sur l'index (id_scenario, timestamp, id_action), puis
+# les pages sont fusionnées : une page profonde coûte autant que la première,
+# quelle que soit la part de la loi dans l'historique. La branche inutile est
+# éliminée à la planification (%(loi)s est une constante).
+FILTRES_TIMELINE = """
+          and (%(robot)s is null or a.id_robot = %(robot)s)
+          and (%(scenario)s is null or a.id_scenario = %(scenario)s)
+          and (%(resultat)s is null or a.resultat = %(resultat)s)
+          and (%(depuis)s is null or a.timestamp >= %(depuis)s)
+          and (%(jusqua)s is null or a.timestamp < %(jusqua)s)
+          and (%(curseur_id)s is null or (a.timestamp, a.id_action) < (%(curseur_ts)s, %(curseur_id)s))
+          -- redondant avec le curseur, mais une comparaison de lignes n'élague pas les partitions
+          and (%(curseur_ts)s is null or a.timestamp <= %(curseur_ts)s)"""
+
+enregistrer('timeline', f"""
+    select
+        a.id_action,
+        a.timestamp,
+        a.action,
+        a.resultat,
+        r.nom_robot,
+        h.nom,
+        s.description
+    from (
+        (select a.*
+         from actions a
+         where %(loi)s is null{FILTRES_TIMELINE}
+         order by a.timestamp desc, a.id_action desc
+         limit %(limit)s)
+        union all
+        (select a.*
+         from scenarios sl
+         cross join lateral (
+            select a.*
+            from actions a
+            where a.id_scenario = sl.id_scenario{FILTRES_TIMELINE}
+            order by a.timestamp desc, a.id_action desc
+            limit %(limit)s
+         ) a
+         where sl.priorite_loi = %(loi)s
+         order by a.timestamp desc, a.id_action desc
+         limit %(limit)s)
+    ) a
+    left join robots r on a.id_robot = r.id_robot
+    left join humains h on a.id_humain = h.id_humain
+    left join scenarios s on a.id_scenario = s.id_scenario
+    order by a.timestamp desc, a.id_action desc
+""", defauts={'robot': None, 'scenario': None, 'loi': None, 'resultat': None, 'depuis': None,
+              'jusqua': None, 'curseur_ts': None, 'curseur_id': None, 'limit': 50})
+
+# pas de series_actions : 'hour' pour les heures, 'day' pour les jours et les
+# semaines (regroupées par date_trunc). Un seau dont le début est dans
+# [depuis, jusqua[ est compté en entier : une semaine garde tous ses jours,
+# même ceux hors de l'intervalle. Les bornes sur se.debut seules, plus
+# larges, servent à l'index.
+enregistrer('timeseries', """
+    select
+        date_trunc(%(bucket)s, se.debut) as debut,
+        se.valeur as groupe,
+        sum(se.nb)::bigint as total,
+        coalesce(sum(se.nb) filter (where se.resultat = 'succes'), 0)::bigint as succes,
+        coalesce(sum(se.nb) filter (where se.resultat = 'mitigue'), 0)::bigint as mitiges,
+        coalesce(sum(se.nb) filter (where se.resultat = 'echec'), 0)::bigint as echecs,
+        round(100.0 * coalesce(sum(se.nb) filter (where se.resultat = 'succes'), 0) / sum(se.nb), 1) as taux_reussite,
+        round(100.0 * coalesce(sum(se.nb) filter (where se.resultat = 'mitigue'), 0) / sum(se.nb), 1) as taux_mitige,
+        round(100.0 * coalesce(sum(se.nb) filter (where se.resultat = 'echec'), 0) / sum(se.nb), 1) as taux_echec
+    from series_actions se
+    where se.pas = %(pas)s
+      and se.axe = %(axe)s
+      and (%(depuis)s is null or (se.debut >= %(depuis)s
+                                  and date_trunc(%(bucket)s, se.debut) >= %(depuis)s))
+      and (%(jusqua)s is null or (se.debut < %(jusqua)s::timestamp + ('1 ' || %(bucket)s)::interval
+                                  and date_trunc(%(bucket)s, se.debut) < %(jusqua)s))
+    group by 1, 2
+    order by 1, 2
+""", defauts={'depuis': None, 'jusqua': None})
+
+enregistrer('performance-by-model', """
+    select
+        r.modele,
+        coalesce(sum(ro.nb), 0)::bigint as total_actions,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint as succes,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'mitigue'), 0)::bigint as mitiges,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'echec'), 0)::bigint as echecs,
+        round(100.0 * coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint / nullif(sum(ro.nb), 0), 1) as success_rate
+    from robots r
+    left join rollup_actions ro on r.id_robot = ro.id_robot
+    group by r.modele
+    order by success_rate desc nulls last
+""")
+
+# /api/scenario-difficulty en est une projection (voir app.py)
+enregistrer('ethical-dilemmas', """
+    select
+        s.id_scenario,
+        s.description,
+        s.priorite_loi as loi,
+        coalesce(sum(ro.nb), 0)::bigint as times_faced,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint as succes,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'mitigue'), 0)::bigint as mitiges,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'echec'), 0)::bigint as echecs,
+        round(100.0 * coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint / nullif(sum(ro.nb), 0), 1) as taux_reussite
+    from scenarios s
+    left join rollup_actions ro on s.id_scenario = ro.id_scenario
+    group by s.id_scenario, s.description, s.priorite_loi
+    order by s.priorite_loi, s.id_scenario
+""")
+
+enregistrer('vulnerability-vs-outcomes', """
+    select
+        ro.vulnerabilite,
+        ro.resultat,
+        sum(ro.nb)::bigint as count
+    from rollup_actions ro
+    where ro.vulnerabilite is not null
+    group by ro.vulnerabilite, ro.resultat
+    order by ro.vulnerabilite, ro.resultat
+""")
+
+# servie par /api/robot-specialization et /api/robot-specialization-detailed
+enregistrer('robot-specialization', """
+    select
+        r.nom_robot,
+        r.modele,
+        r.etat,
+        count(distinct a.id_scenario) as scenarios_traites,
+        count(a.id_action) as actions_totales,
+        count(*) filter (where a.resultat = 'succes') as succes,
+        count(*) filter (where a.resultat = 'mitigue') as mitiges,
+        count(*) filter (where a.resultat = 'echec') as echecs,
+        round(100.0 * count(*) filter (where a.resultat = 'succes')
+            / nullif(count(*), 0), 1) as taux_reussite
+    from robots r
+    left join actions a on r.id_robot = a.id_robot
+    group by r.id_robot, r.nom_robot, r.modele, r.etat
+    order by taux_reussite desc nulls last
+    limit 15
+""")
+
+enregistrer('scenarios-by-priority', """
+    select
+        s.priorite_loi as loi,
+        case
+            when s.priorite_loi = 1 then 'Loi 1: Protéger Vie Humaine'
+            when s.priorite_loi = 2 then 'Loi 2: Obéir aux Ordres'
+            when s.priorite_loi = 3 then 'Loi 3: Auto-Préservation'
+        end as loi_nom,
+        count(*) as scenario_count,
+        string_agg(s.description, ' | ' order by s.id_scenario) as scenarios_list
+    from scenarios s
+    group by s.priorite_loi
+    order by s.priorite_loi
+""")
+
+enregistrer('sector-risk-analysis', """
+    select
+        ro.localisation as secteur,
+        sum(ro.nb)::bigint as actions,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint as succes,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'echec'), 0)::bigint as echecs,
+        round(100.0 * coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint / sum(ro.nb), 1) as taux_reussite
+    from rollup_actions ro
+    where ro.vulnerabilite is not null
+    group by ro.localisation
+    order by taux_reussite desc
+""")
+
+enregistrer('action-categories', """
+    select
+        ro.action as categorie,
+        sum(ro.nb)::bigint as total,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint as succes,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'mitigue'), 0)::bigint as mitiges,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'echec'), 0)::bigint as echecs,
+        round(100.0 * coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint / sum(ro.nb), 1) as taux_reussite
+    from rollup_actions ro
+    group by ro.action
+    order by taux_reussite desc
+""")
+
+enregistrer('ethical-complexity', """
+    select
+        s.priorite_loi as loi,
+        case
+            when s.priorite_loi = 1 then 'Loi 1: Protéger Vie'
+            when s.priorite_loi = 2 then 'Loi 2: Obéir Ordres'
+            when s.priorite_loi = 3 then 'Loi 3: Auto-Préservation'
+        end as loi_nom,
+        count(distinct s.id_scenario) as scenario_count,
+        count(a.id_action) as total_attempts
+    from scenarios s
+    left join actions a on s.id_scenario = a.id_scenario
+    group by s.priorite_loi
+    order by s.priorite_loi
+""")
+
+enregistrer('dilemma-success-by-law', """
+    select
+        ro.priorite_loi as loi,
+        case
+            when ro.priorite_loi = 1 then 'Loi 1: Protéger Vie'
+            when ro.priorite_loi = 2 then 'Loi 2: Obéir Ordres'
+            when ro.priorite_loi = 3 then 'Loi 3: Auto-Préservation'
+        end as loi_nom,
+        sum(ro.nb)::bigint as total_actions,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint as succes,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'mitigue'), 0)::bigint as mitiges,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'echec'), 0)::bigint as echecs,
+        round(100.0 * coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint
+            / sum(ro.nb), 1) as pourcent_succes
+    from rollup_actions ro
+    where ro.priorite_loi is not null
+    group by ro.priorite_loi
+    order by ro.priorite_loi
+""")
+
+enregistrer('vulnerability-impact', """
+    select
+        ro.vulnerabilite,
+        sum(ro.nb)::bigint as actions_total,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint as succes,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'mitigue'), 0)::bigint as mitiges,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'echec'), 0)::bigint as echecs,
+        round(100.0 * coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint
+            / sum(ro.nb), 1) as taux_reussite
+    from rollup_actions ro
+    where ro.vulnerabilite is not null
+    group by ro.vulnerabilite
+    order by ro.vulnerabilite
+""")
+
+enregistrer('sector-ethical-analysis', """
+    select
+        ro.localisation as secteur,
+        count(distinct ro.id_scenario) as scenarios_distincts,
+        sum(ro.nb)::bigint as total_actions,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint as succes,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'mitigue'), 0)::bigint as mitiges,
+        coalesce(sum(ro.nb) filter (where ro.resultat = 'echec'), 0)::bigint as echecs,
+        round(100.0 * coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint
+            / sum(ro.nb), 1) as taux_reussite
+    from rollup_actions ro
+    where ro.vulnerabilite is not null
+    group by ro.localisation
+    order by taux_reussite desc
+""")
+
+enregistrer('law-conflict-analysis', """
+    select
+        case ro.priorite_loi
+            when 1 then 'Loi 1 (Protéger Vie)'
+            when 2 then 'Loi 2 (Obéir Ordres)'
+            when 3 then 'Loi 3 (Auto-Préservation)'
+        end as loi_principale,
+        count(distinct ro.id_scenario) as dilemmes_identifiés,
+        sum(ro.nb)::bigint as actions_liees,
+        round(100.0 * coalesce(sum(ro.nb) filter (where ro.resultat = 'succes'), 0)::bigint
+            / sum(ro.nb), 1) as resolution_rate
+    from rollup_actions ro
+    where ro.priorite_loi is not null
+    group by ro.priorite_loi
+    order by ro.priorite_loi
+""")
+
+enregistrer('robot-ethical-maturity', """
+    select
+        r.nom_robot,
+        r.modele,
+        count(distinct a.id_scenario) as scenarios_traites,
+        round(100.0 * count(*) filter (where a.resultat = 'succes')
+            / nullif(count(*), 0), 1) as reussite_rate,
+        count(distinct s.priorite_loi) as lois_traitees
+    from robots r
+    left join actions a on r.id_robot = a.id_robot
+    left join scenarios s on a.id_scenario = s.id_scenario
+    group by r.id_robot, r.nom_robot, r.modele
+    having count(a.id_action) > 0
+    order by reussite_rate desc nulls last
+    limit 10
+""")
+
+enregistrer('time-execution-patterns', """
+    select
+        ro.priorite_loi as loi,
+        case
+            when ro.priorite_loi = 1 then 'Urgence (Protéger Vie)'
+            when ro.priorite_loi = 2 then 'Protocole (Obéir)'
+            when ro.priorite_loi = 3 then 'Sécurité (Auto-Préserv.)'
+        end as categorie_decision,
+        sum(ro.nb)::bigint as decisions
+    from rollup_actions ro
+    where ro.priorite_loi is not null
+    group by ro.priorite_loi
+    order by ro.priorite_loi
+""")
+
+# compteurs et recommandation tenus à jour par triggers (script.sql) ; par
+# défaut, les scénarios avec au moins un échec comme l'ancienne table
+# temporaire recommandations_priorites
+enregistrer('recommendations', """
+    select
+        rs.id_scenario,
+        s.description,
+        s.priorite_loi as priorite_actuelle,
+        rs.nb_actions,
+        rs.nb_echecs,
+        rs.recommandation,
+        rs.maj_le
+    from recommandations_scenarios rs
+    join scenarios s on s.id_scenario = rs.id_scenario
+    where rs.nb_echecs >= %(min_echecs)s
+      and (%(loi)s is null or s.priorite_loi = %(loi)s)
+      and (%(recommandation)s is null or rs.recommandation = %(recommandation)s)
+    order by rs.nb_echecs desc, rs.id_scenario
+""", defauts={'min_echecs': 1, 'loi': None, 'recommandation': None})
@@ -83,3 +83,1029 @@ create index idx_actions_robot on actions(id_robot);
 create index idx_actions_scenario on actions(id_scenario);
 create index idx_scenarios_priorite on scenarios(priorite_loi);
 create index idx_robots_etat on robots(etat);
+
+
+
+-- ============================================================================
+-- optimisations du dashboard (app.py lit la base colonie)
+-- ============================================================================
+\c colonie
+
+
+-- codes de résultat, d'état et de vulnérabilité : des types enum plutôt que du
+-- texte libre (4 octets par valeur, comparaisons entières, ordre naturel
+-- faible < moyenne < elevee). Une valeur hors du type est refusée à l'écriture
+-- au lieu d'être comptée sous une autre graphie (« succès » ou « succes ») et
+-- de manquer silencieusement aux agrégats. libelles_codes donne le libellé
+-- affiché de chaque code et les graphies historiques reprises par la
+-- migration ; mêmes valeurs que codes.py.
+do $$
+begin
+    if to_regtype('resultat_action') is null then
+        create type resultat_action as enum ('succes', 'mitigue', 'echec');
+    end if;
+    if to_regtype('etat_robot') is null then
+        create type etat_robot as enum ('actif', 'maintenance', 'hors_service', 'en_panne', 'retraite');
+    end if;
+    if to_regtype('niveau_vulnerabilite') is null then
+        create type niveau_vulnerabilite as enum ('faible', 'moyenne', 'elevee');
+    end if;
+end $$;
+
+create table if not exists libelles_codes (
+    type text not null,
+    code text not null,
+    libelle text not null,
+    variantes text[] not null default '{}',
+    primary key (type, code)
+);
+
+insert into libelles_codes (type, code, libelle, variantes) values
+    ('resultat_action', 'succes', 'Succès', '{succès,success,réussite,reussite}'),
+    ('resultat_action', 'mitigue', 'Mitigé', '{mitigé,mitige}'),
+    ('resultat_action', 'echec', 'Échec', '{échec,echoue,échoué}'),
+    ('etat_robot', 'actif', 'Actif', '{opérationnel,operationnel}'),
+    ('etat_robot', 'maintenance', 'Maintenance', '{}'),
+    ('etat_robot', 'hors_service', 'Hors service', '{inactif,hors service}'),
+    ('etat_robot', 'en_panne', 'En panne', '{en panne,panne}'),
+    ('etat_robot', 'retraite', 'Retraité', '{retraité}'),
+    ('niveau_vulnerabilite', 'faible', 'Faible', '{basse,bas}'),
+    ('niveau_vulnerabilite', 'moyenne', 'Moyenne', '{moyen}'),
+    ('niveau_vulnerabilite', 'elevee', 'Élevée', '{élevée,élevé,eleve,haute}')
+on conflict (type, code) do update set libelle = excluded.libelle, variantes = excluded.variantes;
+
+-- code d'une valeur saisie (casse et espaces ignorés), null si inconnue
+create or replace function code_de(type text, valeur text) returns text
+language sql stable as $$
+    select l.code from libelles_codes l
+    where l.type = $1 and (l.code = lower(btrim($2)) or lower(btrim($2)) = any(l.variantes))
+$$;
+
+-- passe une colonne texte au type enum `type`, chaque valeur ramenée à son
+-- code. Une valeur sans code arrête la migration plutôt que d'être perdue. Les
+-- vues qui lisent la colonne sont supprimées (leurs définitions comparent du
+-- texte, souvent dans l'ancienne graphie) : relancer queries.sql les recrée.
+create or replace function convertir_en_code(tab regclass, colonne text, type text) returns void
+language plpgsql as $$
+declare
+    inconnues text;
+    vue record;
+begin
+    if (select format_type(atttypid, null) from pg_attribute
+        where attrelid = tab and attname = colonne) = type then
+        return;
+    end if;
+    execute format('select string_agg(distinct %1$I::text, '', '') from %2$s
+                    where %1$I is not null and code_de(%3$L, %1$I::text) is null',
+                   colonne, tab, type)
+        into inconnues;
+    if inconnues is not null then
+        raise exception '%.% : valeurs sans code % : %', tab, colonne, type, inconnues
+            using hint = 'ajouter ces graphies aux variantes de libelles_codes';
+    end if;
+
+    for vue in
+        with recursive dependantes(oid) as (
+            select r.ev_class
+            from pg_depend d
+            join pg_rewrite r on r.oid = d.objid
+            join pg_attribute a on a.attrelid = d.refobjid and a.attnum = d.refobjsubid
+            where d.refobjid = tab and a.attname = colonne and r.ev_class <> tab
+            union
+            select r.ev_class
+            from dependantes v
+            join pg_depend d on d.refobjid = v.oid
+            join pg_rewrite r on r.oid = d.objid
+            where r.ev_class <> v.oid
+        )
+        select c.relname as nom, c.relkind
+        from dependantes v
+        join pg_class c on c.oid = v.oid and c.relkind in ('v', 'm')
+        order by c.oid desc
+    loop
+        execute format('drop %s if exists %I cascade',
+                       case vue.relkind when 'm' then 'materialized view' else 'view' end, vue.nom);
+        raise notice 'vue % supprimée, relancer queries.sql', vue.nom;
+    end loop;
+
+    execute format('alter table %1$s alter column %2$I type %3$I using code_de(%3$L, %2$I::text)::%3$I',
+                   tab, colonne, type);
+end $$;
+
+select convertir_en_code('robots', 'etat', 'etat_robot');
+select convertir_en_code('humains', 'vulnerabilite', 'niveau_vulnerabilite');
+select convertir_en_code('actions', 'resultat', 'resultat_action');
+
+
+-- partitionnement mensuel de actions (par timestamp) : les requêtes sur une
+-- fenêtre récente (vue_maintenance_robots, /api/timeline) ne lisent que les
+-- partitions concernées. Pas de partition par défaut : elle empêcherait le
+-- parcours ordonné des partitions (Append au lieu de Merge Append) qui permet
+-- à la chronologie de s'arrêter dans la partition la plus récente. Une ligne
+-- hors des partitions existantes est refusée : maintenir_partitions_actions()
+-- (fin du script) crée les mois à venir.
+
+-- crée les partitions mensuelles manquantes, du mois de `debut` à celui de `fin`
+create or replace function creer_partitions_actions(debut date, fin date) returns setof text
+language plpgsql as $$
+declare
+    mois date := date_trunc('month', debut);
+    nom text;
+begin
+    while mois <= fin loop
+        nom := 'actions_' || to_char(mois, 'YYYY_MM');
+        if to_regclass(nom) is null then
+            execute format('create table %I partition of actions for values from (%L) to (%L)',
+                           nom, mois, (mois + interval '1 month')::date);
+            return next nom;
+        end if;
+        mois := mois + interval '1 month';
+    end loop;
+end $$;
+
+-- migration d'une table actions ordinaire : les lignes sont recopiées dans la
+-- table partitionnée, les vues (et vues matérialisées) qui lisent actions
+-- (queries.sql) recréées avec leurs index et leurs droits. Les triggers et
+-- index des sections suivantes sont créés sur la nouvelle table, compteurs et
+-- rollup recalculés plus bas.
+do $$
+declare
+    sequence_id text := pg_get_serial_sequence('actions', 'id_action');
+    droits_actions aclitem[];
+    vue record;
+    droit record;
+    definition text;
+    premier timestamp;
+    dernier timestamp;
+begin
+    if (select relkind from pg_class where oid = 'actions'::regclass) = 'p' then
+        return;
+    end if;
+    lock table actions in access exclusive mode;
+    select relacl into droits_actions from pg_class where oid = 'actions'::regclass;
+
+    create temp table vues_actions on commit drop as
+    with recursive dependantes(oid) as (
+        select r.ev_class
+        from pg_depend d
+        join pg_rewrite r on r.oid = d.objid
+        where d.refobjid = 'actions'::regclass and r.ev_class <> 'actions'::regclass
+        union
+        select r.ev_class
+        from dependantes v
+        join pg_depend d on d.refobjid = v.oid
+        join pg_rewrite r on r.oid = d.objid
+        where r.ev_class <> v.oid
+    )
+    select c.oid, c.relname as nom, c.relkind, c.relowner, c.relacl,
+           pg_get_viewdef(c.oid) as definition,
+           array(select indexdef from pg_indexes where schemaname = 'public' and tablename = c.relname) as index
+    from dependantes v
+    join pg_class c on c.oid = v.oid and c.relkind in ('v', 'm');
+    for vue in select nom, relkind from vues_actions order by oid desc loop
+        execute format('drop %s if exists %I cascade',
+                       case vue.relkind when 'm' then 'materialized view' else 'view' end, vue.nom);
+    end loop;
+
+    alter table actions rename to actions_avant_partition;
+    alter table actions_avant_partition rename constraint actions_pkey to actions_avant_partition_pkey;
+    -- libère les noms d'index et de contraintes pour la nouvelle table
+    for vue in
+        select indexrelid::regclass as nom from pg_index
+        where indrelid = 'actions_avant_partition'::regclass and not indisprimary
+    loop
+        execute format('drop index %s', vue.nom);
+    end loop;
+    for vue in
+        select conname as nom from pg_constraint
+        where conrelid = 'actions_avant_partition'::regclass and contype = 'f'
+    loop
+        execute format('alter table actions_avant_partition drop constraint %I', vue.nom);
+    end loop;
+    execute format('alter sequence %s owned by none', sequence_id);
+
+    -- la clé primaire d'une table partitionnée contient la clé de partition
+    execute format($f$
+        create table actions (
+            id_action integer not null default nextval(%L),
+            id_robot integer references robots(id_robot),
+            id_humain integer references humains(id_humain),
+            id_scenario integer references scenarios(id_scenario),
+            action text not null,
+            timestamp timestamp not null,
+            resultat resultat_action not null,
+            primary key (id_action, timestamp)
+        ) partition by range (timestamp)
+    $f$, sequence_id);
+    execute format('alter sequence %s owned by actions.id_action', sequence_id);
+
+    select min(timestamp), max(timestamp) into premier, dernier from actions_avant_partition;
+    perform creer_partitions_actions(least(premier::date, current_date),
+                                     greatest(dernier::date, (current_date + interval '3 months')::date));
+    insert into actions (id_action, id_robot, id_humain, id_scenario, action, timestamp, resultat)
+    select id_action, id_robot, id_humain, id_scenario, action, timestamp, resultat
+    from actions_avant_partition;
+    drop table actions_avant_partition;
+
+    for vue in select * from vues_actions order by oid loop
+        execute format('create %s %I as %s',
+                       case vue.relkind when 'm' then 'materialized view' else 'view' end,
+                       vue.nom, rtrim(vue.definition, ';'));
+        foreach definition in array vue.index loop
+            execute definition;
+        end loop;
+    end loop;
+    for droit in
+        select 'actions' as nom, a.privilege_type, a.grantee
+        from aclexplode(droits_actions) a
+        where a.grantee <> (select relowner from pg_class where oid = 'actions'::regclass)
+        union all
+        select v.nom, a.privilege_type, a.grantee
+        from vues_actions v, aclexplode(v.relacl) a
+        where a.grantee <> v.relowner
+    loop
+        execute format('grant %s on %I to %s', droit.privilege_type, droit.nom,
+                       case when droit.grantee = 0 then 'public' else droit.grantee::regrole::text end);
+    end loop;
+    analyze actions;
+end $$;
+
+
+-- compteurs maintenus par triggers : /api/global-stats lit cette table au lieu
+-- de refaire les count(*) sur toutes les tables
+create table if not exists compteurs (
+    categorie text not null,
+    cle text not null default '',
+    valeur bigint not null default 0,
+    primary key (categorie, cle)
+);
+
+-- trigger par instruction (tables de transition) : un COPY d'un million de lignes
+-- ne fait qu'une mise à jour par compteur.
+-- tg_argv[0] : catégorie du total, tg_argv[1] (optionnel) : colonne ventilée
+create or replace function maj_compteurs() returns trigger
+language plpgsql as $$
+declare
+    cat text := tg_argv[0];
+    cat_detail text := case when tg_nargs > 1 then tg_argv[0] || '_' || tg_argv[1] end;
+    lignes text[] := '{}';
+    sources text[][] := '{}';
+    src text[];
+begin
+    if tg_op = 'TRUNCATE' then
+        update compteurs set valeur = 0 where categorie in (cat, cat_detail);
+        return null;
+    end if;
+
+    if tg_op in ('INSERT', 'UPDATE') then
+        sources := sources || array[['nouvelles', '1']];
+    end if;
+    if tg_op in ('DELETE', 'UPDATE') then
+        sources := sources || array[['anciennes', '-1']];
+    end if;
+
+    foreach src slice 1 in array sources loop
+        lignes := lignes || format('select %L as categorie, %L as cle, %s as n from %I',
+                                   cat, '', src[2], src[1]);
+        if cat_detail is not null then
+            lignes := lignes || format('select %L, coalesce(%I::text, %L), %s from %I',
+                                       cat_detail, tg_argv[1], '', src[2], src[1]);
+        end if;
+    end loop;
+
+    execute format($f$
+        insert into compteurs (categorie, cle, valeur)
+        select categorie, cle, sum(n) from (%s) d
+        group by categorie, cle
+        having sum(n) <> 0
+        on conflict (categorie, cle) do update set valeur = compteurs.valeur + excluded.valeur
+    $f$, array_to_string(lignes, ' union all '));
+    return null;
+end $$;
+
+drop trigger if exists compteurs_actions_ins on actions;
+drop trigger if exists compteurs_actions_upd on actions;
+drop trigger if exists compteurs_actions_del on actions;
+drop trigger if exists compteurs_actions_trunc on actions;
+create trigger compteurs_actions_ins after insert on actions
+    referencing new table as nouvelles
+    for each statement execute function maj_compteurs('actions', 'resultat');
+create trigger compteurs_actions_upd after update on actions
+    referencing old table as anciennes new table as nouvelles
+    for each statement execute function maj_compteurs('actions', 'resultat');
+create trigger compteurs_actions_del after delete on actions
+    referencing old table as anciennes
+    for each statement execute function maj_compteurs('actions', 'resultat');
+create trigger compteurs_actions_trunc after truncate on actions
+    for each statement execute function maj_compteurs('actions', 'resultat');
+
+drop trigger if exists compteurs_robots_ins on robots;
+drop trigger if exists compteurs_robots_upd on robots;
+drop trigger if exists compteurs_robots_del on robots;
+drop trigger if exists compteurs_robots_trunc on robots;
+create trigger compteurs_robots_ins after insert on robots
+    referencing new table as nouvelles
+    for each statement execute function maj_compteurs('robots', 'etat');
+create trigger compteurs_robots_upd after update on robots
+    referencing old table as anciennes new table as nouvelles
+    for each statement execute function maj_compteurs('robots', 'etat');
+create trigger compteurs_robots_del after delete on robots
+    referencing old table as anciennes
+    for each statement execute function maj_compteurs('robots', 'etat');
+create trigger compteurs_robots_trunc after truncate on robots
+    for each statement execute function maj_compteurs('robots', 'etat');
+
+drop trigger if exists compteurs_humains_ins on humains;
+drop trigger if exists compteurs_humains_del on humains;
+drop trigger if exists compteurs_humains_trunc on humains;
+create trigger compteurs_humains_ins after insert on humains
+    referencing new table as nouvelles
+    for each statement execute function maj_compteurs('humains');
+create trigger compteurs_humains_del after delete on humains
+    referencing old table as anciennes
+    for each statement execute function maj_compteurs('humains');
+create trigger compteurs_humains_trunc after truncate on humains
+    for each statement execute function maj_compteurs('humains');
+
+drop trigger if exists compteurs_scenarios_ins on scenarios;
+drop trigger if exists compteurs_scenarios_del on scenarios;
+drop trigger if exists compteurs_scenarios_trunc on scenarios;
+create trigger compteurs_scenarios_ins after insert on scenarios
+    referencing new table as nouvelles
+    for each statement execute function maj_compteurs('scenarios');
+create trigger compteurs_scenarios_del after delete on scenarios
+    referencing old table as anciennes
+    for each statement execute function maj_compteurs('scenarios');
+create trigger compteurs_scenarios_trunc after truncate on scenarios
+    for each statement execute function maj_compteurs('scenarios');
+
+-- recalcule les compteurs depuis les tables et renvoie les écarts trouvés.
+-- le verrou share bloque les écritures le temps du recalcul (pas les lectures)
+create or replace function reconcilier_compteurs(corriger boolean default true)
+returns table (categorie text, cle text, compteur bigint, reel bigint)
+language plpgsql as $$
+#variable_conflict use_column
+begin
+    lock table actions, robots, humains, scenarios in share mode;
+
+    drop table if exists compteurs_reels;
+    create temp table compteurs_reels on commit drop as
+        select 'actions'::text as categorie, ''::text as cle, count(*)::bigint as valeur from actions
+        union all
+        select 'actions_resultat', coalesce(resultat::text, ''), count(*) from actions group by 2
+        union all
+        select 'robots', '', count(*) from robots
+        union all
+        select 'robots_etat', coalesce(etat::text, ''), count(*) from robots group by 2
+        union all
+        select 'humains', '', count(*) from humains
+        union all
+        select 'scenarios', '', count(*) from scenarios;
+
+    return query
+        select coalesce(c.categorie, r.categorie), coalesce(c.cle, r.cle),
+               coalesce(c.valeur, 0), coalesce(r.valeur, 0)
+        from compteurs c
+        full join compteurs_reels r on r.categorie = c.categorie and r.cle = c.cle
+        where coalesce(c.valeur, 0) <> coalesce(r.valeur, 0)
+        order by 1, 2;
+
+    if corriger then
+        delete from compteurs;
+        insert into compteurs (categorie, cle, valeur)
+        select categorie, cle, valeur from compteurs_reels;
+    end if;
+end $$;
+
+-- initialisation
+select * from reconcilier_compteurs();
+
+
+-- rollup des actions : une ligne par groupe (robot, vulnérabilité/secteur de l'humain,
+-- scénario, loi, action, résultat, jour). Les endpoints d'agrégats lisent cette table,
+-- dont la taille dépend du nombre de groupes et non de l'historique des actions.
+create table if not exists rollup_actions (
+    id_robot integer,
+    id_scenario integer,
+    priorite_loi integer,
+    vulnerabilite niveau_vulnerabilite,
+    localisation text,
+    action text not null,
+    resultat resultat_action not null,
+    jour date,
+    nb bigint not null,
+    constraint rollup_actions_groupe unique nulls not distinct
+        (id_robot, id_scenario, priorite_loi, vulnerabilite, localisation, action, resultat, jour)
+);
+
+select convertir_en_code('rollup_actions', 'vulnerabilite', 'niveau_vulnerabilite');
+select convertir_en_code('rollup_actions', 'resultat', 'resultat_action');
+
+create index if not exists idx_rollup_actions_scenario on rollup_actions(id_scenario);
+create index if not exists idx_rollup_actions_vide on rollup_actions(nb) where nb = 0;
+create index if not exists idx_actions_humain on actions(id_humain);
+
+-- ajoute (signe 1) ou retire (signe -1) les lignes des tables de transition du rollup
+create or replace function maj_rollup_actions() returns trigger
+language plpgsql as $$
+declare
+    lignes text[] := '{}';
+begin
+    if tg_op = 'TRUNCATE' then
+        truncate rollup_actions;
+        return null;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        lignes := lignes || 'select id_robot, id_humain, id_scenario, action, resultat, timestamp, 1 as signe from nouvelles'::text;
+    end if;
+    if tg_op in ('DELETE', 'UPDATE') then
+        lignes := lignes || 'select id_robot, id_humain, id_scenario, action, resultat, timestamp, -1 as signe from anciennes'::text;
+    end if;
+
+    execute format($f$
+        insert into rollup_actions as ro
+            (id_robot, id_scenario, priorite_loi, vulnerabilite, localisation, action, resultat, jour, nb)
+        select d.id_robot, d.id_scenario, s.priorite_loi, h.vulnerabilite, h.localisation,
+               d.action, d.resultat, d.timestamp::date, sum(d.signe)
+        from (%s) d
+        left join humains h on h.id_humain = d.id_humain
+        left join scenarios s on s.id_scenario = d.id_scenario
+        group by 1, 2, 3, 4, 5, 6, 7, 8
+        having sum(d.signe) <> 0
+        on conflict on constraint rollup_actions_groupe do update set nb = ro.nb + excluded.nb
+    $f$, array_to_string(lignes, ' union all '));
+
+    if tg_op <> 'INSERT' then
+        delete from rollup_actions where nb = 0;
+    end if;
+    return null;
+end $$;
+
+drop trigger if exists rollup_actions_ins on actions;
+drop trigger if exists rollup_actions_upd on actions;
+drop trigger if exists rollup_actions_del on actions;
+drop trigger if exists rollup_actions_trunc on actions;
+create trigger rollup_actions_ins after insert on actions
+    referencing new table as nouvelles
+    for each statement execute function maj_rollup_actions();
+create trigger rollup_actions_upd after update on actions
+    referencing old table as anciennes new table as nouvelles
+    for each statement execute function maj_rollup_actions();
+create trigger rollup_actions_del after delete on actions
+    referencing old table as anciennes
+    for each statement execute function maj_rollup_actions();
+create trigger rollup_actions_trunc after truncate on actions
+    for each statement execute function maj_rollup_actions();
+
+-- un humain qui change de vulnérabilité ou de secteur déplace ses actions de groupe
+-- (les tables de transition interdisent 'update of <colonnes>' : les lignes
+-- dont ni la vulnérabilité ni le secteur n'ont changé sont écartées avant de
+-- lire les actions)
+create or replace function maj_rollup_humains() returns trigger
+language plpgsql as $$
+begin
+    if not exists (
+        select 1 from anciennes o join nouvelles n on n.id_humain = o.id_humain
+        where (n.vulnerabilite, n.localisation) is distinct from (o.vulnerabilite, o.localisation)
+    ) then
+        return null;
+    end if;
+
+    insert into rollup_actions as ro
+        (id_robot, id_scenario, priorite_loi, vulnerabilite, localisation, action, resultat, jour, nb)
+    select a.id_robot, a.id_scenario, s.priorite_loi, x.vulnerabilite, x.localisation,
+           a.action, a.resultat, a.timestamp::date, sum(x.signe)
+    from (
+        select n.id_humain, c.vulnerabilite, c.localisation, c.signe
+        from anciennes o
+        join nouvelles n on n.id_humain = o.id_humain
+        cross join lateral (values (n.vulnerabilite, n.localisation, 1),
+                                   (o.vulnerabilite, o.localisation, -1)) c(vulnerabilite, localisation, signe)
+        where (n.vulnerabilite, n.localisation) is distinct from (o.vulnerabilite, o.localisation)
+    ) x
+    join actions a on a.id_humain = x.id_humain
+    left join scenarios s on s.id_scenario = a.id_scenario
+    group by 1, 2, 3, 4, 5, 6, 7, 8
+    having sum(x.signe) <> 0
+    on conflict on constraint rollup_actions_groupe do update set nb = ro.nb + excluded.nb;
+
+    delete from rollup_actions where nb = 0;
+    return null;
+end $$;
+
+drop trigger if exists rollup_humains_upd on humains;
+create trigger rollup_humains_upd after update on humains
+    referencing old table as anciennes new table as nouvelles
+    for each statement execute function maj_rollup_humains();
+
+-- la loi d'un scénario est recopiée dans le rollup
+create or replace function maj_rollup_scenarios() returns trigger
+language plpgsql as $$
+begin
+    update rollup_actions ro set priorite_loi = n.priorite_loi
+    from nouvelles n
+    where ro.id_scenario = n.id_scenario
+      and ro.priorite_loi is distinct from n.priorite_loi;
+    return null;
+end $$;
+
+drop trigger if exists rollup_scenarios_upd on scenarios;
+create trigger rollup_scenarios_upd after update on scenarios
+    referencing new table as nouvelles
+    for each statement execute function maj_rollup_scenarios();
+
+-- reconstruction complète (initialisation ou après un chargement sans triggers)
+create or replace function reconstruire_rollup_actions() returns bigint
+language plpgsql as $$
+declare
+    nb_groupes bigint;
+begin
+    lock table actions in share mode;
+    truncate rollup_actions;
+    insert into rollup_actions
+        (id_robot, id_scenario, priorite_loi, vulnerabilite, localisation, action, resultat, jour, nb)
+    select a.id_robot, a.id_scenario, s.priorite_loi, h.vulnerabilite, h.localisation,
+           a.action, a.resultat, a.timestamp::date, count(*)
+    from actions a
+    left join humains h on h.id_humain = a.id_humain
+    left join scenarios s on s.id_scenario = a.id_scenario
+    group by 1, 2, 3, 4, 5, 6, 7, 8;
+    get diagnostics nb_groupes = row_count;
+    return nb_groupes;
+end $$;
+
+select reconstruire_rollup_actions();
+
+
+-- séries temporelles (/api/timeseries, vue_performance_horaire) : nombre
+-- d'actions par heure et par jour (`pas`), ventilé séparément par modèle, loi et
+-- secteur (`axe`, `valeur`) et par résultat. Une action compte dans 6 lignes ;
+-- une année lue par jour et par modèle parcourt quelques milliers de lignes
+-- quel que soit le nombre d'actions. Les semaines sont regroupées depuis les
+-- jours.
+create table if not exists series_actions (
+    pas text not null check (pas in ('hour', 'day')),
+    axe text not null check (axe in ('modele', 'loi', 'secteur')),
+    debut timestamp not null,
+    valeur text,
+    resultat resultat_action not null,
+    nb bigint not null,
+    constraint series_actions_groupe unique nulls not distinct (pas, axe, debut, valeur, resultat)
+);
+
+create index if not exists idx_series_actions_vide on series_actions(nb) where nb = 0;
+
+-- instruction qui ajoute aux séries les lignes (id_robot, id_humain,
+-- id_scenario, timestamp, resultat, signe) de `source`. Renvoyée et non
+-- exécutée : les tables de transition ne sont visibles que du trigger.
+create or replace function requete_series_actions(source text) returns text
+language sql immutable as $$
+    select format($f$
+        insert into series_actions as se (pas, axe, debut, valeur, resultat, nb)
+        select p.pas, x.axe, date_trunc(p.pas, d.timestamp), x.valeur, d.resultat, sum(d.signe)
+        from (%s) d
+        left join robots r on r.id_robot = d.id_robot
+        left join humains h on h.id_humain = d.id_humain
+        left join scenarios s on s.id_scenario = d.id_scenario
+        cross join (values ('hour'), ('day')) p(pas)
+        cross join lateral (values ('modele', r.modele),
+                                   ('loi', s.priorite_loi::text),
+                                   ('secteur', h.localisation)) x(axe, valeur)
+        group by 1, 2, 3, 4, 5
+        having sum(d.signe) <> 0
+        on conflict on constraint series_actions_groupe do update set nb = se.nb + excluded.nb
+    $f$, source)
+$$;
+
+create or replace function maj_series_actions() returns trigger
+language plpgsql as $$
+declare
+    lignes text[] := '{}';
+begin
+    if tg_op = 'TRUNCATE' then
+        truncate series_actions;
+        return null;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        lignes := lignes || 'select id_robot, id_humain, id_scenario, timestamp, resultat, 1 as signe from nouvelles'::text;
+    end if;
+    if tg_op in ('DELETE', 'UPDATE') then
+        lignes := lignes || 'select id_robot, id_humain, id_scenario, timestamp, resultat, -1 as signe from anciennes'::text;
+    end if;
+    execute requete_series_actions(array_to_string(lignes, ' union all '));
+
+    if tg_op <> 'INSERT' then
+        delete from series_actions where nb = 0;
+    end if;
+    return null;
+end $$;
+
+drop trigger if exists series_actions_ins on actions;
+drop trigger if exists series_actions_upd on actions;
+drop trigger if exists series_actions_del on actions;
+drop trigger if exists series_actions_trunc on actions;
+create trigger series_actions_ins after insert on actions
+    referencing new table as nouvelles
+    for each statement execute function maj_series_actions();
+create trigger series_actions_upd after update on actions
+    referencing old table as anciennes new table as nouvelles
+    for each statement execute function maj_series_actions();
+create trigger series_actions_del after delete on actions
+    referencing old table as anciennes
+    for each statement execute function maj_series_actions();
+create trigger series_actions_trunc after truncate on actions
+    for each statement execute function maj_series_actions();
+
+-- un robot qui change de modèle (humain de secteur, scénario de loi) déplace
+-- ses actions d'une valeur à l'autre de l'axe ; les lignes dont la colonne de
+-- l'axe n'a pas changé (changement d'état d'un robot...) ne lisent pas les
+-- actions.
+-- tg_argv[0] : axe, tg_argv[1] : clé commune avec actions, tg_argv[2] : colonne de l'axe
+create or replace function maj_series_referentiel() returns trigger
+language plpgsql as $$
+declare
+    modifies boolean;
+begin
+    execute format($f$
+        select exists (select 1 from anciennes o join nouvelles n on n.%1$I = o.%1$I
+                       where n.%2$I is distinct from o.%2$I)
+    $f$, tg_argv[1], tg_argv[2]) into modifies;
+    if not modifies then
+        return null;
+    end if;
+
+    execute format($f$
+        insert into series_actions as se (pas, axe, debut, valeur, resultat, nb)
+        select p.pas, %1$L, date_trunc(p.pas, a.timestamp), x.valeur, a.resultat, sum(x.signe)
+        from (
+            select n.%2$I as id, c.valeur, c.signe
+            from anciennes o
+            join nouvelles n on n.%2$I = o.%2$I
+            cross join lateral (values (n.%3$I::text, 1), (o.%3$I::text, -1)) c(valeur, signe)
+            where n.%3$I is distinct from o.%3$I
+        ) x
+        join actions a on a.%2$I = x.id
+        cross join (values ('hour'), ('day')) p(pas)
+        group by 1, 2, 3, 4, 5
+        having sum(x.signe) <> 0
+        on conflict on constraint series_actions_groupe do update set nb = se.nb + excluded.nb
+    $f$, tg_argv[0], tg_argv[1], tg_argv[2]);
+
+    delete from series_actions where nb = 0;
+    return null;
+end $$;
+
+drop trigger if exists series_robots_upd on robots;
+drop trigger if exists series_humains_upd on humains;
+drop trigger if exists series_scenarios_upd on scenarios;
+create trigger series_robots_upd after update on robots
+    referencing old table as anciennes new table as nouvelles
+    for each statement execute function maj_series_referentiel('modele', 'id_robot', 'modele');
+create trigger series_humains_upd after update on humains
+    referencing old table as anciennes new table as nouvelles
+    for each statement execute function maj_series_referentiel('secteur', 'id_humain', 'localisation');
+create trigger series_scenarios_upd after update on scenarios
+    referencing old table as anciennes new table as nouvelles
+    for each statement execute function maj_series_referentiel('loi', 'id_scenario', 'priorite_loi');
+
+-- reconstruction complète (initialisation ou après un chargement sans triggers)
+create or replace function reconstruire_series_actions() returns bigint
+language plpgsql as $$
+declare
+    nb_groupes bigint;
+begin
+    lock table actions in share mode;
+    truncate series_actions;
+    execute requete_series_actions(
+        'select id_robot, id_humain, id_scenario, timestamp, resultat, 1 as signe from actions');
+    select count(*) into nb_groupes from series_actions;
+    return nb_groupes;
+end $$;
+
+select reconstruire_series_actions();
+
+
+-- recommandations par scénario (/api/recommendations), à la place de la table
+-- temporaire recommandations_priorites de queries.sql : le nombre d'actions et
+-- d'échecs de chaque scénario est tenu à jour par triggers, et la
+-- recommandation n'est recalculée que pour les scénarios touchés. Un scénario
+-- reçoit la recommandation du plus haut seuil de seuils_recommandations que
+-- son nombre d'échecs dépasse strictement.
+create table if not exists seuils_recommandations (
+    recommandation text primary key,
+    seuil_echecs integer not null check (seuil_echecs >= 0)
+);
+
+insert into seuils_recommandations (recommandation, seuil_echecs) values
+    ('Réévaluation urgente du scénario recommandée', 3),
+    ('Formation supplémentaire des robots recommandée', 1)
+on conflict do nothing;
+
+create table if not exists recommandations_scenarios (
+    id_scenario integer primary key,
+    nb_actions bigint not null,
+    nb_echecs bigint not null,
+    recommandation text not null,
+    maj_le timestamptz not null default now()
+);
+
+create index if not exists idx_recommandations_echecs on recommandations_scenarios(nb_echecs desc);
+
+create or replace function recommandation_pour(nb_echecs bigint) returns text
+language sql stable as $$
+    select coalesce((select s.recommandation
+                     from seuils_recommandations s
+                     where nb_echecs > s.seuil_echecs
+                     order by s.seuil_echecs desc, s.recommandation
+                     limit 1),
+                    'Aucune action requise')
+$$;
+
+-- instruction qui ajoute aux compteurs les lignes (id_scenario, resultat,
+-- signe) de `source`, renvoyée comme celle de requete_series_actions. Les
+-- scénarios sans variation (mise à jour d'une autre colonne) ne sont pas
+-- réécrits.
+create or replace function requete_recommandations(source text) returns text
+language sql immutable as $$
+    select format($f$
+        insert into recommandations_scenarios as rs (id_scenario, nb_actions, nb_echecs, recommandation)
+        select g.id_scenario, g.nb_actions, g.nb_echecs, recommandation_pour(g.nb_echecs)
+        from (
+            select d.id_scenario,
+                   sum(d.signe) as nb_actions,
+                   coalesce(sum(d.signe) filter (where d.resultat = 'echec'), 0) as nb_echecs
+            from (%s) d
+            join scenarios s on s.id_scenario = d.id_scenario
+            group by d.id_scenario
+        ) g
+        where g.nb_actions <> 0 or g.nb_echecs <> 0
+        on conflict (id_scenario) do update set
+            nb_actions = rs.nb_actions + excluded.nb_actions,
+            nb_echecs = rs.nb_echecs + excluded.nb_echecs,
+            recommandation = recommandation_pour(rs.nb_echecs + excluded.nb_echecs),
+            maj_le = now()
+    $f$, source)
+$$;
+
+create or replace function maj_recommandations() returns trigger
+language plpgsql as $$
+declare
+    lignes text[] := '{}';
+begin
+    if tg_op = 'TRUNCATE' then
+        truncate recommandations_scenarios;
+        return null;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        lignes := lignes || 'select id_scenario, resultat, 1 as signe from nouvelles'::text;
+    end if;
+    if tg_op in ('DELETE', 'UPDATE') then
+        lignes := lignes || 'select id_scenario, resultat, -1 as signe from anciennes'::text;
+    end if;
+    execute requete_recommandations(array_to_string(lignes, ' union all '));
+    return null;
+end $$;
+
+drop trigger if exists recommandations_ins on actions;
+drop trigger if exists recommandations_upd on actions;
+drop trigger if exists recommandations_del on actions;
+drop trigger if exists recommandations_trunc on actions;
+create trigger recommandations_ins after insert on actions
+    referencing new table as nouvelles
+    for each statement execute function maj_recommandations();
+create trigger recommandations_upd after update on actions
+    referencing old table as anciennes new table as nouvelles
+    for each statement execute function maj_recommandations();
+create trigger recommandations_del after delete on actions
+    referencing old table as anciennes
+    for each statement execute function maj_recommandations();
+create trigger recommandations_trunc after truncate on actions
+    for each statement execute function maj_recommandations();
+
+-- un seuil ajouté, modifié ou retiré reclasse les scénarios sans recompter
+-- leurs actions
+create or replace function reclasser_recommandations() returns trigger
+language plpgsql as $$
+begin
+    update recommandations_scenarios
+    set recommandation = recommandation_pour(nb_echecs), maj_le = now()
+    where recommandation <> recommandation_pour(nb_echecs);
+    return null;
+end $$;
+
+drop trigger if exists recommandations_seuils on seuils_recommandations;
+create trigger recommandations_seuils after insert or update or delete or truncate on seuils_recommandations
+    for each statement execute function reclasser_recommandations();
+
+-- reconstruction complète (initialisation ou après un chargement sans triggers)
+create or replace function reconstruire_recommandations() returns bigint
+language plpgsql as $$
+declare
+    nb_scenarios bigint;
+begin
+    lock table actions in share mode;
+    truncate recommandations_scenarios;
+    execute requete_recommandations(
+        'select id_scenario, resultat, 1 as signe from actions');
+    get diagnostics nb_scenarios = row_count;
+    return nb_scenarios;
+end $$;
+
+select reconstruire_recommandations();
+
+
+-- version des données : incrémentée une fois par transaction qui écrit dans les
+-- tables lues par le dashboard, et diffusée par NOTIFY, pour invalider le cache
+-- de réponses de app.py. L'incrément est fait au commit (trigger différé) : les
+-- écritures concurrentes ne se suivent sur la ligne de version_donnees que le
+-- temps de leur commit, et non jusqu'à la fin de leur transaction.
+create table if not exists version_donnees (
+    id boolean primary key default true check (id),
+    version bigint not null default 0,
+    modifie_le timestamptz not null default now()
+);
+insert into version_donnees default values on conflict do nothing;
+
+create or replace function publier_version() returns void
+language plpgsql as $$
+declare
+    v bigint;
+    le timestamptz;
+begin
+    update version_donnees set version = version + 1, modifie_le = now()
+    returning version, modifie_le into v, le;
+    -- payload : "<version> <epoch>", livré au commit
+    perform pg_notify('colonie_modifications', v || ' ' || extract(epoch from le));
+end $$;
+
+-- une ligne par transaction en attente de publication, retirée au commit
+create table if not exists versions_a_publier (
+    txid bigint primary key
+);
+
+create or replace function publier_version_differee() returns trigger
+language plpgsql as $$
+begin
+    delete from versions_a_publier where txid = new.txid;
+    perform publier_version();
+    return null;
+end $$;
+
+drop trigger if exists publication_version on versions_a_publier;
+create constraint trigger publication_version after insert on versions_a_publier
+    deferrable initially deferred
+    for each row execute function publier_version_differee();
+
+-- publie une nouvelle version au commit de la transaction en cours, une seule
+-- fois quel que soit le nombre d'instructions
+create or replace function demander_version() returns void
+language plpgsql as $$
+begin
+    if current_setting('colonie.version_demandee', true) is distinct from txid_current()::text then
+        perform set_config('colonie.version_demandee', txid_current()::text, true);
+        insert into versions_a_publier (txid) values (txid_current());
+    end if;
+end $$;
+
+create or replace function signaler_modification() returns trigger
+language plpgsql as $$
+begin
+    perform demander_version();
+    return null;
+end $$;
+
+drop trigger if exists version_actions on actions;
+drop trigger if exists version_robots on robots;
+drop trigger if exists version_humains on humains;
+drop trigger if exists version_scenarios on scenarios;
+drop trigger if exists version_seuils_recommandations on seuils_recommandations;
+create trigger version_actions after insert or update or delete or truncate on actions
+    for each statement execute function signaler_modification();
+create trigger version_robots after insert or update or delete or truncate on robots
+    for each statement execute function signaler_modification();
+create trigger version_humains after insert or update or delete or truncate on humains
+    for each statement execute function signaler_modification();
+create trigger version_scenarios after insert or update or delete or truncate on scenarios
+    for each statement execute function signaler_modification();
+create trigger version_seuils_recommandations after insert or update or delete or truncate on seuils_recommandations
+    for each statement execute function signaler_modification();
+
+
+-- pagination par curseur de /api/timeline sur (timestamp, id_action) : chaque page
+-- est une lecture d'index, quelle que soit sa profondeur. Les index composites
+-- remplacent idx_actions_robot et idx_actions_scenario.
+create index if not exists idx_actions_timestamp on actions(timestamp desc, id_action desc);
+create index if not exists idx_actions_robot_timestamp on actions(id_robot, timestamp desc, id_action desc);
+create index if not exists idx_actions_scenario_timestamp on actions(id_scenario, timestamp desc, id_action desc);
+create index if not exists idx_actions_resultat_timestamp on actions(resultat, timestamp desc, id_action desc);
+drop index if exists idx_actions_robot;
+drop index if exists idx_actions_scenario;
+
+
+-- diffusion en direct des nouvelles actions (GET /api/events) : un NOTIFY par
+-- instruction d'insertion, quel que soit son nombre de lignes. Le payload
+-- résume le lot (nombre, répartition par résultat) et porte ses 10 actions les
+-- plus récentes au format de /api/timeline, sous la limite de 8000 octets de
+-- NOTIFY.
+create or replace function diffuser_actions() returns trigger
+language plpgsql as $$
+declare
+    resume jsonb;
+    dernieres jsonb;
+begin
+    select jsonb_build_object(
+        'nb', count(*),
+        'id_max', max(id_action),
+        'par_resultat', (select jsonb_object_agg(resultat, nb)
+                         from (select resultat, count(*) as nb from nouvelles group by resultat) r)
+    ) into resume
+    from nouvelles;
+
+    select coalesce(jsonb_agg(d order by d.timestamp desc, d.id_action desc), '[]') into dernieres
+    from (
+        select n.id_action, n.timestamp, left(n.action, 120) as action, n.resultat,
+               r.nom_robot, h.nom, left(s.description, 200) as description
+        from (select * from nouvelles order by timestamp desc, id_action desc limit 10) n
+        left join robots r on r.id_robot = n.id_robot
+        left join humains h on h.id_humain = n.id_humain
+        left join scenarios s on s.id_scenario = n.id_scenario
+    ) d;
+
+    -- textes très longs : le client recharge la chronologie au lieu de l'insérer
+    if octet_length(dernieres::text) > 7000 then
+        dernieres := '[]';
+        resume := resume || '{"tronque": true}';
+    end if;
+    perform pg_notify('colonie_actions', (resume || jsonb_build_object('dernieres', dernieres))::text);
+    return null;
+end $$;
+
+drop trigger if exists diffusion_actions on actions;
+create trigger diffusion_actions after insert on actions
+    referencing new table as nouvelles
+    for each statement execute function diffuser_actions();
+
+
+-- maintenance des partitions de actions (flask --app app partitions, chaque
+-- jour par cron) : crée le mois courant et les `mois_avance` suivants, et
+-- détache les mois terminés depuis plus de `retention_mois` mois. Une
+-- partition détachée reste une table (archive) sauf avec `supprimer` ; ses
+-- lignes sont retirées des compteurs, du rollup et des séries (découpés par
+-- jour ou par heure, donc exactement par mois), et des recommandations.
+create or replace function maintenir_partitions_actions(
+    mois_avance integer default 3,
+    retention_mois integer default null,
+    supprimer boolean default false
+) returns table (nom_partition text, operation text)
+language plpgsql as $$
+declare
+    p record;
+    limite date;
+begin
+    return query
+        select c, 'creee'::text
+        from creer_partitions_actions(current_date,
+                                      (current_date + make_interval(months => mois_avance))::date) c;
+    if retention_mois is null then
+        return;
+    end if;
+
+    limite := date_trunc('month', current_date) - make_interval(months => retention_mois);
+    for p in
+        select c.relname::text as nom, to_date(right(c.relname, 7), 'YYYY_MM') as mois
+        from pg_inherits i
+        join pg_class c on c.oid = i.inhrelid
+        where i.inhparent = 'actions'::regclass
+          and c.relname ~ '^actions_\d{4}_\d{2}$'
+          and to_date(right(c.relname, 7), 'YYYY_MM') + interval '1 month' <= limite
+        order by 2
+    loop
+        execute format('alter table actions detach partition %I', p.nom);
+        execute format($f$
+            insert into compteurs as co (categorie, cle, valeur)
+            select categorie, cle, -n from (
+                select 'actions' as categorie, '' as cle, count(*) as n from %1$I
+                union all
+                select 'actions_resultat', coalesce(resultat::text, ''), count(*) from %1$I group by 2
+            ) d
+            where n <> 0
+            on conflict (categorie, cle) do update set valeur = co.valeur + excluded.valeur
+        $f$, p.nom);
+        delete from rollup_actions where jour >= p.mois and jour < p.mois + interval '1 month';
+        delete from series_actions where debut >= p.mois and debut < p.mois + interval '1 month';
+        execute requete_recommandations(
+            format('select id_scenario, resultat, -1 as signe from %I', p.nom));
+        if supprimer then
+            execute format('drop table %I', p.nom);
+        end if;
+        nom_partition := p.nom;
+        operation := case when supprimer then 'supprimee' else 'detachee' end;
+        return next;
+    end loop;
+    if found then
+        perform demander_version();
+    end if;
+end $$;
+
+select * from maintenir_partitions_actions();
+
@@ -0,0 +1,513 @@
+#!/usr/bin/env python
+"""
+Mode de service asyncio du dashboard : mêmes routes /api/* que app.py, servies
+par aiohttp sur un pool psycopg 3 asynchrone
+
+    python serveur_async.py --port 5001
+
+Une requête HTTP n'occupe pas de thread pendant qu'elle attend PostgreSQL :
+un seul processus tient des milliers de clients, la base ne voit jamais plus
+de COLONIE_ASYNC_POOL_MAX connexions et une requête qui n'obtient pas de
+connexion à temps reçoit un 503 au lieu d'attendre indéfiniment.
+/api/batch exécute ses requêtes en parallèle sur plusieurs connexions qui
+partagent le même instantané (pg_export_snapshot).
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import psycopg
+from aiohttp import web
+from flask import render_template
+from psycopg import sql
+from psycopg.rows import dict_row, tuple_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout, TooManyRequests
+from werkzeug.http import http_date, parse_date, parse_etags
+
+from app import (app, BATCH_MAX, COMPTEURS_METRIQUES, DASHBOARD_QUERIES, ETAT_VUES, EXPORT_CHUNK,
+                 EXPORTS, ParametreInvalide, _param_colonnes, _valeur_json, moteur_analytique,
+                 parametres_simulation)
+import codes
+import reponses
+import ingestion
+import simulation
+from ingestion import ActionsInvalides, EcritureIndisponible, TamponPlein
+from cache import CacheReponses, EntreeCache
+from evenements import Diffuseur, KEEPALIVE, RESYNC
+from db import DB_CONFIG
+from metrics import exposer, metriques_etat
+from requetes import VolUniqueAsync
+
+POOL_MIN = int(os.environ.get('COLONIE_ASYNC_POOL_MIN', 2))
+POOL_MAX = int(os.environ.get('COLONIE_ASYNC_POOL_MAX', 20))
+POOL_TIMEOUT = float(os.environ.get('COLONIE_POOL_TIMEOUT', 5))
+# requêtes en attente d'une connexion au-delà desquelles on répond 503 tout de suite
+MAX_ATTENTE = int(os.environ.get('COLONIE_ASYNC_MAX_WAITING', 2000))
+# connexions utilisées en parallèle par un même /api/batch
+PARALLELE_BATCH = int(os.environ.get('COLONIE_ASYNC_BATCH_PARALLEL', 4))
+
+# DB_CONFIG avec le nom de paramètre de psycopg 3
+CONNEXION = {'dbname' if cle == 'database' else cle: valeur for cle, valeur in DB_CONFIG.items()}
+
+pool = AsyncConnectionPool(
+    kwargs={**CONNEXION, 'client_encoding': 'UTF8', 'row_factory': dict_row,
+            # liaison côté client, comme psycopg2 : les filtres « %(x)s is null »
+            # du registre restent des constantes pour le planificateur
+            'cursor_factory': psycopg.AsyncClientCursor},
+    min_size=POOL_MIN, max_size=POOL_MAX, timeout=POOL_TIMEOUT, max_waiting=MAX_ATTENTE,
+    open=False, name='colonie-async')
+cache = CacheReponses(
+    max_entrees=int(os.environ.get('COLONIE_CACHE_MAX_ENTRIES', 512)),
+    max_octets=int(os.environ.get('COLONIE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+)
+vol_unique = VolUniqueAsync()
+
+# agrégats en mémoire : comme dans app.py, un instantané plus ancien que la
+# version connue du cache n'est pas servi (le cache de app.py n'écoute pas ici)
+if moteur_analytique is not None:
+    moteur_analytique.version_courante = lambda: cache.version if cache.actif else None
+
+diffuseur = Diffuseur(max_actions=int(os.environ.get('COLONIE_SSE_MAX_ACTIONS', 20)))
+SSE_INTERVALLE = float(os.environ.get('COLONIE_SSE_INTERVAL', 0.5))
+SSE_FILE = int(os.environ.get('COLONIE_SSE_QUEUE', 64))
+# un batch garde une connexion pendant qu'il en attend d'autres : on borne le
+# nombre de batchs simultanés pour qu'ils ne puissent pas épuiser le pool entre eux
+lots = asyncio.Semaphore(max(1, POOL_MAX // max(PARALLELE_BATCH, 1)))
+# get_stats() de psycopg_pool : totaux depuis l'ouverture, les autres valeurs sont des jauges
+COMPTEURS_POOL = ('requests_num', 'requests_queued', 'requests_wait_ms', 'requests_errors',
+                  'usage_ms', 'returns_bad', 'connections_num', 'connections_ms',
+                  'connections_errors', 'connections_lost')
+
+
+def corps_json(data):
+    """Même corps que jsonify() de app.py (clés triées, dates HTTP, Decimal en texte)"""
+    return (app.json.dumps(data, separators=(',', ':')) + '\n').encode()
+
+
+def corps_donnees(data, colonnes):
+    """corps_json(), ou le JSON compact de reponses.py au format colonnes"""
+    return reponses.corps_json(data) if colonnes else corps_json(data)
+
+
+def reponse_json(data, status=200, **headers):
+    return web.Response(body=corps_json(data), status=status, content_type='application/json',
+                        headers=headers)
+
+
+async def repondre_cache(request, nom, ttl, produire):
+    """Équivalent de @cached : cache LRU versionné, compression, ETag/Last-Modified et 304"""
+    actif, version, modifie_le = cache.actif, cache.version, cache.modifie_le
+    encodage = reponses.encodage_accepte(request.headers.get('Accept-Encoding'))
+    cle = request.path_qs if encodage is None else f'{request.path_qs} {encodage}'
+    entree = cache.lire(nom, cle) if actif else None
+    if entree is not None:
+        statut_cache = 'HIT'
+    else:
+        corps, encodage = reponses.compresser(await produire(), encodage)
+        entree = EntreeCache(corps, 'application/json',
+                             hashlib.blake2b(corps, digest_size=16).hexdigest(),
+                             modifie_le, time.monotonic() + ttl, version, encodage)
+        if actif:
+            cache.ecrire(cle, entree)
+        statut_cache = 'MISS' if actif else 'BYPASS'
+
+    headers = {'ETag': f'"{entree.etag}"', 'Cache-Control': 'no-cache', 'X-Cache': statut_cache,
+               'Vary': 'Accept-Encoding'}
+    if entree.encodage:
+        headers['Content-Encoding'] = entree.encodage
+    if entree.modifie_le:
+        headers['Last-Modified'] = http_date(entree.modifie_le)
+    if 'If-None-Match' in request.headers:
+        non_modifie = parse_etags(request.headers['If-None-Match']).contains(entree.etag)
+    else:
+        depuis = parse_date(request.headers.get('If-Modified-Since'))
+        non_modifie = bool(depuis and entree.modifie_le
+                           and entree.modifie_le.replace(microsecond=0) <= depuis)
+    if non_modifie:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=entree.corps, content_type='application/json', headers=headers)
+
+
+def curseur(conn, colonnes):
+    """Curseur de tuples au format colonnes, de dicts sinon"""
+    return conn.cursor(row_factory=tuple_row) if colonnes else conn.cursor()
+
+
+async def executer_route(conn, nom, args, colonnes=False):
+    route = DASHBOARD_QUERIES[nom]
+    params = route.parametres(args)
+    lignes = await route.requete.executer_async(curseur(conn, colonnes), params, colonnes)
+    return route.resultat(lignes, params)
+
+
+async def dashboard(request):
+    nom = request.match_info['nom']
+    if nom not in DASHBOARD_QUERIES:
+        raise web.HTTPNotFound()
+    route = DASHBOARD_QUERIES[nom]
+    colonnes = _param_colonnes(request.query)
+
+    async def produire():
+        params = route.parametres(request.query)
+
+        async def executer():
+            lignes = route.requete.en_memoire(params)
+            if lignes is not None:
+                return reponses.en_colonnes(lignes) if colonnes else lignes
+            async with pool.connection() as conn:
+                return await route.requete.executer_async(curseur(conn, colonnes), params, colonnes)
+        cle = (route.requete.nom, tuple(sorted(params.items())), colonnes)
+        return corps_donnees(route.resultat(await vol_unique.executer(cle, executer), params),
+                             colonnes)
+    return await repondre_cache(request, nom, route.ttl, produire)
+
+
+async def batch(request):
+    """
+    Comme /api/batch de app.py, mais les requêtes tournent en parallèle sur
+    au plus COLONIE_ASYNC_BATCH_PARALLEL connexions, toutes dans l'instantané
+    exporté par la première
+    """
+    noms = list(dict.fromkeys(n.strip() for n in request.query.get('q', '').split(',') if n.strip()))
+    inconnues = [n for n in noms if n not in DASHBOARD_QUERIES]
+    if not noms or inconnues or len(noms) > BATCH_MAX:
+        return reponse_json({
+            'error': f'q doit lister entre 1 et {BATCH_MAX} requêtes connues, séparées par des virgules',
+            'inconnues': inconnues,
+            'disponibles': sorted(DASHBOARD_QUERIES),
+        }, status=400)
+    colonnes = _param_colonnes(request.query)
+
+    async def produire():
+        a_faire = list(noms)
+        resultats = {}
+
+        async def travailler(conn):
+            while a_faire:
+                nom = a_faire.pop(0)
+                resultats[nom] = await executer_route(conn, nom, request.query, colonnes)
+
+        async def travailler_dans(instantane):
+            async with pool.connection() as conn:
+                await conn.execute("set transaction isolation level repeatable read read only")
+                await conn.execute("set transaction snapshot %s", (instantane,))
+                await travailler(conn)
+                await conn.rollback()
+
+        async with lots:
+            async with pool.connection() as conn:
+                await conn.execute("set transaction isolation level repeatable read read only")
+                cur = await conn.execute("select pg_export_snapshot() as instantane")
+                instantane = (await cur.fetchone())['instantane']
+                aides = min(PARALLELE_BATCH, len(noms)) - 1
+                await asyncio.gather(travailler(conn),
+                                     *(travailler_dans(instantane) for _ in range(aides)))
+                await conn.rollback()
+        return corps_donnees({nom: resultats[nom] for nom in noms}, colonnes)
+    return await repondre_cache(request, 'batch', 5, produire)
+
+
+async def export(request):
+    """Export en flux comme /api/export/<source> de app.py (curseur côté serveur)"""
+    source = request.match_info['source']
+    format = request.query.get('format', 'csv')
+    if source not in EXPORTS or format not in ('csv', 'ndjson'):
+        raise ParametreInvalide(f'source parmi {sorted(EXPORTS)}, format csv ou ndjson')
+
+    async with pool.connection() as conn:
+        await conn.execute("set transaction read only")
+        cur = conn.cursor(name=f'export_{source}', row_factory=tuple_row)
+        try:
+            await cur.execute(EXPORTS[source])
+            lignes = await cur.fetchmany(EXPORT_CHUNK)
+        except psycopg.errors.UndefinedTable:
+            return reponse_json({'error': f"{source} n'existe pas dans la base (voir queries.sql)"},
+                                status=404)
+        colonnes = [col.name for col in cur.description]
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/csv' if format == 'csv' else 'application/x-ndjson',
+            'Content-Disposition': f'attachment; filename={source}.{format}'})
+        await response.prepare(request)
+        tampon = io.StringIO()
+        ecrivain = csv.writer(tampon)
+        if format == 'csv':
+            ecrivain.writerow(colonnes)
+        while lignes:
+            if format == 'csv':
+                ecrivain.writerows(lignes)
+                texte = tampon.getvalue()
+                tampon.seek(0)
+                tampon.truncate()
+            else:
+                texte = ''.join(json.dumps(dict(zip(colonnes, ligne)), default=_valeur_json,
+                                           ensure_ascii=False) + '\n'
+                                for ligne in lignes)
+            await response.write(texte.encode())
+            lignes = await cur.fetchmany(EXPORT_CHUNK)
+        await cur.close()
+        await response.write_eof()
+        return response
+
+
+async def vues_materialisees(request):
+    """Fraîcheur des vues matérialisées, comme /api/materialized-views de app.py"""
+    async with pool.connection() as conn:
+        cur = await conn.execute(ETAT_VUES + " order by nom")
+        return reponse_json(await cur.fetchall())
+
+
+async def vue_materialisee(request):
+    """Lignes d'une vue matérialisée et sa fraîcheur, comme /api/materialized-views/<nom> de app.py"""
+    nom = request.match_info['nom']
+    async with pool.connection() as conn:
+        await conn.execute("set transaction isolation level repeatable read read only")
+        cur = await conn.execute(ETAT_VUES + " where nom = %s", (nom,))
+        fraicheur = await cur.fetchone()
+        if fraicheur is None:
+            return reponse_json({'error': f'vue matérialisée inconnue : {nom}'}, status=404)
+        cur = await conn.execute(sql.SQL("select * from {}").format(sql.Identifier(nom)))
+        lignes = await cur.fetchall()
+        await conn.rollback()
+    return reponse_json({'fraicheur': fraicheur, 'lignes': lignes},
+                        **{'Last-Modified': http_date(fraicheur['rafraichie_le'])})
+
+
+async def simulate(request):
+    """
+    Comme /api/simulate de app.py : les comptes sont lus sur le pool
+    asynchrone, la simulation (NumPy) tourne dans un thread
+    """
+    h = parametres_simulation(request.query)
+    simulateur = simulation.get_simulateur()
+
+    async def produire():
+        async with pool.connection() as conn:
+            cur = conn.cursor(row_factory=tuple_row)
+            await cur.execute("select version from version_donnees")
+            version, = await cur.fetchone()
+            resultat = simulateur.memorise(version, h)
+            comptes = simulateur.comptes(version) if resultat is None else None
+            if resultat is None and comptes is None:
+                await cur.execute(simulation.ROBOTS)
+                robots = await cur.fetchall()
+                await cur.execute(simulation.COMPTES)
+                comptes = simulation.assembler(version, robots, await cur.fetchall())
+            await conn.rollback()
+        if resultat is None:
+            # connexion rendue pendant le calcul
+            resultat = await asyncio.to_thread(simulateur.calculer, comptes, h)
+        return corps_json(resultat)
+    return await repondre_cache(request, 'simulate', 60, produire)
+
+
+async def pool_stats(request):
+    return reponse_json({**pool.get_stats(), 'single_flight': vol_unique.etat()})
+
+
+async def cache_stats(request):
+    return reponse_json(cache.etat())
+
+
+async def metrics(request):
+    """
+    /metrics comme app.py, avec l'état du pool psycopg 3 ; les durées par
+    phase et par endpoint ne sont mesurées que par app.py
+    """
+    etat_cache = cache.etat()
+    etat_cache.pop('version_donnees', None)
+    etats = [
+        ('colonie_pool', 'État du pool psycopg 3 (voir /api/pool-stats)', pool.get_stats(),
+         COMPTEURS_POOL),
+        ('colonie_cache', 'État du cache des réponses (voir /api/cache-stats)', etat_cache,
+         COMPTEURS_METRIQUES['colonie_cache']),
+        ('colonie_single_flight', 'Exécutions de requêtes et appels coalescés', vol_unique.etat(),
+         COMPTEURS_METRIQUES['colonie_single_flight']),
+        ('colonie_ingestion', "Tampon d'écriture de POST /api/actions", ingestion.get_tampon().etat(),
+         COMPTEURS_METRIQUES['colonie_ingestion']),
+        ('colonie_analytique', 'Instantané des agrégats en mémoire (COLONIE_ANALYTICS)',
+         moteur_analytique.etat() if moteur_analytique else {}, COMPTEURS_METRIQUES['colonie_analytique']),
+        ('colonie_simulation', 'Simulations calculées et servies par mémoïsation',
+         simulation.get_simulateur().etat(), COMPTEURS_METRIQUES['colonie_simulation']),
+    ]
+    texte = exposer(*(metriques_etat(*etat) for etat in etats))
+    return web.Response(body=texte.encode(), headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+
+async def index(request):
+    return web.Response(text=request.app['page'], content_type='text/html')
+
+
+@web.middleware
+async def erreurs(request, handler):
+    try:
+        return await handler(request)
+    except ParametreInvalide as error:
+        return reponse_json({'error': str(error)}, status=400)
+    except ActionsInvalides as error:
+        return reponse_json({'error': str(error), 'details': error.erreurs[:100]}, status=400)
+    except TamponPlein as error:
+        return reponse_json({'error': "trop d'actions en attente d'écriture, réessayez",
+                             'detail': str(error)}, status=429, **{'Retry-After': '1'})
+    except EcritureIndisponible as error:
+        return reponse_json({'error': str(error)}, status=503, **{'Retry-After': '1'})
+    except (PoolTimeout, TooManyRequests) as error:
+        return reponse_json({'error': 'base de données saturée, réessayez', 'detail': str(error)},
+                            status=503, **{'Retry-After': '1'})
+
+
+async def ingerer_actions(request):
+    """
+    POST /api/actions, comme app.py : même validation et même tampon d'écriture
+    (un thread psycopg2 qui écrit par COPY). Sans attente de place libre : un
+    tampon plein donne 429 tout de suite.
+    """
+    try:
+        donnees = await request.json()
+    except ValueError:
+        raise ParametreInvalide('corps JSON attendu')
+    durabilite = request.query.get('durabilite', ingestion.DURABILITE)
+    if durabilite not in ingestion.DURABILITES:
+        raise ParametreInvalide(f"durabilite : {' ou '.join(ingestion.DURABILITES)}")
+    # la validation peut recharger les identifiants connus depuis la base
+    nb, futur = await asyncio.to_thread(ingestion.soumettre, donnees, durabilite)
+    if futur is None:
+        return reponse_json({'acceptees': nb, 'durabilite': durabilite}, status=202)
+    try:
+        ids = await asyncio.wait_for(asyncio.wrap_future(futur), ingestion.DELAI_COMMIT)
+    except asyncio.TimeoutError:
+        raise EcritureIndisponible(f'écriture non confirmée en {ingestion.DELAI_COMMIT}s '
+                                   '(les actions restent en tampon)')
+    return reponse_json({'ecrites': sum(i is not None for i in ids), 'ids': ids,
+                         'durabilite': durabilite}, status=201)
+
+
+async def ingest_stats(request):
+    return reponse_json(ingestion.get_tampon().etat())
+
+
+async def ecouter_modifications():
+    """
+    LISTEN colonie_modifications (même invalidation du cache que app.py) et
+    colonie_actions (diffusion SSE)
+    """
+    avec_cache = os.environ.get('COLONIE_CACHE', '1') != '0'
+    while True:
+        try:
+            conn = await psycopg.AsyncConnection.connect(**CONNEXION, autocommit=True)
+            async with conn:
+                await conn.execute('listen colonie_modifications')
+                await conn.execute('listen colonie_actions')
+                if avec_cache:
+                    cur = await conn.execute(
+                        "select version, extract(epoch from modifie_le) from version_donnees")
+                    version, epoch = await cur.fetchone()
+                    cache.activer(version, datetime.fromtimestamp(float(epoch), timezone.utc))
+                diffuseur.connecte()
+                async for notif in conn.notifies():
+                    if notif.channel == 'colonie_actions':
+                        diffuseur.publier(notif.payload)
+                    elif avec_cache:
+                        version, epoch = notif.payload.split()
+                        cache.nouvelle_version(int(version),
+                                               datetime.fromtimestamp(float(epoch), timezone.utc))
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            app.logger.warning('écouteur LISTEN déconnecté : %s', error)
+        finally:
+            cache.desactiver()
+        await asyncio.sleep(2)
+
+
+async def horloge_diffusion():
+    while True:
+        await asyncio.sleep(SSE_INTERVALLE)
+        diffuseur.diffuser()
+
+
+async def evenements(request):
+    """Flux SSE des nouvelles actions, comme /api/events de app.py"""
+    abonne = diffuseur.abonner(asyncio.Queue(SSE_FILE))
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream',
+                                           'Cache-Control': 'no-cache',
+                                           'X-Accel-Buffering': 'no'})
+    try:
+        await response.prepare(request)
+        await response.write(b'retry: 3000\n\n')
+        if request.headers.get('Last-Event-ID'):
+            await response.write(RESYNC.encode())
+        while True:
+            try:
+                message = await asyncio.wait_for(abonne.file.get(), timeout=15)
+            except asyncio.TimeoutError:
+                message = KEEPALIVE
+            await response.write(message.encode())
+    except ConnectionResetError:
+        pass
+    finally:
+        diffuseur.desabonner(abonne)
+    return response
+
+
+async def events_stats(request):
+    return reponse_json(diffuseur.etat())
+
+
+async def demarrer(application):
+    await pool.open()
+    application['ecouteur'] = asyncio.create_task(ecouter_modifications())
+    application['horloge'] = asyncio.create_task(horloge_diffusion())
+
+
+async def arreter(application):
+    application['ecouteur'].cancel()
+    application['horloge'].cancel()
+    await pool.close()
+    await asyncio.to_thread(ingestion.arreter)
+
+
+def creer_application():
+    application = web.Application(middlewares=[erreurs])
+    with app.test_request_context('/'):
+        application['page'] = render_template('dashboard.html', libelles=codes.libelles())
+    application.router.add_get('/', index)
+    application.router.add_static('/static/', os.path.join(os.path.dirname(__file__), 'static'))
+    application.router.add_get('/api/pool-stats', pool_stats)
+    application.router.add_get('/api/cache-stats', cache_stats)
+    application.router.add_get('/api/batch', batch)
+    application.router.add_get('/api/events', evenements)
+    application.router.add_get('/api/events-stats', events_stats)
+    application.router.add_post('/api/actions', ingerer_actions)
+    application.router.add_get('/api/ingest-stats', ingest_stats)
+    application.router.add_get('/api/export/{source}', export)
+    application.router.add_get('/api/materialized-views', vues_materialisees)
+    application.router.add_get('/api/materialized-views/{nom}', vue_materialisee)
+    application.router.add_get('/api/simulate', simulate)
+    application.router.add_get('/metrics', metrics)
+    application.router.add_get('/api/{nom}', dashboard)
+    application.on_startup.append(demarrer)
+    application.on_cleanup.append(arreter)
+    return application
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+    if sys.platform == 'win32':
+        # psycopg 3 asynchrone ne fonctionne pas avec la boucle Proactor de Windows
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    web.run_app(creer_application(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""
+Simulation d'un autre ordre de priorité des lois sur l'historique des actions
+(généralise vue_simulation_ponderations de queries.sql)
+
+Une hypothèse donne le nouvel ordre des lois (ou des poids, rangés par ordre
+décroissant), et peut reclasser des scénarios sous une autre loi. Pour
+chaque action, son scénario gagne ou perd d rangs de priorité :
+- s'il en gagne, une part min(1, gain × d) des échecs et des mitigés devient
+  des succès ;
+- s'il en perd, une part min(1, perte × d) des succès devient des mitigés, et
+  la même part des mitigés devient des échecs.
+
+Avec l'ordre 3, 2, 1, un gain de 0,5 et aucune perte, toutes les actions de
+la loi 3 réussissent et les autres sont inchangées : c'est
+taux_reussite_simule_loi3_priorise.
+
+Les résultats sont des espérances, calculées par robot à partir de
+rollup_actions. Les classifications (performant, défaillant) reprennent
+les critères de vue_robots_performants et vue_robots_defaillants.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
+
+import numpy as np
+
+import codes
+
+LOIS = (1, 2, 3)
+SUCCES, MITIGUE, ECHEC = (codes.RESULTATS.index(r) for r in ('succes', 'mitigue', 'echec'))
+EPSILON = 1e-9
+
+
+class Hypothese(NamedTuple):
+    ordre: tuple = LOIS               # lois de la plus prioritaire à la moins prioritaire
+    reclassements: tuple = ()         # ((id_scenario, loi), ...), trié
+    gain: float = 0.5
+    perte: float = 0.0
+
+
+def hypothese(ordre=None, poids=None, reclasser=None, gain=0.5, perte=0.0):
+    """
+    Hypothèse normalisée (deux paramétrages équivalents donnent la même) ;
+    `poids` : {loi: poids}, les égalités gardent l'ordre d'origine
+    """
+    if ordre is not None and poids is not None:
+        raise ValueError('ordre ou poids, pas les deux')
+    if poids is not None:
+        if set(poids) != set(LOIS):
+            raise ValueError('poids : une valeur pour chacune des lois 1, 2 et 3')
+        ordre = sorted(LOIS, key=lambda loi: -poids[loi])
+    ordre = tuple(ordre or LOIS)
+    if sorted(ordre) != list(LOIS):
+        raise ValueError("ordre : les lois 1, 2 et 3, chacune une fois")
+    reclasser = dict(reclasser or {})
+    if any(loi not in LOIS for loi in reclasser.values()):
+        raise ValueError('reclasser : loi 1, 2 ou 3')
+    if not (0 <= gain <= 1 and 0 <= perte <= 1):
+        raise ValueError('gain et perte entre 0 et 1')
+    return Hypothese(ordre, tuple(sorted(reclasser.items())), float(gain), float(perte))
+
+
+def transitions(h):
+    """
+    M[loi d'origine, loi simulée, résultat d'origine, résultat simulé] ;
+    l'indice 0 (action sans scénario) est laissé tel quel
+    """
+    rang = {loi: i + 1 for i, loi in enumerate(h.ordre)}
+    m = np.zeros((4, 4, 3, 3))
+    m[:, :] = np.eye(3)
+    for origine in LOIS:
+        for simulee in LOIS:
+            d = origine - rang[simulee]
+            t = np.eye(3)
+            if d > 0:
+                f = min(1.0, h.gain * d)
+                t[MITIGUE] = t[ECHEC] = 0
+                t[MITIGUE, SUCCES] = t[ECHEC, SUCCES] = f
+                t[MITIGUE, MITIGUE] = t[ECHEC, ECHEC] = 1 - f
+            elif d < 0:
+                g = min(1.0, h.perte * -d)
+                t[SUCCES, SUCCES] = t[MITIGUE, MITIGUE] = 1 - g
+                t[SUCCES, MITIGUE] = t[MITIGUE, ECHEC] = g
+            m[origine, simulee] = t
+    return m
+
+
+class Comptes(NamedTuple):
+    """Actions par (robot, scénario, loi, résultat), lues dans rollup_actions"""
+    version: int
+    robots: list                 # [(id_robot, nom_robot, modele)], dans l'ordre des indices
+    robot: np.ndarray            # indice du robot
+    scenario: np.ndarray         # id_scenario, -1 sans scénario
+    loi: np.ndarray              # priorite_loi actuelle du scénario, 0 sans scénario
+    resultat: np.ndarray         # indice dans codes.RESULTATS
+    nb: np.ndarray
+
+
+ROBOTS = "select id_robot, nom_robot, modele from robots order by id_robot"
+COMPTES = """
+    select ra.id_robot, coalesce(ra.id_scenario, -1), coalesce(s.priorite_loi, 0),
+           array_position(enum_range(null::resultat_action), ra.resultat) - 1, sum(ra.nb)
+    from rollup_actions ra
+    left join scenarios s on s.id_scenario = ra.id_scenario
+    where ra.id_robot is not null
+    group by 1, 2, 3, 4
+"""
+
+
+def charger(cur):
+    """Comptes de la base, sur un curseur de tuples"""
+    cur.execute("select version from version_donnees")
+    version, = cur.fetchone()
+    cur.execute(ROBOTS)
+    robots = cur.fetchall()
+    cur.execute(COMPTES)
+    return assembler(version, robots, cur.fetchall())
+
+
+def assembler(version, robots, lignes):
+    """Comptes à partir des lignes de ROBOTS et de COMPTES (tuples)"""
+    colonnes = np.array(lignes, dtype=np.int64).reshape(-1, 5)
+    ids = np.array([id_robot for id_robot, _, _ in robots], dtype=np.int64)
+    indice = np.full(int(max(ids.max(initial=0), colonnes[:, 0].max(initial=0))) + 1, -1)
+    indice[ids] = np.arange(len(ids))
+    robot = indice[colonnes[:, 0]]
+    colonnes = colonnes[robot >= 0]         # robot supprimé depuis
+    return Comptes(version, robots, robot[robot >= 0], colonnes[:, 1], colonnes[:, 2], colonnes[:, 3],
+                   colonnes[:, 4].astype(float))
+
+
+def _simuler_morceau(nb_robots, robot, loi, loi_simulee, resultat, nb, m):
+    """Résultats d'origine et simulés par (robot, loi simulée, résultat), pour un morceau des comptes"""
+    cases = ((robot * 4 + loi) * 4 + loi_simulee) * 3 + resultat
+    k = np.bincount(cases, weights=nb, minlength=nb_robots * 48).reshape(nb_robots, 4, 4, 3)
+    return k.sum(axis=2), np.einsum('rabi,abij->rbj', k, m)
+
+
+def _taux(n, total):
+    return round(100.0 * float(n) / float(total), 2) if total else None
+
+
+def _classification(nb_scenarios, taux, echecs, violations_loi1):
+    """Critères de vue_robots_defaillants puis de vue_robots_performants"""
+    if taux is None:
+        return None
+    if taux < 50 or violations_loi1 > EPSILON:
+        return 'Défaillant'
+    if (nb_scenarios >= 5 and taux >= 70) or (echecs <= EPSILON and taux >= 80):
+        return 'Performant'
+    return None
+
+
+_executeur = None
+_executeur_verrou = threading.Lock()
+
+
+def _pool(processus=None):
+    """
+    Pool de processus partagé, créé au premier calcul réparti. Ses processus
+    partent d'un forkserver (spawn s'il n'existe pas) : un fork du processus
+    de l'API hériterait des verrous tenus par ses threads.
+    """
+    global _executeur
+    with _executeur_verrou:
+        if _executeur is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                contexte = multiprocessing.get_context('forkserver')
+                contexte.set_forkserver_preload(['simulation'])
+            else:
+                contexte = multiprocessing.get_context('spawn')
+            _executeur = ProcessPoolExecutor(max_workers=processus, mp_context=contexte)
+            atexit.register(_executeur.shutdown)
+        return _executeur
+
+
+def _abandonner_pool(pool):
+    """Un pool cassé (processus tué) est remplacé au calcul suivant"""
+    global _executeur
+    with _executeur_verrou:
+        if _executeur is pool:
+            _executeur = None
+    pool.shutdown(wait=False)
+
+
+def simuler(comptes, h, morceau=1_000_000, processus=None):
+    """
+    Résultat de l'hypothèse `h` : par robot, par modèle et global. Au-delà
+    de `morceau` lignes de comptes, le calcul est réparti sur le pool
+    partagé de `processus` processus (fixé au premier calcul réparti).
+    """
+    reclasse = dict(h.reclassements)
+    loi_simulee = comptes.loi.copy()
+    for id_scenario, loi in reclasse.items():
+        loi_simulee[comptes.scenario == id_scenario] = loi
+    m = transitions(h)
+    nb_robots = len(comptes.robots)
+    colonnes = (comptes.robot, comptes.loi, loi_simulee, comptes.resultat, comptes.nb)
+    if len(comptes.nb) <= morceau:
+        origine, simule = _simuler_morceau(nb_robots, *colonnes, m)
+    else:
+        bornes = range(0, len(comptes.nb), morceau)
+        pool = _pool(processus)
+        try:
+            parts = list(pool.map(_simuler_morceau, [nb_robots] * len(bornes),
+                                  *([c[i:i + morceau] for i in bornes] for c in colonnes),
+                                  [m] * len(bornes)))
+        except BrokenProcessPool:
+            _abandonner_pool(pool)
+            raise
+        origine = sum(p[0] for p in parts)
+        simule = sum(p[1] for p in parts)
+
+    # violations de la loi 1 : échecs sur un scénario de loi 1 (d'origine ou simulée)
+    violation = (comptes.loi == 1) & (comptes.resultat == ECHEC)
+    violations_origine = np.bincount(comptes.robot, weights=comptes.nb * violation, minlength=nb_robots)
+    avec_scenario = comptes.scenario >= 0
+    largeur = int(comptes.scenario.max(initial=0)) + 1
+    couples = np.unique(comptes.robot[avec_scenario] * largeur + comptes.scenario[avec_scenario])
+    nb_scenarios = np.bincount(couples // largeur, minlength=nb_robots)
+
+    origine_par_resultat = origine.sum(axis=1)
+    simule_par_resultat = simule.sum(axis=1)
+    robots = []
+    for i, (id_robot, nom_robot, modele) in enumerate(comptes.robots):
+        total = origine_par_resultat[i].sum()
+        avant = _taux(origine_par_resultat[i, SUCCES], total)
+        apres = _taux(simule_par_resultat[i, SUCCES], total)
+        robots.append({
+            'id_robot': id_robot, 'nom_robot': nom_robot, 'modele': modele,
+            'nb_actions': int(round(total)),
+            'taux_reussite_original': avant,
+            'taux_reussite_simule': apres,
+            'variation': None if avant is None else round(apres - avant, 2),
+            'classification_originale': _classification(
+                nb_scenarios[i], avant, origine_par_resultat[i, ECHEC], violations_origine[i]),
+            'classification_simulee': _classification(
+                nb_scenarios[i], apres, simule_par_resultat[i, ECHEC], simule[i, 1, ECHEC]),
+        })
+
+    modeles = {}
+    for i, robot in enumerate(robots):
+        modele = modeles.setdefault(robot['modele'], {
+            'modele': robot['modele'], 'nb_robots': 0, 'nb_actions': 0, 'succes_original': 0.0,
+            'succes_simule': 0.0, 'performants_original': 0, 'performants_simule': 0,
+            'defaillants_original': 0, 'defaillants_simule': 0})
+        modele['nb_robots'] += 1
+        modele['nb_actions'] += robot['nb_actions']
+        modele['succes_original'] += origine_par_resultat[i, SUCCES]
+        modele['succes_simule'] += simule_par_resultat[i, SUCCES]
+        for cle, classification in (('original', robot['classification_originale']),
+                                    ('simule', robot['classification_simulee'])):
+            modele[f'performants_{cle}'] += classification == 'Performant'
+            modele[f'defaillants_{cle}'] += classification == 'Défaillant'
+    for modele in modeles.values():
+        succes_original, succes_simule = modele.pop('succes_original'), modele.pop('succes_simule')
+        modele['taux_reussite_original'] = _taux(succes_original, modele['nb_actions'])
+        modele['taux_reussite_simule'] = _taux(succes_simule, modele['nb_actions'])
+        if modele['taux_reussite_original'] is not None:
+            modele['variation'] = round(modele['taux_reussite_simule'] - modele['taux_reussite_original'], 2)
+
+    changements = {}
+    for robot in robots:
+        avant = robot['classification_originale'] or 'Non classé'
+        apres = robot['classification_simulee'] or 'Non classé'
+        if avant != apres:
+            changements[f'{avant} → {apres}'] = changements.get(f'{avant} → {apres}', 0) + 1
+
+    def moyenne(cle):
+        # moyenne des taux par robot, comme l'« impact global » de queries.sql
+        taux = [r[cle] for r in robots if r[cle] is not None]
+        return round(float(np.mean(taux)), 2) if taux else None
+    return {
+        'hypothese': {'ordre': list(h.ordre), 'reclasser': dict(h.reclassements), 'gain': h.gain,
+                      'perte': h.perte},
+        'version_donnees': comptes.version,
+        'global': {
+            'nb_actions': sum(r['nb_actions'] for r in robots),
+            'taux_moyen_original': moyenne('taux_reussite_original'),
+            'taux_moyen_simule': moyenne('taux_reussite_simule'),
+            'changements_classification': changements,
+        },
+        'modeles': sorted(modeles.values(), key=lambda m: m['modele']),
+        'robots': robots,
+    }
+
+
+class Simulateur:
+    """
+    Mémoïse les comptes (un jeu par version des données) et les résultats
+    (par version et hypothèse normalisée, LRU de `taille_memo` entrées)
+    """
+
+    def __init__(self, taille_memo=64, morceau=1_000_000, processus=None):
+        self.taille_memo = taille_memo
+        self.morceau = morceau
+        self.processus = processus
+        self._comptes = None
+        self._memo = OrderedDict()
+        self._verrou = threading.Lock()
+        self.stats = {'calculs': 0, 'memo': 0, 'chargements': 0}
+
+    def simuler(self, cur, h):
+        cur.execute("select version from version_donnees")
+        version, = cur.fetchone()
+        resultat = self.memorise(version, h)
+        if resultat is None:
+            resultat = self.calculer(self.comptes(version) or charger(cur), h)
+        return resultat
+
+    def memorise(self, version, h):
+        """Résultat déjà calculé pour cette version des données, ou None"""
+        with self._verrou:
+            resultat = self._memo.get((version, h))
+            if resultat is not None:
+                self._memo.move_to_end((version, h))
+                self.stats['memo'] += 1
+            return resultat
+
+    def comptes(self, version):
+        """Comptes chargés pour cette version des données, ou None"""
+        with self._verrou:
+            comptes = self._comptes
+        return comptes if comptes is not None and comptes.version == version else None
+
+    def calculer(self, comptes, h):
+        """Simule `h` sur `comptes` (gardés pour les hypothèses suivantes) et mémoïse le résultat"""
+        with self._verrou:
+            if self._comptes is not comptes:
+                self._comptes = comptes
+                self.stats['chargements'] += 1
+        resultat = simuler(comptes, h, self.morceau, self.processus)
+        with self._verrou:
+            self.stats['calculs'] += 1
+            self._memo[(comptes.version, h)] = resultat
+            while len(self._memo) > self.taille_memo:
+                self._memo.popitem(last=False)
+        return resultat
+
+    def etat(self):
+        with self._verrou:
+            return {'entrees': len(self._memo),
+                    'version_comptes': self._comptes.version if self._comptes else None,
+                    **self.stats}
+
+
+_simulateur = None
+
+
+def get_simulateur():
+    global _simulateur
+    if _simulateur is None:
+        _simulateur = Simulateur(
+            taille_memo=int(os.environ.get('COLONIE_SIMULATION_MEMO', 64)),
+            morceau=int(os.environ.get('COLONIE_SIMULATION_CHUNK', 1_000_000)),
+            processus=int(os.environ['COLONIE_SIMULATION_PROCESSES'])
+            if os.environ.get('COLONIE_SIMULATION_PROCESSES') else None)
+    return _simulateur
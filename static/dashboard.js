@@ -20,6 +20,11 @@ const resultColors = {
     'echec': '#ff4444'
 };
 
+// libellé affiché d'un code (resultat_action, etat_robot, niveau_vulnerabilite)
+function libelle(type, code) {
+    return (LIBELLES[type] || {})[code] || code;
+}
+
 // Tab switching
 document.querySelectorAll('.tab-btn').forEach(btn => {
     btn.addEventListener('click', () => {
@@ -37,6 +42,7 @@ document.querySelectorAll('.tab-btn').forEach(btn => {
 
 // Load overview tab by default
 loadTabData('overview');
+startLiveEvents();
 
 async function loadTabData(tab) {
     switch(tab) {
@@ -61,37 +67,72 @@ async function loadTabData(tab) {
     }
 }
 
+// Réponses au format colonnes (?format=columns) : noms une fois, valeurs par colonne
+function colonnes(donnees) {
+    const resultat = {};
+    donnees.colonnes.forEach((nom, i) => { resultat[nom] = donnees.valeurs[i]; });
+    return resultat;
+}
+
+function nbLignes(donnees) {
+    return donnees && donnees.valeurs.length ? donnees.valeurs[0].length : 0;
+}
+
+// une ligne par objet, pour les tableaux
+function lignes(donnees) {
+    const resultat = [];
+    for (let i = 0; i < nbLignes(donnees); i++) {
+        const ligne = {};
+        donnees.colonnes.forEach((nom, j) => { ligne[nom] = donnees.valeurs[j][i]; });
+        resultat.push(ligne);
+    }
+    return resultat;
+}
+
+// Charge plusieurs requêtes du dashboard en un seul appel (une connexion, un instantané)
+async function fetchBatch(names) {
+    const response = await fetch('/api/batch?format=columns&q=' + names.join(','));
+    if (!response.ok) throw new Error('batch ' + response.status);
+    return response.json();
+}
+
 // ============================================================================
 // TAB: OVERVIEW
 // ============================================================================
 
 async function loadOverviewTab() {
     try {
-        const [stats, results, robots, vulns] = await Promise.all([
-            fetch('/api/global-stats').then(r => r.json()),
-            fetch('/api/actions-results').then(r => r.json()),
-            fetch('/api/robots-status').then(r => r.json()),
-            fetch('/api/humains-vulnerability').then(r => r.json())
+        const data = await fetchBatch([
+            'global-stats', 'actions-results', 'robots-status',
+            'humains-vulnerability', 'performance-by-model'
         ]);
-
-        // Update stat cards
-        document.querySelectorAll('.stat-value')[0].textContent = stats.total_actions || 0;
-        document.querySelectorAll('.stat-value')[1].textContent = (stats.success_rate || 0) + '%';
-        document.querySelectorAll('.stat-value')[2].textContent = stats.active_robots || 0;
-        document.querySelectorAll('.stat-value')[3].textContent = stats.total_scenarios || 0;
+        const stats = data['global-stats'] || {};
+        const results = colonnes(data['actions-results']);
+        const robots = colonnes(data['robots-status']);
+        const vulns = colonnes(data['humains-vulnerability']);
+
+        // Update stat cards (puis mis à jour en direct par les événements)
+        liveStats = {
+            total_actions: Number(stats.total_actions) || 0,
+            total_succes: Number(stats.total_succes) || 0,
+            success_rate: stats.success_rate,
+            active_robots: stats.active_robots,
+            total_scenarios: stats.total_scenarios
+        };
+        renderStatCards(liveStats);
 
         // Results chart
-        if (results && results.length > 0) {
+        if (nbLignes(data['actions-results']) > 0) {
             const ctx = document.getElementById('resultsChart').getContext('2d');
             if (charts.resultsChart) charts.resultsChart.destroy();
             
             charts.resultsChart = new Chart(ctx, {
                 type: 'doughnut',
                 data: {
-                    labels: results.map(r => r.resultat),
+                    labels: results.resultat.map(r => libelle('resultat_action', r)),
                     datasets: [{
-                        data: results.map(r => r.count),
-                        backgroundColor: results.map(r => resultColors[r.resultat] || '#999')
+                        data: results.count,
+                        backgroundColor: results.resultat.map(r => resultColors[r] || '#999')
                     }]
                 },
                 options: {
@@ -105,16 +146,16 @@ async function loadOverviewTab() {
         }
 
         // Vulnerability chart
-        if (vulns && vulns.length > 0) {
+        if (nbLignes(data['humains-vulnerability']) > 0) {
             const ctx = document.getElementById('vulnerabilityChart').getContext('2d');
             if (charts.vulnerabilityChart) charts.vulnerabilityChart.destroy();
             
             charts.vulnerabilityChart = new Chart(ctx, {
                 type: 'pie',
                 data: {
-                    labels: vulns.map(v => v.vulnerabilite),
+                    labels: vulns.vulnerabilite.map(v => libelle('niveau_vulnerabilite', v)),
                     datasets: [{
-                        data: vulns.map(v => v.count),
+                        data: vulns.count,
                         backgroundColor: ['#6bcf7f', '#ffd93d', '#ff6b6b']
                     }]
                 },
@@ -129,17 +170,17 @@ async function loadOverviewTab() {
         }
 
         // Robot status chart
-        if (robots && robots.length > 0) {
+        if (nbLignes(data['robots-status']) > 0) {
             const ctx = document.getElementById('robotStatusChart').getContext('2d');
             if (charts.robotStatusChart) charts.robotStatusChart.destroy();
             
             charts.robotStatusChart = new Chart(ctx, {
                 type: 'bar',
                 data: {
-                    labels: robots.map(r => r.modele + ' (' + r.etat + ')'),
+                    labels: robots.modele.map((m, i) => m + ' (' + libelle('etat_robot', robots.etat[i]) + ')'),
                     datasets: [{
                         label: 'Nombre de robots',
-                        data: robots.map(r => r.count),
+                        data: robots.count,
                         backgroundColor: '#00d4ff',
                         borderColor: '#0099cc',
                         borderWidth: 1
@@ -157,20 +198,20 @@ async function loadOverviewTab() {
         }
 
         // Model performance chart
-        const perf = await fetch('/api/performance-by-model').then(r => r.json());
-        if (perf && perf.length > 0) {
+        const perf = colonnes(data['performance-by-model']);
+        if (nbLignes(data['performance-by-model']) > 0) {
             const ctx = document.getElementById('modelPerformanceChart').getContext('2d');
             if (charts.modelPerformanceChart) charts.modelPerformanceChart.destroy();
             
             charts.modelPerformanceChart = new Chart(ctx, {
                 type: 'bar',
                 data: {
-                    labels: perf.map(p => p.modele),
+                    labels: perf.modele,
                     datasets: [{
                         label: 'Taux de Réussite (%)',
-                        data: perf.map(p => p.success_rate || 0),
-                        backgroundColor: perf.map(p => {
-                            const rate = p.success_rate || 0;
+                        data: perf.success_rate.map(rate => rate || 0),
+                        backgroundColor: perf.success_rate.map(rate => {
+                            rate = rate || 0;
                             if (rate >= 75) return '#00ff64';
                             if (rate >= 50) return '#ffd93d';
                             return '#ff4444';
@@ -198,22 +239,21 @@ async function loadOverviewTab() {
 
 async function loadEthicsTab() {
     try {
-        const [complexity, success] = await Promise.all([
-            fetch('/api/ethical-complexity').then(r => r.json()),
-            fetch('/api/dilemma-success-by-law').then(r => r.json())
-        ]);
+        const data = await fetchBatch(['ethical-complexity', 'dilemma-success-by-law', 'ethical-dilemmas']);
+        const complexity = colonnes(data['ethical-complexity']);
+        const success = colonnes(data['dilemma-success-by-law']);
 
         // Ethical laws chart
-        if (complexity && complexity.length > 0) {
+        if (nbLignes(data['ethical-complexity']) > 0) {
             const ctx = document.getElementById('ethicalLawsChart').getContext('2d');
             if (charts.ethicalLawsChart) charts.ethicalLawsChart.destroy();
             
             charts.ethicalLawsChart = new Chart(ctx, {
                 type: 'pie',
                 data: {
-                    labels: complexity.map(c => c.loi_nom),
+                    labels: complexity.loi_nom,
                     datasets: [{
-                        data: complexity.map(c => c.scenario_count),
+                        data: complexity.scenario_count,
                         backgroundColor: lawColors
                     }]
                 },
@@ -228,17 +268,17 @@ async function loadEthicsTab() {
         }
 
         // Law success chart
-        if (success && success.length > 0) {
+        if (nbLignes(data['dilemma-success-by-law']) > 0) {
             const ctx = document.getElementById('lawSuccessChart').getContext('2d');
             if (charts.lawSuccessChart) charts.lawSuccessChart.destroy();
             
             charts.lawSuccessChart = new Chart(ctx, {
                 type: 'bar',
                 data: {
-                    labels: success.map(s => s.loi_nom),
+                    labels: success.loi_nom,
                     datasets: [{
                         label: 'Taux de Réussite (%)',
-                        data: success.map(s => s.pourcent_succes),
+                        data: success.pourcent_succes,
                         backgroundColor: lawColors,
                         borderColor: lawColors,
                         borderWidth: 2
@@ -255,7 +295,7 @@ async function loadEthicsTab() {
         }
 
         // Ethical scenarios table
-        const scenarios = await fetch('/api/ethical-dilemmas').then(r => r.json());
+        const scenarios = lignes(data['ethical-dilemmas']);
         if (scenarios && scenarios.length > 0) {
             const tbody = document.getElementById('ethicalTableBody');
             tbody.innerHTML = scenarios.slice(0, 10).map((s, i) => `
@@ -280,30 +320,31 @@ async function loadEthicsTab() {
 
 async function loadRobotsTab() {
     try {
-        const perf = await fetch('/api/performance-by-model').then(r => r.json());
+        const data = await fetchBatch(['performance-by-model', 'robot-specialization']);
+        const perf = colonnes(data['performance-by-model']);
         
-        if (perf && perf.length > 0) {
+        if (nbLignes(data['performance-by-model']) > 0) {
             const ctx = document.getElementById('robotComparisonChart').getContext('2d');
             if (charts.robotComparisonChart) charts.robotComparisonChart.destroy();
             
             charts.robotComparisonChart = new Chart(ctx, {
                 type: 'bar',
                 data: {
-                    labels: perf.map(p => p.modele),
+                    labels: perf.modele,
                     datasets: [
                         {
                             label: 'Succès',
-                            data: perf.map(p => p.succes),
+                            data: perf.succes,
                             backgroundColor: '#00ff64'
                         },
                         {
                             label: 'Mitigé',
-                            data: perf.map(p => p.mitiges),
+                            data: perf.mitiges,
                             backgroundColor: '#ffa500'
                         },
                         {
                             label: 'Échec',
-                            data: perf.map(p => p.echecs),
+                            data: perf.echecs,
                             backgroundColor: '#ff4444'
                         }
                     ]
@@ -320,7 +361,7 @@ async function loadRobotsTab() {
         }
 
         // Robot rankings table
-        const robots = await fetch('/api/robot-specialization').then(r => r.json());
+        const robots = lignes(data['robot-specialization']);
         if (robots && robots.length > 0) {
             const tbody = document.getElementById('robotRankingsBody');
             tbody.innerHTML = robots.map((r, i) => `
@@ -328,7 +369,7 @@ async function loadRobotsTab() {
                     <td>${i + 1}</td>
                     <td>${r.nom_robot}</td>
                     <td>${r.modele}</td>
-                    <td>${r.etat}</td>
+                    <td>${libelle('etat_robot', r.etat)}</td>
                     <td>${r.actions_totales || 0}</td>
                     <td>${r.scenarios_traites || 0}</td>
                     <td>${r.succes || 0}</td>
@@ -348,30 +389,31 @@ async function loadRobotsTab() {
 
 async function loadVulnerabilityTab() {
     try {
-        const impact = await fetch('/api/vulnerability-impact').then(r => r.json());
+        const data = await fetchBatch(['vulnerability-impact', 'sector-ethical-analysis']);
+        const impact = colonnes(data['vulnerability-impact']);
         
-        if (impact && impact.length > 0) {
+        if (nbLignes(data['vulnerability-impact']) > 0) {
             const ctx = document.getElementById('vulnerabilityOutcomesChart').getContext('2d');
             if (charts.vulnerabilityOutcomesChart) charts.vulnerabilityOutcomesChart.destroy();
             
             charts.vulnerabilityOutcomesChart = new Chart(ctx, {
                 type: 'bar',
                 data: {
-                    labels: impact.map(i => i.vulnerabilite),
+                    labels: impact.vulnerabilite.map(v => libelle('niveau_vulnerabilite', v)),
                     datasets: [
                         {
                             label: 'Succès',
-                            data: impact.map(i => i.succes),
+                            data: impact.succes,
                             backgroundColor: '#00ff64'
                         },
                         {
                             label: 'Mitigé',
-                            data: impact.map(i => i.mitiges),
+                            data: impact.mitiges,
                             backgroundColor: '#ffa500'
                         },
                         {
                             label: 'Échec',
-                            data: impact.map(i => i.echecs),
+                            data: impact.echecs,
                             backgroundColor: '#ff4444'
                         }
                     ]
@@ -385,7 +427,7 @@ async function loadVulnerabilityTab() {
         }
 
         // Sector analysis table
-        const sectors = await fetch('/api/sector-ethical-analysis').then(r => r.json());
+        const sectors = lignes(data['sector-ethical-analysis']);
         if (sectors && sectors.length > 0) {
             const tbody = document.getElementById('sectorAnalysisBody');
             tbody.innerHTML = sectors.map(s => `
@@ -411,7 +453,7 @@ async function loadVulnerabilityTab() {
 
 async function loadActionsTab() {
     try {
-        const categories = await fetch('/api/action-categories').then(r => r.json());
+        const categories = lignes(await fetch('/api/action-categories?format=columns').then(r => r.json()));
         
         if (categories && categories.length > 0) {
             const ctx = document.getElementById('actionCategoriesChart').getContext('2d');
@@ -464,29 +506,140 @@ async function loadActionsTab() {
 // TAB: TIMELINE
 // ============================================================================
 
+let timelineCursor = null;
+let timelineLoaded = false;
+
+document.getElementById('timelineMore').addEventListener('click', loadTimelinePage);
+
 async function loadTimelineTab() {
-    try {
-        const timeline = await fetch('/api/timeline').then(r => r.json());
-        
-        if (timeline && timeline.length > 0) {
-            const list = document.getElementById('timelineList');
-            list.innerHTML = timeline.slice(0, 20).map(t => `
+    timelineCursor = null;
+    document.getElementById('timelineList').innerHTML = '';
+    await loadTimelinePage();
+    timelineLoaded = true;
+}
+
+// Dates en ISO sans fuseau (format colonnes, événements) ; le format HTTP (GMT)
+// des réponses par lignes reste accepté
+function parseTimestamp(t) {
+    if (/^\d{4}-/.test(t) && !/(Z|[+-]\d\d:?\d\d)$/.test(t)) t += 'Z';
+    return new Date(t);
+}
+
+function timelineItemHtml(t) {
+    return `
                 <div class="timeline-item">
-                    <div class="timeline-time">${t.timestamp ? new Date(t.timestamp).toLocaleString('fr-FR') : '-'}</div>
+                    <div class="timeline-time">${t.timestamp ? parseTimestamp(t.timestamp).toLocaleString('fr-FR') : '-'}</div>
                     <div class="timeline-content">
                         <div class="timeline-action">${t.action}</div>
                         <div class="timeline-details">
                             <span>Robot: ${t.nom_robot || 'N/A'}</span>
                             <span>Humain: ${t.nom || 'N/A'}</span>
-                            <span>Résultat: <strong class="result-${t.resultat}">${t.resultat}</strong></span>
+                            <span>Résultat: <strong class="result-${t.resultat}">${libelle('resultat_action', t.resultat)}</strong></span>
                         </div>
                         <div class="timeline-scenario">${t.description || 'Scénario non spécifié'}</div>
                     </div>
                 </div>
-            `).join('');
-        }
+            `;
+}
+
+// Page suivante de la chronologie (pagination par curseur)
+async function loadTimelinePage() {
+    try {
+        let url = '/api/timeline?format=columns&limit=20';
+        if (timelineCursor) url += '&cursor=' + encodeURIComponent(timelineCursor);
+        const page = await fetch(url).then(r => r.json());
+        
+        const list = document.getElementById('timelineList');
+        list.insertAdjacentHTML('beforeend', lignes(page.items).map(timelineItemHtml).join(''));
+
+        timelineCursor = page.next_cursor;
+        document.getElementById('timelineMore').style.display = timelineCursor ? 'block' : 'none';
 
     } catch (error) {
         console.error('Error loading timeline:', error);
     }
 }
+
+// ============================================================================
+// DIRECT : nouvelles actions poussées par /api/events (SSE)
+// ============================================================================
+
+let liveStats = null;
+let livePending = null;
+const TIMELINE_MAX_ITEMS = 200;
+
+function renderStatCards(stats) {
+    document.querySelectorAll('.stat-value')[0].textContent = stats.total_actions || 0;
+    document.querySelectorAll('.stat-value')[1].textContent = (stats.success_rate || 0) + '%';
+    document.querySelectorAll('.stat-value')[2].textContent = stats.active_robots || 0;
+    document.querySelectorAll('.stat-value')[3].textContent = stats.total_scenarios || 0;
+}
+
+// Le serveur envoie au plus un événement par intervalle ; côté navigateur les
+// événements reçus entre deux rendus sont cumulés et appliqués en une fois.
+function startLiveEvents() {
+    if (!window.EventSource) return;
+    const source = new EventSource('/api/events');
+
+    source.addEventListener('actions', e => {
+        const lot = JSON.parse(e.data);
+        if (!livePending) {
+            livePending = { nb: 0, par_resultat: {}, dernieres: [] };
+            requestAnimationFrame(renderLive);
+        }
+        livePending.nb += lot.nb;
+        for (const [resultat, nb] of Object.entries(lot.par_resultat)) {
+            livePending.par_resultat[resultat] = (livePending.par_resultat[resultat] || 0) + nb;
+        }
+        livePending.dernieres = lot.dernieres.concat(livePending.dernieres).slice(0, 20);
+    });
+
+    // événements perdus (client trop lent, reconnexion) : on recharge l'onglet
+    source.addEventListener('resync', () => {
+        livePending = null;
+        const active = document.querySelector('.tab-btn.active');
+        loadTabData(active ? active.dataset.tab : 'overview');
+    });
+}
+
+function renderLive() {
+    const lot = livePending;
+    livePending = null;
+    if (!lot) return;
+
+    if (liveStats) {
+        liveStats.total_actions += lot.nb;
+        liveStats.total_succes += lot.par_resultat['succes'] || 0;
+        liveStats.success_rate = Math.round(10000 * liveStats.total_succes / liveStats.total_actions) / 100;
+        renderStatCards(liveStats);
+    }
+
+    const chart = charts.resultsChart;
+    if (chart) {
+        const dataset = chart.data.datasets[0];
+        for (const [resultat, nb] of Object.entries(lot.par_resultat)) {
+            const i = chart.data.labels.indexOf(libelle('resultat_action', resultat));
+            if (i >= 0) {
+                dataset.data[i] = Number(dataset.data[i]) + nb;
+            } else {
+                chart.data.labels.push(libelle('resultat_action', resultat));
+                dataset.data.push(nb);
+                if (Array.isArray(dataset.backgroundColor)) {
+                    dataset.backgroundColor.push(resultColors[resultat] || colors.info);
+                }
+            }
+        }
+        chart.update('none');
+    }
+
+    if (timelineLoaded && lot.dernieres.length) {
+        const list = document.getElementById('timelineList');
+        list.insertAdjacentHTML('afterbegin', lot.dernieres.map(timelineItemHtml).join(''));
+        if (list.children.length > TIMELINE_MAX_ITEMS) {
+            // la liste est tronquée par le bas : la pagination ne peut plus reprendre
+            while (list.children.length > TIMELINE_MAX_ITEMS) list.lastElementChild.remove();
+            timelineCursor = null;
+            document.getElementById('timelineMore').style.display = 'none';
+        }
+    }
+}
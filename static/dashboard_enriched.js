@@ -57,18 +57,23 @@ async function loadTabData(tab) {
     }
 }
 
+// Charge plusieurs requêtes du dashboard en un seul appel (une connexion, un instantané)
+async function fetchBatch(names) {
+    const response = await fetch('/api/batch?q=' + names.join(','));
+    if (!response.ok) throw new Error('batch ' + response.status);
+    return response.json();
+}
+
 // ============================================================================
 // TAB: OVERVIEW (Aperçu Général)
 // ============================================================================
 
 async function loadOverviewTab() {
     try {
-        const [stats, results, robots, laws] = await Promise.all([
-            fetch('/api/global-stats').then(r => r.json()),
-            fetch('/api/actions-results').then(r => r.json()),
-            fetch('/api/robots-status').then(r => r.json()),
-            fetch('/api/dilemma-success-by-law').then(r => r.json())
-        ]);
+        const data = await fetchBatch(['global-stats', 'actions-results', 'dilemma-success-by-law']);
+        const stats = data['global-stats'];
+        const results = data['actions-results'];
+        const laws = data['dilemma-success-by-law'];
 
         // Update stat cards
         document.querySelector('.stats-grid').innerHTML = `
@@ -136,11 +141,10 @@ async function loadOverviewTab() {
 
 async function loadEthicsTab() {
     try {
-        const [complexity, conflict, timings] = await Promise.all([
-            fetch('/api/ethical-complexity').then(r => r.json()),
-            fetch('/api/law-conflict-analysis').then(r => r.json()),
-            fetch('/api/time-execution-patterns').then(r => r.json())
-        ]);
+        const data = await fetchBatch(['ethical-complexity', 'law-conflict-analysis', 'time-execution-patterns']);
+        const complexity = data['ethical-complexity'];
+        const conflict = data['law-conflict-analysis'];
+        const timings = data['time-execution-patterns'];
 
         // Complexité par loi
         if (complexity && complexity.length > 0) {
@@ -222,10 +226,9 @@ async function loadEthicsTab() {
 
 async function loadRobotsTab() {
     try {
-        const [specialization, maturity] = await Promise.all([
-            fetch('/api/robot-specialization-detailed').then(r => r.json()),
-            fetch('/api/robot-ethical-maturity').then(r => r.json())
-        ]);
+        const data = await fetchBatch(['robot-specialization-detailed', 'robot-ethical-maturity']);
+        const specialization = data['robot-specialization-detailed'];
+        const maturity = data['robot-ethical-maturity'];
 
         // Spécialisation
         if (specialization && specialization.length > 0) {
@@ -289,10 +292,9 @@ async function loadRobotsTab() {
 
 async function loadVulnerabilityTab() {
     try {
-        const [vulnerability, sectors] = await Promise.all([
-            fetch('/api/vulnerability-impact').then(r => r.json()),
-            fetch('/api/sector-ethical-analysis').then(r => r.json())
-        ]);
+        const data = await fetchBatch(['vulnerability-impact', 'sector-ethical-analysis']);
+        const vulnerability = data['vulnerability-impact'];
+        const sectors = data['sector-ethical-analysis'];
 
         // Vulnérabilité impact
         if (vulnerability && vulnerability.length > 0) {
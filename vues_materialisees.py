@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Rafraîchissement des vues matérialisées de queries.sql (suffixe _mat) : une
+vue est rafraîchie quand sa cadence est écoulée ou quand assez d'actions sont
+arrivées depuis le dernier rafraîchissement (colonnes cadence et
+seuil_actions de rafraichissements_vues)
+
+    python vues_materialisees.py               # en continu
+    python vues_materialisees.py --une-fois    # un seul passage, pour cron
+    python vues_materialisees.py --forcer      # rafraîchit toutes les vues
+
+Les rafraîchissements sont concurrents (REFRESH ... CONCURRENTLY) : les
+lecteurs ne sont pas bloqués. Plusieurs planificateurs peuvent tourner, un
+verrou consultatif évite qu'ils rafraîchissent la même vue en même temps.
+"""
+import argparse
+import logging
+import time
+
+import psycopg2
+
+from db import connecter
+
+log = logging.getLogger(__name__)
+
+
+def vues_a_rafraichir(cur, forcer=False):
+    cur.execute("select nom from etat_vues_materialisees where a_rafraichir or %s order by nom",
+                (forcer,))
+    return [nom for nom, in cur.fetchall()]
+
+
+def passage(forcer=False):
+    """Rafraîchit les vues dues ; renvoie [(nom, rafraîchie, durée en s)]"""
+    conn = connecter()
+    try:
+        cur = conn.cursor()
+        noms = vues_a_rafraichir(cur, forcer)
+        conn.commit()
+        faits = []
+        for nom in noms:
+            debut = time.perf_counter()
+            cur.execute("select rafraichir_vue_materialisee(%s)", (nom,))
+            fait = cur.fetchone()[0]
+            conn.commit()
+            faits.append((nom, fait, time.perf_counter() - debut))
+        cur.close()
+        return faits
+    finally:
+        conn.close()
+
+
+def boucle(intervalle):
+    while True:
+        try:
+            for nom, fait, duree in passage():
+                log.info('%s %s en %.2fs', nom, 'rafraîchie' if fait else 'déjà en cours', duree)
+        except psycopg2.Error as error:
+            log.warning('rafraîchissement impossible : %s', error)
+        time.sleep(intervalle)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--intervalle', type=float, default=10,
+                        help='secondes entre deux vérifications (défaut 10)')
+    parser.add_argument('--une-fois', action='store_true', help='un seul passage puis quitte')
+    parser.add_argument('--forcer', action='store_true',
+                        help='rafraîchit toutes les vues, dues ou non (implique --une-fois)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    if args.une_fois or args.forcer:
+        faits = passage(args.forcer)
+        for nom, fait, duree in faits:
+            print(f"   {'✓' if fait else '…'} {nom:34} {duree:8.2f}s")
+        if not faits:
+            print("   vues à jour")
+    else:
+        boucle(args.intervalle)
+
+
+if __name__ == '__main__':
+    main()